@@ -1,27 +1,17 @@
-from zeroconf import ServiceBrowser, Zeroconf, IPVersion
-from time import sleep
+from xthings.discovery import XThingsBrowser
+import anyio
 
 
-def on_service_state_change(zeroconf, service_type, name, state_change):
-    print(service_type, name, state_change)
-    serviceinfo = zeroconf.get_service_info(
-        service_type,
-        name,
-    )
-    print(serviceinfo)
-    print(serviceinfo.parsed_addresses())
+async def main():
+    async with XThingsBrowser(["_xthings._tcp.local."]) as browser:
+        while True:
+            # the services found so far, without browsing again
+            for service in browser.services():
+                print(service.name, service.url, service.properties)
+            await anyio.sleep(5)
 
 
-zeroconf = Zeroconf(ip_version=IPVersion.V4Only)
-
-# Service broswer
-services = ["_xthings._tcp.local."]
-broswer = ServiceBrowser(zeroconf, services, handlers=[on_service_state_change])
-
 try:
-    while True:
-        sleep(0.1)
+    anyio.run(main)
 except KeyboardInterrupt:
     pass
-finally:
-    zeroconf.close()
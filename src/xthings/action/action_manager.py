@@ -15,13 +15,16 @@ import logging
 from pydantic import model_validator
 from collections import deque
 import threading
+import time
 from functools import partial
 
+from .. import profiling
 from ..utils import pathjoin
 from ..errors import InvocationCancelledError
 
 if TYPE_CHECKING:  # pragma: no cover
     from ..descriptors import ActionDescriptor
+    from ..server.xthings_workers import WorkerBridge
     from ..xthing import XThing
 
 
@@ -134,6 +137,7 @@ class Invocation:
         self._status_lock = RLock()
         self._status = InvocationStatus.PENDING
         self._request_time: datetime = datetime.now()
+        self._requested_at = time.perf_counter()
         self._start_time: Optional[datetime] = None
         self._end_time: Optional[datetime] = None
         self._exception: Optional[Exception] = None
@@ -157,6 +161,10 @@ class Invocation:
     def input(self) -> Any:
         return self._input
 
+    @property
+    def status(self) -> InvocationStatus:
+        return self._status
+
     @property
     def output(self) -> Any:
         return self._return_value
@@ -166,7 +174,7 @@ class Invocation:
             self._cancellation_token._event.set()
 
     def response(self, request: Optional[Request] = None):
-        return self._action._invocation_model(
+        return self._action.invocation_model(
             status=self._status,
             id=self.id,
             action=pathjoin(self._xthing.path, self._action.name),
@@ -180,6 +188,13 @@ class Invocation:
         )
 
     def run(self) -> None:
+        if profiling.active_sessions:
+            name = self._action.name
+            profiling.profiled_call("action", self._xthing, name, self._run)
+        else:
+            self._run()
+
+    def _run(self) -> None:
         handler = DequeLogHandler(dest=self._log)
         logger = invocation_logger(self.id)
         logger.addHandler(handler)
@@ -194,6 +209,7 @@ class Invocation:
             self._status = InvocationStatus.RUNNING
             self._start_time = datetime.now()
             event_handle(self._status)
+        started_at = time.perf_counter()
 
         try:
             kwargs = self._input
@@ -224,6 +240,16 @@ class Invocation:
         finally:
             with self._status_lock:
                 self._end_time = datetime.now()
+            metrics = self._xthing._metrics
+            if metrics is not None:
+                labels = (self._xthing.path, self._action.name)
+                metrics.action_queue_wait.observe(
+                    labels, started_at - self._requested_at
+                )
+                metrics.action_run_time.observe(
+                    labels, time.perf_counter() - started_at
+                )
+                metrics.action_outcomes.inc(labels + (self._status.value,))
 
 
 class ActionManager:
@@ -232,6 +258,8 @@ class ActionManager:
     def __init__(self):
         self._invocations = {}
         self._invocations_lock = asyncio.Lock()
+        # in a worker process, the invocations run in the owner process
+        self._remote: Optional[WorkerBridge] = None
 
     async def invoke_action(
         self,
@@ -251,9 +279,17 @@ class ActionManager:
             self._invocations[str(invocation.id).lower()] = invocation
         return invocation
 
+    async def get_invocation(self, id: uuid.UUID | str) -> Optional[Invocation]:
+        async with self._invocations_lock:
+            return self._invocations.get(str(id).lower())
+
     async def list_invocation(
         self, action: Optional[ActionDescriptor] = None, xthing: Optional[XThing] = None
     ):
+        if self._remote is not None:
+            return await self._remote.query_all_actions(
+                xthing, None if action is None else action.name
+            )
         async with self._invocations_lock:
             return [
                 i.response()
@@ -273,6 +309,8 @@ class ActionManager:
 
         # get invocations by id
         async def action_invocation(id: uuid.UUID, request: Request):
+            if self._remote is not None:
+                return await self._remote.query_action(id)
             try:
                 async with self._invocations_lock:
                     return self._invocations[str(id).lower()].response(request=request)
@@ -285,6 +323,9 @@ class ActionManager:
 
         # delete invocation by id
         async def delete_invocation(id: uuid.UUID):
+            if self._remote is not None:
+                await self._remote.cancel_action(id)
+                return
             async with self._invocations_lock:
                 invocation = self._invocations[str(id).lower()]
                 invocation.cancel()
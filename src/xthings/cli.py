@@ -0,0 +1,103 @@
+"""
+The `xthings` command
+
+    xthings serve module:factory [--settings-folder ./settings] [--port 8080] ...
+
+`factory` is a function of `module` which returns the XThingsServer. The server
+settings are read from `server.yaml` in the settings folder, see
+`xthings.server.ServerSettings`, and the command line options override them.
+With more than one worker, the XThings are set up in an owner process and served
+by the worker processes, see `xthings.server.run_workers`.
+"""
+
+from __future__ import annotations
+from typing import Optional, Sequence
+import argparse
+import os
+import sys
+
+from .server.xthings_settings import (
+    SERVER_SETTINGS_ENVIRONMENT_VARIABLE,
+    SETTINGS_FOLDER_ENVIRONMENT_VARIABLE,
+    ServerSettings,
+    load_server_settings,
+)
+
+# command line options which override a server setting
+_OVERRIDES = (
+    "host",
+    "port",
+    "workers",
+    "thread_pool_size",
+    "loop",
+    "http",
+    "backlog",
+    "keep_alive",
+)
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="xthings")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="serve the XThings of a server factory")
+    serve.add_argument("app", help='the "module:factory" returning the XThingsServer')
+    serve.add_argument("--settings-folder", default="./settings")
+    serve.add_argument("--host")
+    serve.add_argument("--port", type=int)
+    serve.add_argument("--workers", type=int)
+    serve.add_argument("--threads", dest="thread_pool_size", type=int)
+    serve.add_argument("--loop", choices=["auto", "asyncio", "uvloop"])
+    serve.add_argument("--http", choices=["auto", "h11", "httptools"])
+    serve.add_argument("--backlog", type=int)
+    serve.add_argument("--keep-alive", dest="keep_alive", type=float)
+    serve.add_argument("--ipc-path", help="the Unix socket of the owner process")
+    return parser
+
+
+def server_settings(arguments: argparse.Namespace) -> ServerSettings:
+    """The settings of the settings folder, overridden by the command line"""
+    os.environ.pop(SERVER_SETTINGS_ENVIRONMENT_VARIABLE, None)
+    settings = load_server_settings(arguments.settings_folder)
+    overrides = {
+        name: getattr(arguments, name)
+        for name in _OVERRIDES
+        if getattr(arguments, name) is not None
+    }
+    return ServerSettings.model_validate({**settings.model_dump(), **overrides})
+
+
+def serve(arguments: argparse.Namespace) -> None:
+    import uvicorn
+
+    from .server import run_workers
+
+    settings = server_settings(arguments)
+    # the servers created by the factory, in this process or in the worker
+    # processes, read the same settings
+    os.environ[SETTINGS_FOLDER_ENVIRONMENT_VARIABLE] = arguments.settings_folder
+    os.environ[SERVER_SETTINGS_ENVIRONMENT_VARIABLE] = settings.model_dump_json()
+    print(f"Serving {arguments.app}")
+    print(settings.describe())
+
+    if settings.workers > 1:
+        run_workers(
+            arguments.app,
+            settings.workers,
+            ipc_path=arguments.ipc_path,
+            **settings.uvicorn_options(),
+        )
+    else:
+        uvicorn.run(arguments.app, factory=True, **settings.uvicorn_options())
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    arguments = _parser().parse_args(argv)
+    # import the app from the current folder, as `uvicorn` does
+    if "" not in sys.path and os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    if arguments.command == "serve":
+        serve(arguments)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
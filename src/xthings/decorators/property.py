@@ -1,37 +1,69 @@
 from functools import wraps, partial
 from pydantic import BaseModel
-from typing import Callable
+from typing import Callable, Optional
 
 from ..descriptors import PropertyDescriptor, LcrudDescriptor
 
 
 def create_xproperty_descriptor(
-    model: type[BaseModel], func: Callable
+    model: type[BaseModel],
+    func: Callable,
+    poll_interval: Optional[float] = None,
+    deadband: Optional[float] = None,
+    history_length: Optional[int] = None,
+    max_concurrency: Optional[int] = None,
 ) -> PropertyDescriptor:
     class PropertyDescriptorSubclass(PropertyDescriptor):
         def __get__(self, obj, objtype=None):
             return super().__get__(obj, objtype)
 
-    descriptor = PropertyDescriptorSubclass(model, None, getter=func)
+    descriptor = PropertyDescriptorSubclass(
+        model,
+        None,
+        getter=func,
+        poll_interval=poll_interval,
+        deadband=deadband,
+        history_length=history_length,
+        max_concurrency=max_concurrency,
+    )
     return descriptor
 
 
 @wraps(create_xproperty_descriptor)
-def xproperty(model: type[BaseModel]):
-    return partial(create_xproperty_descriptor, model)
+def xproperty(
+    model: type[BaseModel],
+    poll_interval: Optional[float] = None,
+    deadband: Optional[float] = None,
+    history_length: Optional[int] = None,
+    max_concurrency: Optional[int] = None,
+):
+    return partial(
+        create_xproperty_descriptor,
+        model,
+        poll_interval=poll_interval,
+        deadband=deadband,
+        history_length=history_length,
+        max_concurrency=max_concurrency,
+    )
 
 
 def create_xlcrud_descriptor(
-    item_model: type[BaseModel], func: Callable
+    item_model: type[BaseModel],
+    func: Callable,
+    max_concurrency: Optional[int] = None,
 ) -> LcrudDescriptor:
     class LcrudDescriptorSubclass(LcrudDescriptor):
         def __get__(self, obj, objtype=None):
             return super().__get__(obj, objtype)
 
-    descriptor = LcrudDescriptorSubclass(item_model, list_func=func)
+    descriptor = LcrudDescriptorSubclass(
+        item_model, list_func=func, max_concurrency=max_concurrency
+    )
     return descriptor
 
 
 @wraps(create_xlcrud_descriptor)
-def xlcrud(item_model: type[BaseModel]):
-    return partial(create_xlcrud_descriptor, item_model)
+def xlcrud(item_model: type[BaseModel], max_concurrency: Optional[int] = None):
+    return partial(
+        create_xlcrud_descriptor, item_model, max_concurrency=max_concurrency
+    )
@@ -1,6 +1,7 @@
 from .xthings import XThingsDescriptor
 from .action import ActionDescriptor
-from .property import PropertyDescriptor, LcrudDescriptor
+from .property import PropertyDescriptor
+from .lcrud import LcrudDescriptor
 from .stream import (
     ImageStream,
     ImageStreamResponse,
@@ -1,7 +1,7 @@
 from __future__ import annotations
 from fastapi import Body, FastAPI, Request, BackgroundTasks
-from functools import partial
-from pydantic import BaseModel
+from functools import lru_cache, partial
+from pydantic import BaseModel, TypeAdapter
 from typing import (
     TYPE_CHECKING,
     Annotated,
@@ -12,10 +12,11 @@ from typing import (
     Union,
     overload,
 )
+import inspect
 import uuid
 import pydantic
 
-from ..action import InvocationModel, CancellationToken
+from ..action import InvocationModel, CancellationToken, Invocation
 
 from ..utils import pathjoin
 
@@ -25,6 +26,25 @@ if TYPE_CHECKING:  # pragma: no cover
     from ..xthing import XThing
 
 
+@lru_cache(maxsize=None)
+def _invocation_model(
+    name: str, input_model: Optional[type], output_model: Optional[type]
+) -> type[InvocationModel]:
+    """The invocation model of the actions with this name and these models
+
+    Actions of different XThing classes share their model, so that FastAPI and
+    the OpenAPI schema process it once.
+    """
+    model = pydantic.create_model(
+        f"{name}_invocation",
+        __base__=InvocationModel,
+        input=(Optional[input_model], None),
+        output=(Optional[output_model], None),
+    )
+    model.__name__ = f"{name}_invocation"
+    return model
+
+
 class ActionDescriptor(XThingsDescriptor):
     def __init__(
         self,
@@ -35,16 +55,11 @@ class ActionDescriptor(XThingsDescriptor):
         self._func = func
         self._input_model = input_model
         self._output_model = output_model
+        self._input_adapter: Optional[TypeAdapter] = None
+        self._invocation_model: Optional[type[InvocationModel]] = None
 
     def __set_name__(self, owner, name: str):
         self._name = name
-        self._invocation_model = pydantic.create_model(
-            f"{self.name}_invocation",
-            __base__=InvocationModel,
-            input=(Optional[self._input_model], None),
-            output=(Optional[self.output_model], None),
-        )
-        self._invocation_model.__name__ = f"{self.name}_invocation"
 
     @overload
     def __get__(self, xthing_obj: Literal[None], type=None) -> ActionDescriptor: ...
@@ -73,6 +88,39 @@ class ActionDescriptor(XThingsDescriptor):
     def output_model(self) -> Optional[type[BaseModel]]:
         return self._output_model
 
+    @property
+    def invocation_model(self) -> type[InvocationModel]:
+        """The model of the invocations of this action, created when first used"""
+        if self._invocation_model is None:
+            try:
+                self._invocation_model = _invocation_model(
+                    self.name, self._input_model, self._output_model
+                )
+            except TypeError:  # unhashable models
+                self._invocation_model = _invocation_model.__wrapped__(
+                    self.name, self._input_model, self._output_model
+                )
+        return self._invocation_model
+
+    def validate_input(self, input: Any) -> Any:
+        """Validate an input given other than by HTTP, raise ValidationError"""
+        if self._input_model is None:
+            return None
+        if self._input_adapter is None:
+            self._input_adapter = TypeAdapter(self._input_model)
+        return self._input_adapter.validate_python(input)
+
+    async def invoke(self, xthing: XThing, input: Any = None) -> Invocation:
+        """Start an invocation of the action in a thread executor"""
+        id = uuid.uuid4()
+        return await xthing.action_manager.invoke_action(
+            action=self,
+            xthing=xthing,
+            input=input,
+            id=id,
+            cancellation_token=CancellationToken(id),
+        )
+
     def emit_changed_event(self, xthing: XThing, value: Any):
         try:
             runner = xthing._blocking_portal
@@ -83,14 +131,7 @@ class ActionDescriptor(XThingsDescriptor):
             ...
 
     async def _emit_changed_event_async(self, xthing: XThing, value: Any):
-        try:
-            for observer in xthing.action_observers(self.name):
-                await observer.send(
-                    {"messageType": "actionStatus", "data": {self.name: value}}
-                )
-        except Exception:
-            # TODO: handle exception
-            ...
+        await xthing.publish_event("actionStatus", self.name, value)
 
     def add_to_app(self, app: FastAPI, xthing: XThing):
         async def list_invocations():
@@ -103,16 +144,9 @@ class ActionDescriptor(XThingsDescriptor):
             background_tasks: BackgroundTasks,
             body: Optional[Any] = None,
         ):
-            # invoke the action in a thread executor
-            id = uuid.uuid4()
-            action = await xthing._action_manager.invoke_action(
-                action=self,
-                xthing=xthing,
-                input=body,
-                id=id,
-                cancellation_token=CancellationToken(id),
-            )
-
+            if xthing._remote is not None:
+                return await xthing._remote.invoke_action(xthing, self.name, body)
+            action = await self.invoke(xthing, body)
             return action.response(request=request)
 
         if self.input_model is not None:
@@ -120,9 +154,36 @@ class ActionDescriptor(XThingsDescriptor):
 
         app.post(
             pathjoin(xthing.path, self.name),
-            response_model=self._invocation_model,
+            response_model=self.invocation_model,
             status_code=201,
         )(start_action)
 
-    def description(self):
-        return {}
+    def description(self, xthing: XThing) -> dict[str, Any]:
+        """The action affordance of the Thing Description"""
+        href = pathjoin(xthing.path, self.name)
+        affordance: dict[str, Any] = {
+            "safe": False,
+            "idempotent": False,
+            "forms": [
+                {
+                    "href": href,
+                    "op": "invokeaction",
+                    "htv:methodName": "POST",
+                    "contentType": "application/json",
+                },
+                {
+                    "href": href,
+                    "op": "queryallactions",
+                    "htv:methodName": "GET",
+                    "contentType": "application/json",
+                },
+            ],
+        }
+        doc = inspect.getdoc(self._func)
+        if doc:
+            affordance["description"] = doc
+        if self._input_model is not None:
+            affordance["input"] = TypeAdapter(self._input_model).json_schema()
+        if self._output_model is not None:
+            affordance["output"] = TypeAdapter(self._output_model).json_schema()
+        return affordance
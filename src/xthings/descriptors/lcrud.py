@@ -0,0 +1,531 @@
+from __future__ import annotations
+from fastapi import Body, FastAPI, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from typing import (
+    TYPE_CHECKING,
+    Annotated,
+    Any,
+    AsyncGenerator,
+    Optional,
+    Callable,
+)
+from typing_extensions import Self
+from weakref import WeakKeyDictionary
+import inspect
+import json
+import logging
+import pydantic
+import uuid
+
+from ..utils import pathjoin, run_handler
+from .xthings import XThingsDescriptor
+
+if TYPE_CHECKING:  # pragma: no cover
+    from ..xthing import XThing
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# query parameters of the collection endpoint which are not field filters
+_COLLECTION_QUERY_PARAMS = ("limit", "cursor")
+
+# the arguments of each function, after the XThing
+_OPERATION_ARGUMENTS = {
+    "list": (),
+    "create": ("item",),
+    "retrieve": ("id",),
+    "update": ("id", "item"),
+    "delete": ("id",),
+}
+_CHANGING_OPERATIONS = ("create", "update", "delete")
+
+
+class BatchItemStatus(BaseModel):
+    """The outcome of one item of a batch request"""
+
+    index: int
+    status: int
+    result: Optional[Any] = None
+    error: Optional[Any] = None
+
+
+def _field_value(item: Any, field: str) -> Any:
+    if isinstance(item, dict):
+        return item.get(field)
+    return getattr(item, field, None)
+
+
+class LcrudDescriptor(XThingsDescriptor):
+    _model: type[BaseModel]
+    _readonly: bool
+
+    def __init__(
+        self,
+        item_model: type,
+        list_func: Callable,
+        create_func: Optional[Callable] = None,
+        retrieve_func: Optional[Callable] = None,
+        update_func: Optional[Callable] = None,
+        delete_func: Optional[Callable] = None,
+        max_concurrency: Optional[int] = None,
+    ):
+        self._model = item_model
+        self._list_func: Callable = list_func
+        self._create_func: Optional[Callable] = create_func or getattr(
+            self, "_create_func", None
+        )
+        self._retrieve_func: Optional[Callable] = retrieve_func or getattr(
+            self, "_retrieve_func", None
+        )
+        self._update_func: Optional[Callable] = update_func or getattr(
+            self, "_update_func", None
+        )
+        self._delete_func: Optional[Callable] = delete_func or getattr(
+            self, "_delete_func", None
+        )
+        self._bulk_create_func: Optional[Callable] = getattr(
+            self, "_bulk_create_func", None
+        )
+        self._bulk_update_func: Optional[Callable] = getattr(
+            self, "_bulk_update_func", None
+        )
+        self._bulk_delete_func: Optional[Callable] = getattr(
+            self, "_bulk_delete_func", None
+        )
+        self._max_concurrency = max_concurrency
+        self._versions: WeakKeyDictionary[XThing, tuple[str, int]] = WeakKeyDictionary()
+        self._batch_adapters: dict[str, TypeAdapter] = {}
+
+    def __set_name__(self, owner, name: str):
+        self._name = name
+
+    def __get__(self, obj, type=None) -> Any:
+        if obj is None:
+            return self
+        else:
+            # The getter is running in an anyio worker thread
+            return self._list_func(obj)
+
+    @property
+    def name(self):
+        return self._name
+
+    def create_func(self, func: Callable) -> Self:
+        self._create_func = func
+        return self
+
+    def retrieve_func(self, func: Callable) -> Self:
+        self._retrieve_func = func
+        return self
+
+    def update_func(self, func: Callable) -> Self:
+        self._update_func = func
+        return self
+
+    def delete_func(self, func: Callable) -> Self:
+        self._delete_func = func
+        return self
+
+    def bulk_create_func(self, func: Callable) -> Self:
+        """Create a list of items in one call, returning one result per item"""
+        self._bulk_create_func = func
+        return self
+
+    def bulk_update_func(self, func: Callable) -> Self:
+        """Update a list of (id, item) pairs in one call"""
+        self._bulk_update_func = func
+        return self
+
+    def bulk_delete_func(self, func: Callable) -> Self:
+        """Delete a list of ids in one call"""
+        self._bulk_delete_func = func
+        return self
+
+    def version(self, xthing: XThing) -> int:
+        """The version of the collection, bumped by every change made through it"""
+        return self._versions.get(xthing, ("", 0))[1]
+
+    def etag(self, xthing: XThing) -> str:
+        if xthing not in self._versions:
+            self._versions[xthing] = (uuid.uuid4().hex[:8], 0)
+        epoch, version = self._versions[xthing]
+        return f'"{epoch}-{version}"'
+
+    def touch(self, xthing: XThing):
+        """Mark the collection as changed
+
+        Create, update and delete requests do this by themselves. Code that changes
+        the collection behind the descriptor must call it, or clients holding an
+        ETag will keep being told that their copy is up to date.
+        """
+        epoch, version = self._versions.get(xthing, (uuid.uuid4().hex[:8], 0))
+        self._versions[xthing] = (epoch, version + 1)
+
+    def select(
+        self,
+        collection: Any,
+        filters: dict[str, str],
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> tuple[Any, Optional[int]]:
+        """Filter and slice a collection returned by the list function
+
+        Collections may be mappings of id to item or sequences of items, the
+        selection has the same type. Filters compare the string representation of
+        item fields. Return the selection and the offset of the next page, if any.
+        """
+        is_mapping = isinstance(collection, dict)
+        entries = list(collection.items()) if is_mapping else list(collection)
+        if filters:
+            entries = [
+                entry
+                for entry in entries
+                if all(
+                    str(_field_value(entry[1] if is_mapping else entry, k)) == v
+                    for k, v in filters.items()
+                )
+            ]
+        next_offset: Optional[int] = None
+        if limit is not None:
+            if offset + limit < len(entries):
+                next_offset = offset + limit
+            entries = entries[offset : offset + limit]
+        elif offset:
+            entries = entries[offset:]
+        return (dict(entries) if is_mapping else entries), next_offset
+
+    def validate_batch(
+        self, adapter: TypeAdapter, body: list[Any]
+    ) -> tuple[dict[int, Any], dict[int, Any]]:
+        """Validate a batch in one pass, return the valid items and the errors
+
+        Both are keyed by the index of the item in the batch.
+        """
+        try:
+            return dict(enumerate(adapter.validate_python(body))), {}
+        except ValidationError as e:
+            errors: dict[int, list] = {}
+            for error in e.errors(include_url=False, include_context=False):
+                errors.setdefault(int(error["loc"][0]), []).append(error)
+        valid = [i for i in range(len(body)) if i not in errors]
+        items = adapter.validate_python([body[i] for i in valid])
+        return dict(zip(valid, items)), errors
+
+    @staticmethod
+    def _apply_each(
+        func: Callable, xthing: XThing, args: list[tuple], ok_status: int
+    ) -> list[tuple[int, Any]]:
+        """Call a per-item function for each entry of a batch
+
+        This runs in a single worker thread hop for the whole batch.
+        """
+        results: list[tuple[int, Any]] = []
+        for a in args:
+            try:
+                results.append((ok_status, func(xthing, *a)))
+            except HTTPException as e:
+                results.append((e.status_code, e.detail))
+            except Exception as e:
+                results.append((500, str(e)))
+        return results
+
+    async def apply_batch(
+        self,
+        xthing: XThing,
+        bulk_func: Optional[Callable],
+        item_func: Optional[Callable],
+        args: list[tuple],
+        ok_status: int,
+    ) -> list[tuple[int, Any]]:
+        """Run a batch through the bulk function, or the per-item one"""
+        limiter = self.capacity_limiter(xthing)
+        if bulk_func is not None:
+            bulk_args = [a[0] if len(a) == 1 else a for a in args]
+            try:
+                results = await run_handler(
+                    bulk_func, xthing, bulk_args, limiter=limiter
+                )
+            except HTTPException as e:
+                return [(e.status_code, e.detail)] * len(args)
+            except Exception as e:
+                return [(500, str(e))] * len(args)
+            if results is None:
+                results = [None] * len(args)
+            results = list(results)
+            if len(results) != len(args):
+                # the results cannot be matched with the items
+                error = (
+                    f"The bulk handler returned {len(results)} results "
+                    f"for {len(args)} items"
+                )
+                logging.error(f"{self.name}: {error}")
+                return [(500, error)] * len(args)
+            return [(ok_status, result) for result in results]
+
+        assert item_func is not None
+        if inspect.iscoroutinefunction(item_func):
+            results = []
+            for a in args:
+                try:
+                    results.append((ok_status, await item_func(xthing, *a)))
+                except HTTPException as e:
+                    results.append((e.status_code, e.detail))
+                except Exception as e:
+                    results.append((500, str(e)))
+            return results
+        return await run_handler(
+            self._apply_each, item_func, xthing, args, ok_status, limiter=limiter
+        )
+
+    async def run_batch(
+        self,
+        xthing: XThing,
+        adapter: TypeAdapter,
+        body: list[Any],
+        bulk_func: Optional[Callable],
+        item_func: Optional[Callable],
+        to_args: Callable[[Any], tuple],
+        ok_status: int,
+    ) -> list[BatchItemStatus]:
+        valid, errors = self.validate_batch(adapter, body)
+        indices = list(valid.keys())
+        statuses = {
+            i: BatchItemStatus(index=i, status=422, error=e) for i, e in errors.items()
+        }
+        if indices:
+            try:
+                results = await self.apply_batch(
+                    xthing,
+                    bulk_func,
+                    item_func,
+                    [to_args(valid[i]) for i in indices],
+                    ok_status,
+                )
+            finally:
+                self.touch(xthing)
+            for i, (status, result) in zip(indices, results):
+                if status < 400:
+                    statuses[i] = BatchItemStatus(index=i, status=status, result=result)
+                else:
+                    statuses[i] = BatchItemStatus(index=i, status=status, error=result)
+        return [statuses[i] for i in range(len(body))]
+
+    async def ndjson_lines(
+        self, selection: Any, chunk_size: int = 256
+    ) -> AsyncGenerator[bytes, None]:
+        """Encode the items of a selection as newline-delimited JSON, in chunks"""
+        entries = (
+            [{k: v} for k, v in selection.items()]
+            if isinstance(selection, dict)
+            else selection
+        )
+        for i in range(0, len(entries), chunk_size):
+            chunk = jsonable_encoder(entries[i : i + chunk_size])
+            yield "".join(json.dumps(entry) + "\n" for entry in chunk).encode()
+
+    async def current_etag(self, xthing: XThing) -> str:
+        """The ETag of the collection, from the owner process in a worker one"""
+        if xthing._remote is not None:
+            return await xthing._remote.call_lcrud(xthing, self.name, "etag", ())
+        return self.etag(xthing)
+
+    async def call(self, xthing: XThing, operation: str, *args) -> Any:
+        """Run the "list", "create", "retrieve", "update" or "delete" function
+
+        `args` are the arguments of the function after the XThing. In a worker
+        process, the function runs in the owner process.
+        """
+        if xthing._remote is not None:
+            return await xthing._remote.call_lcrud(xthing, self.name, operation, args)
+        func = getattr(self, f"_{operation}_func")
+        try:
+            return await run_handler(
+                func, xthing, *args, limiter=self.capacity_limiter(xthing)
+            )
+        finally:
+            if operation in _CHANGING_OPERATIONS:
+                self.touch(xthing)
+
+    def _batch_adapter(self, operation: str) -> TypeAdapter:
+        if operation not in self._batch_adapters:
+            adapter: TypeAdapter
+            if operation == "create":
+                adapter = TypeAdapter(list[self._model])  # type: ignore[name-defined]
+            elif operation == "update":
+                update_entry = pydantic.create_model(
+                    f"{self.name}_batch_update",
+                    id=(uuid.UUID, ...),
+                    item=(self._model, ...),
+                )
+                adapter = TypeAdapter(list[update_entry])
+            else:
+                adapter = TypeAdapter(list[uuid.UUID])
+            self._batch_adapters[operation] = adapter
+        return self._batch_adapters[operation]
+
+    async def batch(
+        self, xthing: XThing, operation: str, body: list[Any]
+    ) -> list[BatchItemStatus]:
+        """Create, update or delete the items of a batch, see `run_batch`
+
+        In a worker process, the batch runs in the owner process.
+        """
+        if xthing._remote is not None:
+            statuses = await xthing._remote.call_lcrud(
+                xthing, self.name, "batch", (operation, body)
+            )
+            return [BatchItemStatus(**status) for status in statuses]
+        adapter = self._batch_adapter(operation)
+        if operation == "create":
+            return await self.run_batch(
+                xthing,
+                adapter,
+                body,
+                self._bulk_create_func,
+                self._create_func,
+                lambda item: (item,),
+                201,
+            )
+        if operation == "update":
+            return await self.run_batch(
+                xthing,
+                adapter,
+                body,
+                self._bulk_update_func,
+                self._update_func,
+                lambda entry: (entry.id, entry.item),
+                200,
+            )
+        return await self.run_batch(
+            xthing,
+            adapter,
+            body,
+            self._bulk_delete_func,
+            self._delete_func,
+            lambda id: (id,),
+            200,
+        )
+
+    async def handle_remote_call(
+        self, xthing: XThing, operation: str, args: list[Any]
+    ) -> Any:
+        """Run a call forwarded by a worker process, validating its arguments
+
+        Raise KeyError for an operation the collection does not support.
+        """
+        if operation == "etag":
+            return self.etag(xthing)
+        if operation == "batch":
+            batch_operation, body = args
+            if batch_operation not in _CHANGING_OPERATIONS:
+                raise KeyError(batch_operation)
+            return await self.batch(xthing, batch_operation, list(body))
+        names = _OPERATION_ARGUMENTS[operation]
+        if getattr(self, f"_{operation}_func") is None or len(args) != len(names):
+            raise KeyError(operation)
+        adapters: dict[str, TypeAdapter] = {
+            "item": TypeAdapter(self._model),
+            "id": TypeAdapter(uuid.UUID),
+        }
+        values = [adapters[n].validate_python(a) for n, a in zip(names, args)]
+        return await self.call(xthing, operation, *values)
+
+    def add_to_app(self, app: FastAPI, xthing: XThing):
+        model_fields = getattr(self._model, "model_fields", {})
+
+        async def get_collection(
+            request: Request,
+            response: Response,
+            limit: Annotated[Optional[int], Query(gt=0)] = None,
+            cursor: Optional[str] = None,
+        ):
+            wants_ndjson = NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+            etag = await self.current_etag(xthing)
+            if wants_ndjson:
+                etag = f"{etag[:-1]}-ndjson{etag[-1]}"
+            headers = {"ETag": etag, "Vary": "Accept"}
+            if request.headers.get("if-none-match") in (etag, "*"):
+                return Response(status_code=304, headers=headers)
+
+            try:
+                offset = int(cursor) if cursor is not None else 0
+                if offset < 0:
+                    raise ValueError(cursor)
+            except ValueError:
+                return Response(status_code=400, content="Bad cursor")
+            filters = {
+                k: v
+                for k, v in request.query_params.items()
+                if k in model_fields and k not in _COLLECTION_QUERY_PARAMS
+            }
+
+            collection = await self.call(xthing, "list")
+            selection, next_offset = self.select(collection, filters, limit, offset)
+            if next_offset is not None:
+                headers["X-Next-Cursor"] = str(next_offset)
+
+            if wants_ndjson:
+                return StreamingResponse(
+                    self.ndjson_lines(selection),
+                    media_type=NDJSON_MEDIA_TYPE,
+                    headers=headers,
+                )
+            response.headers.update(headers)
+            return selection
+
+        app.get(pathjoin(xthing.path, self.name))(get_collection)
+
+        # batch routes go first so that "batch" is not taken for an item id
+        batch_path = pathjoin(xthing.path, self.name) + "/batch"
+        if self._create_func is not None or self._bulk_create_func is not None:
+
+            async def create_items(body: Annotated[list[Any], Body()]):
+                return await self.batch(xthing, "create", body)
+
+            app.post(batch_path, response_model=list[BatchItemStatus])(create_items)
+
+        if self._update_func is not None or self._bulk_update_func is not None:
+
+            async def update_items(body: Annotated[list[Any], Body()]):
+                return await self.batch(xthing, "update", body)
+
+            app.put(batch_path, response_model=list[BatchItemStatus])(update_items)
+
+        if self._delete_func is not None or self._bulk_delete_func is not None:
+
+            async def delete_items(body: Annotated[list[Any], Body()]):
+                return await self.batch(xthing, "delete", body)
+
+            app.delete(batch_path, response_model=list[BatchItemStatus])(delete_items)
+
+        if self._create_func is not None:
+
+            async def create_item(body):
+                return await self.call(xthing, "create", body)
+
+            create_item.__annotations__["body"] = Annotated[self._model, Body()]
+            app.post(pathjoin(xthing.path, self.name))(create_item)
+
+        if self._retrieve_func is not None:
+
+            async def retrieve_item(id: uuid.UUID):
+                return await self.call(xthing, "retrieve", id)
+
+            app.get(pathjoin(xthing.path, self.name) + "/{id}")(retrieve_item)
+
+        if self._update_func is not None:
+
+            async def update_item(id: uuid.UUID, body):
+                return await self.call(xthing, "update", id, body)
+
+            update_item.__annotations__["body"] = Annotated[self._model, Body()]
+            app.put(pathjoin(xthing.path, self.name) + "/{id}")(update_item)
+
+        if self._delete_func is not None:
+
+            async def delete_item(id: uuid.UUID):
+                return await self.call(xthing, "delete", id)
+
+            app.delete(pathjoin(xthing.path, self.name) + "/{id}")(delete_item)
@@ -1,8 +1,8 @@
 from __future__ import annotations
 import anyio
 import anyio.from_thread
-from fastapi import Body, FastAPI
-from pydantic import BaseModel
+from fastapi import Body, FastAPI, Query
+from pydantic import BaseModel, TypeAdapter
 from typing import (
     TYPE_CHECKING,
     Annotated,
@@ -11,112 +11,22 @@ from typing import (
     Callable,
 )
 from typing_extensions import Self
-import uuid
-
-from ..utils import pathjoin
+from weakref import WeakKeyDictionary, WeakSet
+import inspect
+import logging
+import numpy as np
+import time
+
+from .. import profiling
+from ..history import PropertyHistory, PropertyHistoryModel
+from ..utils import pathjoin, run_handler
 from .xthings import XThingsDescriptor
 
 if TYPE_CHECKING:  # pragma: no cover
     from ..xthing import XThing
 
-
-class LcrudDescriptor(XThingsDescriptor):
-    _model: type[BaseModel]
-    _readonly: bool
-
-    def __init__(
-        self,
-        item_model: type,
-        list_func: Callable,
-        create_func: Optional[Callable] = None,
-        retrieve_func: Optional[Callable] = None,
-        update_func: Optional[Callable] = None,
-        delete_func: Optional[Callable] = None,
-    ):
-        self._model = item_model
-        self._list_func: Callable = list_func
-        self._create_func: Optional[Callable] = create_func or getattr(
-            self, "_create_func", None
-        )
-        self._retrieve_func: Optional[Callable] = retrieve_func or getattr(
-            self, "_retrieve_func", None
-        )
-        self._update_func: Optional[Callable] = update_func or getattr(
-            self, "_update_func", None
-        )
-        self._delete_func: Optional[Callable] = delete_func or getattr(
-            self, "_delete_func", None
-        )
-
-    def __set_name__(self, owner, name: str):
-        self._name = name
-
-    def __get__(self, obj, type=None) -> Any:
-        if obj is None:
-            return self
-        else:
-            # The getter is running in an anyio worker thread
-            return self._list_func(obj)
-
-    @property
-    def name(self):
-        return self._name
-
-    def create_func(self, func: Callable) -> Self:
-        self._create_func = func
-        return self
-
-    def retrieve_func(self, func: Callable) -> Self:
-        self._retrieve_func = func
-        return self
-
-    def update_func(self, func: Callable) -> Self:
-        self._update_func = func
-        return self
-
-    def delete_func(self, func: Callable) -> Self:
-        self._delete_func = func
-        return self
-
-    def add_to_app(self, app: FastAPI, xthing: XThing):
-        def get_collection():
-            return self.__get__(xthing)
-
-        app.get(pathjoin(xthing.path, self.name))(get_collection)
-
-        if self._create_func is not None:
-            create_func = self._create_func
-
-            def create_item(body):
-                return create_func(xthing, body)
-
-            create_item.__annotations__["body"] = Annotated[self._model, Body()]
-            app.post(pathjoin(xthing.path, self.name))(create_item)
-
-        if self._retrieve_func is not None:
-            retrieve_func = self._retrieve_func
-
-            def retrieve_item(id: uuid.UUID):
-                return retrieve_func(xthing, id)
-
-            app.get(pathjoin(xthing.path, self.name) + "/{id}")(retrieve_item)
-
-        if self._update_func is not None:
-            update_func = self._update_func
-
-            def update_item(id: uuid.UUID, body):
-                return update_func(xthing, id, body)
-
-            update_item.__annotations__["body"] = Annotated[self._model, Body()]
-            app.put(pathjoin(xthing.path, self.name) + "/{id}")(update_item)
-
-        if self._delete_func is not None:
-            del_func = self._delete_func
-
-            def delete_item(id: uuid.UUID):
-                return del_func(xthing, id)
-
-            app.delete(pathjoin(xthing.path, self.name) + "/{id}")(delete_item)
+# the last value of a property which has not been sampled yet
+_UNSAMPLED = object()
 
 
 class PropertyDescriptor(XThingsDescriptor):
@@ -130,12 +40,25 @@ class PropertyDescriptor(XThingsDescriptor):
         initial_value: Any = None,
         getter: Optional[Callable] = None,
         setter: Optional[Callable] = None,
+        poll_interval: Optional[float] = None,
+        deadband: Optional[float] = None,
+        history_length: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
     ):
         self._model = model
         self._value = initial_value
         self._getter = getter or getattr(self, "_getter", None)
         self._setter = setter or getattr(self, "_setter", None)
         self._readonly = False
+        self._poll_interval = poll_interval
+        self._deadband = deadband
+        self._sampled_xthings: WeakSet[XThing] = WeakSet()
+        self._history_length = history_length
+        self._histories: WeakKeyDictionary[XThing, PropertyHistory] = (
+            WeakKeyDictionary()
+        )
+        self._max_concurrency = max_concurrency
+        self._adapter: Optional[TypeAdapter] = None
 
     def __set_name__(self, owner, name: str):
         self._name = name
@@ -143,21 +66,95 @@ class PropertyDescriptor(XThingsDescriptor):
     def __get__(self, obj, type=None) -> Any:
         if obj is None:
             return self
+        if profiling.active_sessions:
+            return profiling.profiled_call("property", obj, self._name, self._get, obj)
+        return self._get(obj)
 
+    def _get(self, obj) -> Any:
         # The getter is running in an anyio worker thread
         if self._getter:
-            return self._getter(obj)
+            if inspect.iscoroutinefunction(self._getter):
+                value = self._call_from_thread(obj, self._getter)
+            else:
+                value = self._getter(obj)
+        else:
+            value = self._value
+        self._record_read(obj, value)
+        return value
 
-        return self._value
+    def _record_read(self, xthing: XThing, value: Any):
+        # without a poll_interval nothing samples the property, so its history
+        # records the values which are read, as well as the ones written
+        if self._history_length is not None and self._poll_interval is None:
+            self.record_history(xthing, value)
 
     def __set__(self, obj, value):
+        if profiling.active_sessions:
+            profiling.profiled_call("property", obj, self._name, self._set, obj, value)
+        else:
+            self._set(obj, value)
+
+    def _set(self, obj, value):
         self._value = value
         # The setter is running in an anyio worker thread
         if self._setter:
-            self._setter(obj, value)
+            if inspect.iscoroutinefunction(self._setter):
+                self._call_from_thread(obj, self._setter, value)
+            else:
+                self._setter(obj, value)
 
+        self.record_history(obj, value)
         self.emit_changed_event(obj, value)
 
+    def _call_from_thread(self, obj, func: Callable, *args) -> Any:
+        """Run an async getter or setter in the event loop from a worker thread"""
+        portal = getattr(obj, "_blocking_portal", None)
+        if portal is not None:
+            return portal.call(func, obj, *args)
+        return anyio.from_thread.run(func, obj, *args)
+
+    async def aget(self, xthing: XThing) -> Any:
+        """Get the value from the event loop thread
+
+        An async getter is awaited directly, a sync one runs in a worker thread
+        bounded by the capacity limiter of this property. In a worker process,
+        the property is read by the owner process.
+        """
+        if xthing._remote is not None:
+            return await xthing._remote.read_property(xthing, self.name)
+        if self._getter and inspect.iscoroutinefunction(self._getter):
+            value = await self._getter(xthing)
+            self._record_read(xthing, value)
+            return value
+        return await run_handler(
+            self.__get__, xthing, limiter=self.capacity_limiter(xthing)
+        )
+
+    async def aset(self, xthing: XThing, value: Any) -> None:
+        """Set the value from the event loop thread
+
+        An async setter is awaited directly, a sync one runs in a worker thread
+        bounded by the capacity limiter of this property. In a worker process,
+        the property is written by the owner process.
+        """
+        if xthing._remote is not None:
+            return await xthing._remote.write_property(xthing, self.name, value)
+        if self._setter and inspect.iscoroutinefunction(self._setter):
+            self._value = value
+            await self._setter(xthing, value)
+            self.record_history(xthing, value)
+            await self._emit_changed_event_async(xthing, value)
+        else:
+            await run_handler(
+                self.__set__, xthing, value, limiter=self.capacity_limiter(xthing)
+            )
+
+    def validate(self, value: Any) -> Any:
+        """Validate a value written other than by HTTP, raise ValidationError"""
+        if self._adapter is None:
+            self._adapter = TypeAdapter(self._model)
+        return self._adapter.validate_python(value)
+
     def emit_changed_event(self, xthing: XThing, value: Any):
         try:
             anyio.from_thread.run(self._emit_changed_event_async, xthing, value)
@@ -165,33 +162,184 @@ class PropertyDescriptor(XThingsDescriptor):
             return e
 
     async def _emit_changed_event_async(self, xthing: XThing, value: Any):
-        try:
-            for observer in xthing.property_observers(self.name):
-                await observer.send(
-                    {"messageType": "propertyStatus", "data": {self.name: value}}
-                )
-        except Exception:
-            # TODO: handle exception
-            ...
+        await xthing.publish_event("propertyStatus", self.name, value)
 
     @property
     def name(self):
         return self._name
 
+    @property
+    def poll_interval(self) -> Optional[float]:
+        return self._poll_interval
+
+    @property
+    def history_length(self) -> Optional[int]:
+        return self._history_length
+
+    def history(self, xthing: XThing) -> Optional[PropertyHistory]:
+        """The history buffer of this property for the XThing, if enabled"""
+        if self._history_length is None:
+            return None
+        try:
+            return self._histories[xthing]
+        except KeyError:
+            return self._histories.setdefault(
+                xthing, PropertyHistory(self._history_length)
+            )
+        except TypeError:
+            # not a weak-referenceable owner
+            return None
+
+    def record_history(self, xthing: XThing, value: Any):
+        history = self.history(xthing)
+        if history is not None:
+            history.append(value)
+
+    def value_changed(self, old: Any, new: Any) -> bool:
+        """Whether a sampled value differs enough from the last one to be pushed"""
+        if isinstance(old, np.ndarray) or isinstance(new, np.ndarray):
+            return self._array_changed(np.asarray(old), np.asarray(new))
+        if self._deadband is not None:
+            try:
+                return abs(new - old) > self._deadband
+            except TypeError:
+                pass
+        try:
+            return bool(old != new)
+        except ValueError:
+            # e.g. a model holding arrays, which cannot be compared
+            return True
+
+    def _array_changed(self, old: np.ndarray, new: np.ndarray) -> bool:
+        if old.shape != new.shape:
+            return True
+        if self._deadband is not None and old.size > 0:
+            try:
+                difference = new.astype(np.float64) - old.astype(np.float64)
+            except (TypeError, ValueError):
+                pass
+            else:
+                return bool(np.max(np.abs(difference)) > self._deadband)
+        return not np.array_equal(old, new)
+
+    def start_sampling(self, xthing: XThing):
+        """Start sampling the getter of this property for the XThing
+
+        Sampling only happens if a `poll_interval` is configured. It stops by
+        itself once the property has no observers or SSE followers left, unless
+        the property keeps a history, in which case it runs as long as the server.
+        The history of a property which is not sampled records the values read
+        and written.
+        """
+        if self._poll_interval is None or xthing._task_group is None:
+            return
+        if xthing in self._sampled_xthings:
+            return
+        self._sampled_xthings.add(xthing)
+        xthing._task_group.start_soon(self._sample, xthing, self._poll_interval)
+
+    async def _sample(self, xthing: XThing, poll_interval: float):
+        """Push `propertyStatus` events when the sampled value changes
+
+        This method runs in the event loop thread, a sync getter runs in a worker
+        thread.
+        """
+        last: Any = _UNSAMPLED
+        try:
+            while True:
+                try:
+                    value = await self.aget(xthing)
+                    self.record_history(xthing, value)
+                    if last is _UNSAMPLED:
+                        last = value
+                    elif self.value_changed(last, value):
+                        last = value
+                        await self._emit_changed_event_async(xthing, value)
+                except Exception as e:
+                    # a failing getter or event must not stop the server
+                    logging.error(f"Failed to sample property {self.name}: {e}")
+                if not (
+                    self._history_length is not None
+                    or xthing.has_property_observers(self.name)
+                ):
+                    break
+                await anyio.sleep(poll_interval)
+        finally:
+            self._sampled_xthings.discard(xthing)
+
     def add_to_app(self, app: FastAPI, xthing: XThing):
-        def set_property(body):
-            return self.__set__(xthing, body)
+        async def set_property(body):
+            metrics = xthing._metrics
+            if metrics is None:
+                return await self.aset(xthing, body)
+            start = time.perf_counter()
+            try:
+                return await self.aset(xthing, body)
+            finally:
+                metrics.property_latency.observe(
+                    (xthing.path, self.name, "PUT"), time.perf_counter() - start
+                )
 
         set_property.__annotations__["body"] = Annotated[self._model, Body()]
         app.put(pathjoin(xthing.path, self.name), status_code=200)(set_property)
 
         @app.get(pathjoin(xthing.path, self.name), response_model=self._model)
-        def get_property():
-            return self.__get__(xthing)
+        async def get_property():
+            metrics = xthing._metrics
+            if metrics is None:
+                return await self.aget(xthing)
+            start = time.perf_counter()
+            try:
+                return await self.aget(xthing)
+            finally:
+                metrics.property_latency.observe(
+                    (xthing.path, self.name, "GET"), time.perf_counter() - start
+                )
+
+        history = self.history(xthing)
+        if history is not None:
+
+            @app.get(
+                pathjoin(xthing.path, self.name) + "/history",
+                response_model=PropertyHistoryModel,
+            )
+            async def get_property_history(
+                start: Annotated[Optional[float], Query(alias="from")] = None,
+                stop: Annotated[Optional[float], Query(alias="to")] = None,
+                max_points: Annotated[Optional[int], Query(gt=0)] = None,
+            ):
+                return history.query(start, stop, max_points)
 
     def setter(self, func: Callable) -> Self:
         self._setter = func
         return self
 
-    def description(self) -> Any:
-        return {}
+    def description(self, xthing: XThing) -> dict[str, Any]:
+        """The property affordance of the Thing Description"""
+        if self._adapter is None:
+            self._adapter = TypeAdapter(self._model)
+        href = pathjoin(xthing.path, self.name)
+        affordance = {
+            **self._adapter.json_schema(),
+            "readOnly": self._readonly,
+            "observable": True,
+            "forms": [
+                {
+                    "href": href,
+                    "op": ["readproperty", "writeproperty"],
+                    "contentType": "application/json",
+                }
+            ],
+        }
+        doc = inspect.getdoc(self._getter) if self._getter is not None else None
+        if doc:
+            affordance["description"] = doc
+        if self._history_length is not None:
+            affordance["forms"].append(
+                {
+                    "href": href + "/history",
+                    "op": "readproperty",
+                    "contentType": "application/json",
+                }
+            )
+        return affordance
@@ -3,6 +3,7 @@ from fastapi import FastAPI
 from fastapi.responses import HTMLResponse
 from typing import (
     TYPE_CHECKING,
+    Any,
     Optional,
     Literal,
     Union,
@@ -59,8 +60,18 @@ class ImageStreamDescriptor(XThingsDescriptor):
             response_class=HTMLResponse,
         )(self.viewer_page)
 
-    def description(self):
-        return {}
+    def description(self, xthing: XThing) -> dict[str, Any]:
+        """The stream affordance of the Thing Description"""
+        return {
+            "frameContentType": self.get_content_type().decode(),
+            "forms": [
+                {
+                    "href": f"{xthing.path}/{self.name}",
+                    "op": "readproperty",
+                    "contentType": ImageStreamResponse.media_type,
+                }
+            ],
+        }
 
 
 class PngImageStreamDescriptor(ImageStreamDescriptor):
@@ -1,25 +1,69 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
+from anyio import CapacityLimiter
 from fastapi import FastAPI
+from weakref import WeakKeyDictionary
 
 from typing import (
     TYPE_CHECKING,
+    Optional,
 )
 
 if TYPE_CHECKING:  # pragma: no cover
     from ..xthing import XThing
 
+_descriptors_by_class: WeakKeyDictionary[
+    type, tuple[tuple[str, XThingsDescriptor], ...]
+] = WeakKeyDictionary()
+
+
+def is_descriptor(obj: object, kind: type) -> bool:
+    """Whether `obj` is an instance of the descriptor class `kind`
+
+    The decorators create a descriptor class per affordance, and `isinstance`
+    with an ABC walks all its subclasses when it is false, so the MRO is checked
+    instead.
+    """
+    return kind in type(obj).__mro__
+
 
 class XThingsDescriptor(ABC):
+    _name: str
+    _max_concurrency: Optional[int] = None
+
     @classmethod
     def get_xthings_descriptors(cls, obj: XThing):
+        """The descriptors of the class of an XThing, by name
+
+        They are found once per class, by walking the `__dict__` of its bases,
+        rather than for every XThing.
+        """
         objcls = obj.__class__
-        for name in dir(objcls):
-            if name.startswith("__"):
-                continue
-            attr = getattr(objcls, name)
-            if isinstance(attr, XThingsDescriptor):
-                yield name, attr
+        descriptors = _descriptors_by_class.get(objcls)
+        if descriptors is None:
+            found: dict[str, XThingsDescriptor] = {}
+            for klass in reversed(objcls.__mro__):
+                for name, attr in vars(klass).items():
+                    if name.startswith("__"):
+                        continue
+                    if is_descriptor(attr, XThingsDescriptor):
+                        found[name] = attr
+                    else:
+                        # overridden by something else in a subclass
+                        found.pop(name, None)
+            descriptors = tuple(sorted(found.items()))
+            _descriptors_by_class[objcls] = descriptors
+        return iter(descriptors)
+
+    def capacity_limiter(self, xthing: XThing) -> CapacityLimiter:
+        """The limiter for worker threads running sync handlers of this descriptor
+
+        Descriptors with a `max_concurrency` get a limiter of their own, the others
+        share the limiter of the XThing.
+        """
+        if self._max_concurrency is not None:
+            return xthing.capacity_limiter(self._name, self._max_concurrency)
+        return xthing.capacity_limiter()
 
     @abstractmethod
     def add_to_app(self, app: FastAPI, xthing: XThing): ...
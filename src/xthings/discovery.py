@@ -0,0 +1,186 @@
+"""
+Discover XThings servers over mDNS
+
+An `XThingsBrowser` browses the network in the background and keeps a view of
+the services it found, so that looking one up is instant rather than a browse:
+
+    async with XThingsBrowser(["_xthings._tcp.local."]) as browser:
+        camera = await browser.wait_for("camera._xthings._tcp.local.", timeout=5)
+        print(camera.url)
+        print(browser.services())
+
+Services are resolved again before their entry is `ttl` seconds old, and are
+dropped when they are unregistered, or do not answer before the entry expires.
+"""
+
+from __future__ import annotations
+from anyio import (
+    Event,
+    create_memory_object_stream,
+    create_task_group,
+    fail_after,
+    sleep,
+)
+from contextlib import AsyncExitStack
+from pydantic import BaseModel
+from typing import Optional, Sequence
+from zeroconf import InterfaceChoice, IPVersion, ServiceStateChange
+from zeroconf.asyncio import AsyncServiceBrowser, AsyncServiceInfo, AsyncZeroconf
+import logging
+import math
+import time
+
+
+class DiscoveredXThing(BaseModel):
+    name: str
+    service_type: str
+    addresses: list[str]
+    port: int
+    server: Optional[str]
+    properties: dict[str, Optional[str]]
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.addresses[0]}:{self.port}"
+
+
+class XThingsBrowser:
+    """A cached view of the XThings services on the network
+
+    `interfaces` are the IPv4 addresses to browse from, all of them if None.
+    """
+
+    def __init__(
+        self,
+        service_types: Sequence[str] = ("_xthings._tcp.local.",),
+        ttl: float = 60.0,
+        interfaces: Optional[Sequence[str]] = None,
+        resolve_timeout: float = 3.0,
+    ):
+        if ttl <= 0:
+            raise ValueError("ttl must be > 0")
+        self._service_types = list(service_types)
+        self._ttl = ttl
+        self._interfaces = interfaces
+        self._resolve_timeout = resolve_timeout
+        # name -> (service, expiry time)
+        self._services: dict[str, tuple[DiscoveredXThing, float]] = {}
+        self._changed = Event()
+        self._zeroconf: Optional[AsyncZeroconf] = None
+        self._stack: Optional[AsyncExitStack] = None
+
+    async def __aenter__(self) -> XThingsBrowser:
+        async with AsyncExitStack() as stack:
+            zeroconf = AsyncZeroconf(
+                interfaces=(
+                    list(self._interfaces)
+                    if self._interfaces is not None
+                    else InterfaceChoice.All
+                ),
+                ip_version=IPVersion.V4Only,
+            )
+            stack.push_async_callback(zeroconf.async_close)
+            self._zeroconf = zeroconf
+            changes_in, changes_out = create_memory_object_stream[
+                tuple[str, str, ServiceStateChange]
+            ](math.inf)
+            stack.enter_context(changes_in)
+            tg = await stack.enter_async_context(create_task_group())
+            stack.callback(tg.cancel_scope.cancel)
+
+            def on_change(zeroconf, service_type, name, state_change):
+                changes_in.send_nowait((service_type, name, state_change))
+
+            browser = AsyncServiceBrowser(
+                zeroconf.zeroconf, self._service_types, handlers=[on_change]
+            )
+            stack.push_async_callback(browser.async_cancel)
+            tg.start_soon(self._follow_changes, changes_out)
+            tg.start_soon(self._refresh)
+            self._stack = stack.pop_all()
+        return self
+
+    async def __aexit__(self, exc_t, exc_v, exc_tb) -> None:
+        stack, self._stack = self._stack, None
+        if stack is not None:
+            await stack.aclose()
+        self._zeroconf = None
+
+    def services(self, service_type: Optional[str] = None) -> list[DiscoveredXThing]:
+        """The services found, of a type or of all the browsed types"""
+        now = time.monotonic()
+        return [
+            service
+            for service, expiry in self._services.values()
+            if expiry > now
+            and (service_type is None or service.service_type == service_type)
+        ]
+
+    def get(self, name: str) -> Optional[DiscoveredXThing]:
+        """A service found, by its full name"""
+        entry = self._services.get(name)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    async def wait_for(
+        self, name: str, timeout: Optional[float] = None
+    ) -> DiscoveredXThing:
+        """A service, once it is found; raise TimeoutError after `timeout`"""
+        with fail_after(timeout):
+            while (service := self.get(name)) is None:
+                await self._changed.wait()
+        return service
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = Event()
+
+    async def _follow_changes(self, changes) -> None:
+        async with changes, create_task_group() as tg:
+            async for service_type, name, state_change in changes:
+                if state_change == ServiceStateChange.Removed:
+                    if self._services.pop(name, None) is not None:
+                        self._notify()
+                else:
+                    tg.start_soon(self._resolve, service_type, name)
+
+    async def _resolve(self, service_type: str, name: str) -> None:
+        if self._zeroconf is None:
+            return
+        info = AsyncServiceInfo(service_type, name)
+        try:
+            found = await info.async_request(
+                self._zeroconf.zeroconf, self._resolve_timeout * 1000
+            )
+        except Exception as e:
+            logging.debug(f"Failed to resolve {name}: {e!r}")
+            return
+        if not found or info.port is None:
+            return
+        service = DiscoveredXThing(
+            name=name,
+            service_type=service_type,
+            addresses=info.parsed_addresses(),
+            port=info.port,
+            server=info.server,
+            properties={
+                key.decode(): None if value is None else value.decode()
+                for key, value in info.properties.items()
+            },
+        )
+        self._services[name] = (service, time.monotonic() + self._ttl)
+        self._notify()
+
+    async def _refresh(self) -> None:
+        """Resolve the services again before they expire, drop expired ones"""
+        async with create_task_group() as tg:
+            while True:
+                await sleep(self._ttl / 4)
+                now = time.monotonic()
+                for name, (service, expiry) in list(self._services.items()):
+                    if expiry <= now:
+                        del self._services[name]
+                        self._notify()
+                    elif expiry - now < self._ttl / 2:
+                        tg.start_soon(self._resolve, service.service_type, name)
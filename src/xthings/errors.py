@@ -1,2 +1,23 @@
+from typing import Optional
+
+
 class InvocationCancelledError(Exception):
     pass
+
+
+class RemoteInteractionError(Exception):
+    """An interaction forwarded to the owner process of the XThings failed
+
+    `status_code` is the one of an HTTPException raised in the owner process.
+    """
+
+    def __init__(
+        self,
+        error_message: str,
+        detail: object = None,
+        status_code: Optional[int] = None,
+    ):
+        super().__init__(f"{error_message}: {detail}" if detail else error_message)
+        self.error_message = error_message
+        self.detail = detail
+        self.status_code = status_code
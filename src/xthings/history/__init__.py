@@ -0,0 +1,6 @@
+from .property_history import PropertyHistory, PropertyHistoryModel
+
+__all__ = [
+    "PropertyHistory",
+    "PropertyHistoryModel",
+]
@@ -0,0 +1,108 @@
+from pydantic import BaseModel
+from typing import Any, Optional
+import numpy as np
+import threading
+import time
+
+
+class PropertyHistoryModel(BaseModel):
+    """Downsampled time series of a property, one entry per bucket"""
+
+    timestamps: list[float]
+    min: list[float]
+    max: list[float]
+    mean: list[float]
+    count: list[int]
+
+
+class PropertyHistory:
+    """A bounded ring buffer of timestamped numeric property values
+
+    Values are written from worker threads and read from the event loop, so the
+    buffer is guarded by a lock. Non-numeric values are ignored.
+    """
+
+    def __init__(self, maxlen: int):
+        if maxlen <= 0:
+            raise ValueError("maxlen must be > 0")
+        self._lock = threading.Lock()
+        self._maxlen = maxlen
+        self._timestamps = np.zeros(maxlen, dtype=np.float64)
+        self._values = np.zeros(maxlen, dtype=np.float64)
+        self._n_appended = 0
+
+    @property
+    def maxlen(self) -> int:
+        return self._maxlen
+
+    def __len__(self) -> int:
+        return min(self._n_appended, self._maxlen)
+
+    def append(self, value: Any, timestamp: Optional[float] = None) -> bool:
+        """Record a value, return False if it is not numeric"""
+        try:
+            v = float(value)
+        except (TypeError, ValueError):
+            return False
+        with self._lock:
+            # timestamped under the lock, so that they are in the order of the
+            # ring even when threads append concurrently
+            t = time.time() if timestamp is None else timestamp
+            i = self._n_appended % self._maxlen
+            self._timestamps[i] = t
+            self._values[i] = v
+            self._n_appended += 1
+        return True
+
+    def snapshot(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return copies of the timestamps and values, oldest first"""
+        with self._lock:
+            if self._n_appended <= self._maxlen:
+                n = self._n_appended
+                return self._timestamps[:n].copy(), self._values[:n].copy()
+            i = self._n_appended % self._maxlen
+            return (
+                np.concatenate((self._timestamps[i:], self._timestamps[:i])),
+                np.concatenate((self._values[i:], self._values[:i])),
+            )
+
+    def query(
+        self,
+        start: Optional[float] = None,
+        stop: Optional[float] = None,
+        max_points: Optional[int] = None,
+    ) -> PropertyHistoryModel:
+        """Return the values between `start` and `stop`
+
+        If there are more than `max_points` values, they are grouped into
+        `max_points` equal time buckets and each non-empty bucket is reduced to
+        its mean timestamp and the min, max and mean of its values.
+        """
+        timestamps, values = self.snapshot()
+        lo = 0 if start is None else int(np.searchsorted(timestamps, start, "left"))
+        hi = (
+            len(timestamps)
+            if stop is None
+            else int(np.searchsorted(timestamps, stop, "right"))
+        )
+        timestamps, values = timestamps[lo:hi], values[lo:hi]
+
+        if max_points is None or len(values) <= max_points:
+            return PropertyHistoryModel(
+                timestamps=timestamps.tolist(),
+                min=values.tolist(),
+                max=values.tolist(),
+                mean=values.tolist(),
+                count=[1] * len(values),
+            )
+
+        bucket_starts = np.linspace(timestamps[0], timestamps[-1], max_points + 1)
+        edges = np.unique(np.searchsorted(timestamps, bucket_starts[:-1], "left"))
+        counts = np.diff(np.append(edges, len(values)))
+        return PropertyHistoryModel(
+            timestamps=(np.add.reduceat(timestamps, edges) / counts).tolist(),
+            min=np.minimum.reduceat(values, edges).tolist(),
+            max=np.maximum.reduceat(values, edges).tolist(),
+            mean=(np.add.reduceat(values, edges) / counts).tolist(),
+            count=counts.tolist(),
+        )
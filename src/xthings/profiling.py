@@ -0,0 +1,284 @@
+"""
+Profile a running server for a time window, without restarting it
+
+A profiling session is started by a request to the admin endpoints of the
+server, see `XThingsServer`. It is scoped to the whole process, or to the calls
+of one action or one property (getter and setter) of an XThing, and either:
+* samples the stacks of the threads every `interval` seconds, which is cheap
+  enough for production, and writes them in the folded format of flame graphs
+  (`<id>.folded`, for flamegraph.pl, speedscope, ...), or
+* profiles deterministically with cProfile, and writes a pstats file
+  (`<id>.prof`, for `python -m pstats`, snakeviz, ...).
+
+Either way, the calls of `Invocation.run` and `PropertyDescriptor.__get__` /
+`__set__` which are in scope are timed, and summed up in `<id>.calls.json`.
+When no session is running, these cost a check of an empty list.
+"""
+
+from __future__ import annotations
+from anyio import CancelScope, sleep, to_thread
+from collections import Counter
+from datetime import datetime
+from enum import Enum
+from pydantic import BaseModel, Field, model_validator
+from typing import TYPE_CHECKING, Any, Callable, Optional
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .xthing import XThing
+
+# the sessions which are running, checked by the profiling hooks
+active_sessions: list[ProfilingSession] = []
+
+_local = threading.local()
+
+
+class ProfilingMode(str, Enum):
+    SAMPLING = "sampling"
+    DETERMINISTIC = "deterministic"
+
+
+class ProfilingScope(str, Enum):
+    PROCESS = "process"
+    ACTION = "action"
+    PROPERTY = "property"
+
+
+class ProfilingRequest(BaseModel):
+    mode: ProfilingMode = ProfilingMode.SAMPLING
+    scope: ProfilingScope = ProfilingScope.PROCESS
+    xthing: Optional[str] = Field(None, description="The path of the XThing")
+    name: Optional[str] = Field(None, description="The action or property")
+    duration: float = Field(10.0, gt=0, le=600)
+    interval: float = Field(0.005, gt=0, le=1, description="Sampling interval")
+
+    @model_validator(mode="after")
+    def check_target(self) -> ProfilingRequest:
+        if self.scope != ProfilingScope.PROCESS and (
+            self.xthing is None or self.name is None
+        ):
+            raise ValueError(f"A {self.scope.value} scope needs an xthing and a name")
+        return self
+
+
+class CallTiming(BaseModel):
+    kind: str
+    xthing: str
+    name: str
+    calls: int
+    total_seconds: float
+    max_seconds: float
+
+
+class ProfilingReport(BaseModel):
+    id: str
+    request: ProfilingRequest
+    state: str
+    started: datetime
+    finished: Optional[datetime]
+    files: list[str]
+    calls: list[CallTiming]
+    error: Optional[str]
+
+
+class ProfilingSession:
+    """A profiling session, see the module documentation"""
+
+    def __init__(self, request: ProfilingRequest, folder: str):
+        self.id = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        self.request = request
+        self._folder = folder
+        self._state = "running"
+        self._started = datetime.now()
+        self._finished: Optional[datetime] = None
+        self._files: list[str] = []
+        self._error: Optional[str] = None
+        self._lock = threading.Lock()
+        # (kind, xthing, name) -> [calls, total seconds, max seconds]
+        self._timings: dict[tuple[str, str, str], list] = {}
+        self._profiles: list[cProfile.Profile] = []
+        # the threads in calls in scope, with their nesting depth
+        self._threads: Counter[int] = Counter()
+        self._stacks: Counter[str] = Counter()
+        self._stop_sampling = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._state == "running"
+
+    def report(self) -> ProfilingReport:
+        return ProfilingReport(
+            id=self.id,
+            request=self.request,
+            state=self._state,
+            started=self._started,
+            finished=self._finished,
+            files=list(self._files),
+            calls=[
+                CallTiming(
+                    kind=kind,
+                    xthing=xthing,
+                    name=name,
+                    calls=calls,
+                    total_seconds=total,
+                    max_seconds=longest,
+                )
+                for (kind, xthing, name), (calls, total, longest) in list(
+                    self._timings.items()
+                )
+            ],
+            error=self._error,
+        )
+
+    def in_scope(self, kind: str, xthing: str, name: str) -> bool:
+        request = self.request
+        if request.scope == ProfilingScope.PROCESS:
+            return True
+        return (
+            request.scope.value == kind
+            and request.xthing == xthing
+            and request.name == name
+        )
+
+    def enter(self, profile: bool) -> Optional[cProfile.Profile]:
+        """Start profiling a call in scope, in the current thread"""
+        with self._lock:
+            self._threads[threading.get_ident()] += 1
+        if not profile or self.request.mode != ProfilingMode.DETERMINISTIC:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is active in this thread
+            return None
+        return profiler
+
+    def exit(
+        self,
+        key: tuple[str, str, str],
+        seconds: float,
+        profiler: Optional[cProfile.Profile],
+    ) -> None:
+        if profiler is not None:
+            profiler.disable()
+        with self._lock:
+            ident = threading.get_ident()
+            self._threads[ident] -= 1
+            if self._threads[ident] <= 0:
+                del self._threads[ident]
+            if profiler is not None:
+                self._profiles.append(profiler)
+            timing = self._timings.setdefault(key, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        process = self.request.scope == ProfilingScope.PROCESS
+        while not self._stop_sampling.wait(self.request.interval):
+            with self._lock:
+                threads = set(self._threads)
+            for ident, frame in sys._current_frames().items():
+                if ident == own or not (process or ident in threads):
+                    continue
+                stack = []
+                f: Any = frame
+                while f is not None:
+                    code = f.f_code
+                    stack.append(
+                        f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                    )
+                    f = f.f_back
+                self._stacks[";".join(reversed(stack))] += 1
+
+    async def run(self) -> None:
+        """Profile for the requested duration, then write the profile files"""
+        sampler: Optional[threading.Thread] = None
+        loop_profiler: Optional[cProfile.Profile] = None
+        try:
+            if self.request.mode == ProfilingMode.SAMPLING:
+                sampler = threading.Thread(
+                    target=self._sample, name=f"profiling-{self.id}", daemon=True
+                )
+                sampler.start()
+            elif self.request.scope == ProfilingScope.PROCESS:
+                # the event loop thread, the calls in worker threads are
+                # profiled by the hooks
+                loop_profiler = cProfile.Profile()
+                loop_profiler.enable()
+                _local.profiling = True
+            active_sessions.append(self)
+            await sleep(self.request.duration)
+        except Exception as e:
+            self._error = repr(e)
+        finally:
+            if self in active_sessions:
+                active_sessions.remove(self)
+            if loop_profiler is not None:
+                loop_profiler.disable()
+                _local.profiling = False
+                self._profiles.append(loop_profiler)
+            self._stop_sampling.set()
+            if sampler is not None:
+                sampler.join()
+            # the files are written even if the server is shutting down
+            with CancelScope(shield=True):
+                await to_thread.run_sync(self._write)
+
+    def _write(self) -> None:
+        try:
+            os.makedirs(self._folder, exist_ok=True)
+            base = os.path.join(self._folder, self.id)
+            if self._stacks:
+                with open(base + ".folded", "w") as f:
+                    for stack, count in self._stacks.most_common():
+                        f.write(f"{stack} {count}\n")
+                self._files.append(base + ".folded")
+            if self._profiles:
+                stats = pstats.Stats(self._profiles[0])
+                for profiler in self._profiles[1:]:
+                    stats.add(profiler)
+                stats.dump_stats(base + ".prof")
+                self._files.append(base + ".prof")
+            with open(base + ".calls.json", "w") as f:
+                f.write(self.report().model_dump_json(include={"calls"}, indent=2))
+            self._files.append(base + ".calls.json")
+        except Exception as e:
+            self._error = repr(e)
+            self._state = "failed"
+        else:
+            self._state = "failed" if self._error else "finished"
+        self._finished = datetime.now()
+
+
+def profiled_call(
+    kind: str, xthing: XThing, name: str, func: Callable, *args: Any
+) -> Any:
+    """Call `func`, timed and profiled by the sessions which have it in scope"""
+    if not active_sessions:
+        return func(*args)
+    path = getattr(xthing, "_path", "")
+    sessions = [s for s in list(active_sessions) if s.in_scope(kind, path, name)]
+    if not sessions:
+        return func(*args)
+    # cProfile cannot nest in a thread: the outermost call is profiled
+    profile = not getattr(_local, "profiling", False)
+    _local.profiling = True
+    profilers = [s.enter(profile) for s in sessions]
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        seconds = time.perf_counter() - start
+        for session, profiler in zip(sessions, profilers):
+            session.exit((kind, path, name), seconds, profiler)
+        if profile:
+            _local.profiling = False
@@ -1,5 +1,50 @@
 from .xthings_server import XThingsServer
-from .xthings_websocket import websocket_endpoint, WebSocket
-from .xthings_zeroconf import run_mdns_in_executor
+from .xthings_websocket import (
+    websocket_endpoint,
+    multiplexed_websocket_endpoint,
+    WebSocket,
+)
+from .xthings_zeroconf import MdnsRegistration
+from .xthings_events import EventMessage
+from .xthings_subscriber import OverflowPolicy, SubscriberQueue, SubscriberStatistics
+from .xthings_subscriptions import SubscriptionRegistry, Topic, WILDCARD
+from .xthings_sse import EventLog, sse_response
+from .xthings_sessions import SessionStore, WebSocketSession
+from .xthings_heartbeat import Heartbeat, HeartbeatStatistics
+from .xthings_metrics import XThingsMetrics
+from .xthings_settings import ServerSettings, load_server_settings
+from .xthings_settings_store import ObservedSettings, SettingsStore
+from .xthings_startup import StartupState, XThingStartup
+from .xthings_workers import OwnerBridge, ServerRole, WorkerBridge, run_workers
 
-__all__ = ["XThingsServer", "websocket_endpoint", "WebSocket", "run_mdns_in_executor"]
+__all__ = [
+    "XThingsServer",
+    "websocket_endpoint",
+    "multiplexed_websocket_endpoint",
+    "WebSocket",
+    "MdnsRegistration",
+    "EventMessage",
+    "OverflowPolicy",
+    "SubscriberQueue",
+    "SubscriberStatistics",
+    "SubscriptionRegistry",
+    "Topic",
+    "WILDCARD",
+    "EventLog",
+    "sse_response",
+    "SessionStore",
+    "WebSocketSession",
+    "Heartbeat",
+    "HeartbeatStatistics",
+    "XThingsMetrics",
+    "OwnerBridge",
+    "ServerRole",
+    "WorkerBridge",
+    "run_workers",
+    "ServerSettings",
+    "load_server_settings",
+    "ObservedSettings",
+    "SettingsStore",
+    "StartupState",
+    "XThingStartup",
+]
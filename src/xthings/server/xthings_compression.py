@@ -0,0 +1,152 @@
+"""
+Compress the responses of the server with gzip or deflate
+
+Unlike a plain gzip middleware, this one leaves alone the responses which must
+reach the client as they are produced, or gain nothing from compression: the
+`multipart/x-mixed-replace` image streams, Server-Sent Events, images, and
+responses which are compressed already, e.g. the Thing Descriptions.
+"""
+
+from __future__ import annotations
+from starlette.datastructures import Headers, MutableHeaders
+from typing import Any, Callable, Optional
+import zlib
+
+from .xthings_settings import CompressionRoute, CompressionSettings
+
+# wbits of zlib.compressobj
+_WBITS = {"gzip": 31, "deflate": 15}
+
+_COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+def is_compressible(content_type: str) -> bool:
+    media_type = content_type.partition(";")[0].strip().lower()
+    if media_type == "text/event-stream":
+        return False
+    return (
+        media_type.startswith("text/")
+        or media_type.endswith(("+json", "+xml"))
+        or media_type in _COMPRESSIBLE_TYPES
+    )
+
+
+def preferred_encoding(accept_encoding: str) -> Optional[str]:
+    """gzip or deflate, whichever the Accept-Encoding header prefers"""
+    best: Optional[str] = None
+    best_q = 0.0
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        name = name.strip().lower()
+        if name == "*":
+            name = "gzip"
+        if name not in _WBITS:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                continue
+        # gzip wins a tie, as deflate is implemented inconsistently by clients
+        if q > best_q or (q > 0 and q == best_q and name == "gzip"):
+            best, best_q = name, q
+    return best
+
+
+class CompressionMiddleware:
+    """Compress the text and JSON responses which are large enough"""
+
+    def __init__(self, app, settings: Callable[[], CompressionSettings]):
+        self.app = app
+        self.settings = settings
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = self.settings().route(scope["path"])
+        encoding = None
+        if route.enabled:
+            encoding = preferred_encoding(
+                Headers(scope=scope).get("accept-encoding", "")
+            )
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _CompressingResponder(send, encoding, route)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressingResponder:
+    def __init__(self, send, encoding: str, route: CompressionRoute):
+        self._send = send
+        self._encoding = encoding
+        self._minimum_size = route.minimum_size or 0
+        self._level = route.level or 6
+        self._start: Optional[dict] = None
+        self._compressor: Any = None
+        self._passthrough = False
+
+    async def send(self, message: dict) -> None:
+        if self._passthrough:
+            await self._send(message)
+            return
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            if (
+                message["status"] in (204, 304)
+                or "content-encoding" in headers
+                or not is_compressible(headers.get("content-type", ""))
+            ):
+                self._passthrough = True
+                await self._send(message)
+            else:
+                # wait for the first body chunk to decide
+                self._start = message
+            return
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self._compressor is None:
+            if self._start is None:
+                await self._send(message)
+                return
+            start, self._start = self._start, None
+            if not more_body and len(body) < max(self._minimum_size, 1):
+                self._passthrough = True
+                await self._send(start)
+                await self._send(message)
+                return
+            self._compressor = zlib.compressobj(
+                self._level, zlib.DEFLATED, _WBITS[self._encoding]
+            )
+            headers = MutableHeaders(raw=start["headers"])
+            headers["Content-Encoding"] = self._encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                # a streaming response: each chunk is flushed as it comes
+                if "content-length" in headers:
+                    del headers["Content-Length"]
+            else:
+                body = self._compressor.compress(body) + self._compressor.flush()
+                headers["Content-Length"] = str(len(body))
+                await self._send(start)
+                await self._send({"type": "http.response.body", "body": body})
+                return
+            await self._send(start)
+
+        flush_mode = zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH
+        body = self._compressor.compress(body) + self._compressor.flush(flush_mode)
+        await self._send(
+            {"type": "http.response.body", "body": body, "more_body": more_body}
+        )
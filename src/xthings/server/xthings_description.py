@@ -0,0 +1,73 @@
+"""
+Serve the Thing Description of an XThing from an encoded copy
+
+Discovery tools fetch the Thing Descriptions of every XThing over and over. The
+description is encoded and gzipped once, and served with an ETag, so that a
+request costs a dictionary lookup, or nothing but a 304 Not Modified.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from fastapi import Request, Response
+from typing import Any
+import gzip
+import hashlib
+import json
+
+TD_MEDIA_TYPE = "application/td+json"
+
+
+@dataclass(frozen=True)
+class EncodedDescription:
+    body: bytes
+    gzipped: bytes
+    etag: str
+
+    @classmethod
+    def encode(cls, description: dict[str, Any]) -> EncodedDescription:
+        body = json.dumps(description, separators=(",", ":")).encode()
+        return cls(
+            body=body,
+            # mtime=0 keeps the compressed copy identical across restarts
+            gzipped=gzip.compress(body, compresslevel=9, mtime=0),
+            etag=f'"{hashlib.sha1(body).hexdigest()[:20]}"',
+        )
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip, e.g. "gzip, br;q=0.5" """
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() not in ("gzip", "*"):
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match header lists the ETag, weakly compared"""
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(",")
+    )
+
+
+def description_response(request: Request, encoded: EncodedDescription) -> Response:
+    headers = {
+        "ETag": encoded.etag,
+        "Vary": "Accept-Encoding",
+        "Cache-Control": "no-cache",
+    }
+    if etag_matches(request.headers.get("if-none-match", ""), encoded.etag):
+        return Response(status_code=304, headers=headers)
+    if accepts_gzip(request.headers.get("accept-encoding", "")):
+        headers["Content-Encoding"] = "gzip"
+        return Response(encoded.gzipped, media_type=TD_MEDIA_TYPE, headers=headers)
+    return Response(encoded.body, media_type=TD_MEDIA_TYPE, headers=headers)
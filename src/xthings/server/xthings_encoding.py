@@ -0,0 +1,240 @@
+"""
+Encode messages for the wire
+
+JSON is the default websocket encoding, using orjson when it is installed. Clients
+may negotiate a binary subprotocol instead, MessagePack or CBOR, if the matching
+package is installed. Binary encodings carry NumPy arrays as typed binary
+payloads rather than lists of numbers:
+* MessagePack: extension type 1 wrapping [dtype string, shape, raw bytes]
+* CBOR: RFC 8746 typed array tags, wrapped in tag 40 (multi-dimensional array)
+  if the array is not one-dimensional
+"""
+
+from __future__ import annotations
+from datetime import date, datetime, time
+from enum import Enum
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from typing import Any, Callable, Optional, Union
+import json
+import numpy as np
+import uuid
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None  # type: ignore[assignment]
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover
+    cbor2 = None  # type: ignore[assignment]
+
+
+MSGPACK_NDARRAY_EXT = 1
+
+# RFC 8746 tags of little-endian typed arrays, by NumPy dtype
+CBOR_TYPED_ARRAY_TAGS: dict[np.dtype, int] = {
+    np.dtype("uint8"): 64,
+    np.dtype("<u2"): 69,
+    np.dtype("<u4"): 70,
+    np.dtype("<u8"): 71,
+    np.dtype("int8"): 72,
+    np.dtype("<i2"): 77,
+    np.dtype("<i4"): 78,
+    np.dtype("<i8"): 79,
+    np.dtype("<f2"): 84,
+    np.dtype("<f4"): 85,
+    np.dtype("<f8"): 86,
+}
+CBOR_TYPED_ARRAY_DTYPES = {tag: dtype for dtype, tag in CBOR_TYPED_ARRAY_TAGS.items()}
+CBOR_MULTI_DIMENSIONAL_ARRAY_TAG = 40
+
+
+def _orjson_default(obj: Any) -> Any:
+    if isinstance(obj, np.ndarray):
+        # e.g. an array which is not C-contiguous, or of an unsupported dtype
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    encoded = jsonable_encoder(obj)
+    if encoded is obj:
+        raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+    return encoded
+
+
+def encode_json(obj: Any) -> bytes:
+    """Encode an object, which may contain pydantic models, as compact JSON
+
+    Dictionary keys which are not strings are converted, as `json` does.
+    """
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        try:
+            return orjson.dumps(obj, default=_orjson_default, option=option)
+        except TypeError:
+            # what orjson does not know, e.g. keys of other types
+            return orjson.dumps(
+                jsonable_encoder(obj), default=_orjson_default, option=option
+            )
+    return json.dumps(jsonable_encoder(obj), separators=(",", ":")).encode()
+
+
+def to_primitive(obj: Any) -> Any:
+    """Convert an object to types binary encoders understand, keeping arrays"""
+    if isinstance(obj, (str, int, float, bool, bytes, np.ndarray)) or obj is None:
+        if isinstance(obj, Enum):
+            return obj.value
+        return obj
+    if isinstance(obj, BaseModel):
+        return to_primitive(obj.model_dump())
+    if isinstance(obj, dict):
+        return {str(k): to_primitive(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return [to_primitive(v) for v in obj]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, Enum):
+        return to_primitive(obj.value)
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    return jsonable_encoder(obj)
+
+
+def _little_endian(array: np.ndarray) -> np.ndarray:
+    if array.dtype.byteorder == ">":
+        array = array.astype(array.dtype.newbyteorder("<"))
+    return np.ascontiguousarray(array)
+
+
+def _msgpack_default(obj: Any) -> Any:
+    if isinstance(obj, np.ndarray):
+        array = _little_endian(obj)
+        payload = msgpack.packb(
+            [array.dtype.str, list(array.shape), array.tobytes()], use_bin_type=True
+        )
+        return msgpack.ExtType(MSGPACK_NDARRAY_EXT, payload)
+    raise TypeError(f"Type is not MessagePack serializable: {type(obj).__name__}")
+
+
+def _msgpack_ext_hook(code: int, data: bytes) -> Any:
+    if code == MSGPACK_NDARRAY_EXT:
+        dtype, shape, buffer = msgpack.unpackb(data, raw=False)
+        return np.frombuffer(buffer, dtype=np.dtype(dtype)).reshape(shape)
+    return msgpack.ExtType(code, data)
+
+
+def encode_msgpack(obj: Any) -> bytes:
+    return msgpack.packb(to_primitive(obj), default=_msgpack_default)
+
+
+def decode_msgpack(data: Union[bytes, str]) -> Any:
+    if isinstance(data, str):
+        data = data.encode()
+    return msgpack.unpackb(data, ext_hook=_msgpack_ext_hook, raw=False)
+
+
+def _cbor_default(encoder: Any, obj: Any) -> None:
+    if isinstance(obj, np.ndarray):
+        array = _little_endian(obj)
+        if array.dtype not in CBOR_TYPED_ARRAY_TAGS:
+            encoder.encode(array.tolist())
+            return
+        typed = cbor2.CBORTag(CBOR_TYPED_ARRAY_TAGS[array.dtype], array.tobytes())
+        if array.ndim == 1:
+            encoder.encode(typed)
+        else:
+            shape = list(array.shape)
+            encoder.encode(
+                cbor2.CBORTag(CBOR_MULTI_DIMENSIONAL_ARRAY_TAG, [shape, typed])
+            )
+        return
+    raise TypeError(f"Type is not CBOR serializable: {type(obj).__name__}")
+
+
+def _cbor_tag_hook(*args: Any) -> Any:
+    # cbor2 5 calls tag_hook(decoder, tag), cbor2 6 calls tag_hook(tag, immutable)
+    tag = next(arg for arg in args if isinstance(arg, cbor2.CBORTag))
+    if tag.tag in CBOR_TYPED_ARRAY_DTYPES:
+        return np.frombuffer(tag.value, dtype=CBOR_TYPED_ARRAY_DTYPES[tag.tag])
+    if tag.tag == CBOR_MULTI_DIMENSIONAL_ARRAY_TAG:
+        shape, array = tag.value
+        return np.asarray(array).reshape(shape)
+    return tag
+
+
+def encode_cbor(obj: Any) -> bytes:
+    return cbor2.dumps(to_primitive(obj), default=_cbor_default)
+
+
+def decode_cbor(data: Union[bytes, str]) -> Any:
+    if isinstance(data, str):
+        data = data.encode()
+    return cbor2.loads(data, tag_hook=_cbor_tag_hook)
+
+
+class Codec:
+    """How messages of a websocket subprotocol are encoded"""
+
+    def __init__(
+        self,
+        name: str,
+        subprotocol: Optional[str],
+        binary: bool,
+        encode: Callable[[Any], bytes],
+        decode: Callable[[Union[bytes, str]], Any],
+    ):
+        self.name = name
+        self.subprotocol = subprotocol
+        self.binary = binary
+        self._encode = encode
+        self._decode = decode
+
+    def encode(self, obj: Any) -> Union[bytes, str]:
+        """Encode to bytes for binary codecs, or to text"""
+        encoded = self._encode(obj)
+        return encoded if self.binary else encoded.decode()
+
+    def decode(self, data: Union[bytes, str]) -> Any:
+        """Decode a message, raising ValueError if it is malformed"""
+        try:
+            return self._decode(data)
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Malformed {self.name} message: {e}") from e
+
+    def __repr__(self) -> str:
+        return f"Codec({self.name})"
+
+
+JSON_CODEC = Codec("json", None, False, encode_json, json.loads)
+
+CODECS: dict[str, Codec] = {}
+if msgpack is not None:
+    CODECS["xthings.msgpack"] = Codec(
+        "msgpack", "xthings.msgpack", True, encode_msgpack, decode_msgpack
+    )
+if cbor2 is not None:
+    CODECS["xthings.cbor"] = Codec(
+        "cbor", "xthings.cbor", True, encode_cbor, decode_cbor
+    )
+CODECS["xthings.json"] = Codec("json", "xthings.json", False, encode_json, json.loads)
+
+
+def negotiate_codec(subprotocols: list[str]) -> Codec:
+    """Pick the first subprotocol requested by the client that is supported
+
+    JSON without a subprotocol is used if there is none.
+    """
+    for subprotocol in subprotocols:
+        if subprotocol in CODECS:
+            return CODECS[subprotocol]
+    return JSON_CODEC
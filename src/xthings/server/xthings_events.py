@@ -0,0 +1,79 @@
+"""
+Events sent to the observers of an XThing
+"""
+
+from __future__ import annotations
+from typing import Any, Hashable, Optional, Union
+
+from .xthings_encoding import Codec, JSON_CODEC
+
+
+class EventMessage:
+    """A property or action status event, encoded once for all its observers
+
+    Sending the same pre-encoded frame to every observer makes fanning out an
+    event to N clients cost one serialization per encoding instead of N. The
+    JSON frame is encoded at once, binary frames when first asked for.
+    """
+
+    __slots__ = ("message_type", "name", "value", "thing", "seq", "_encoded")
+
+    def __init__(
+        self,
+        message_type: str,
+        name: str,
+        value: Any,
+        thing: Optional[str] = None,
+        seq: Optional[int] = None,
+    ):
+        self.message_type = message_type
+        self.name = name
+        self.value = value
+        self.thing = thing
+        self.seq = seq
+        self._encoded: dict[str, Union[bytes, str]] = {}
+        self.encoded(JSON_CODEC)
+
+    @property
+    def message(self) -> dict:
+        message: dict[str, Any] = {
+            "messageType": self.message_type,
+            "data": {self.name: self.value},
+        }
+        if self.thing is not None:
+            message["thing"] = self.thing
+        if self.seq is not None:
+            message["seq"] = self.seq
+        return message
+
+    @property
+    def key(self) -> Optional[Hashable]:
+        """Events with the same key supersede each other
+
+        Action status events have none: the events of an action do not tell
+        its invocations apart, and a terminal status must not be replaced by
+        the one of a later invocation.
+        """
+        if self.message_type == "actionStatus":
+            return None
+        return (self.thing, self.message_type, self.name)
+
+    @property
+    def topic(self) -> tuple[str, str]:
+        """The subscription topic of this event: (kind, affordance name)"""
+        kind = "property" if self.message_type == "propertyStatus" else "action"
+        return (kind, self.name)
+
+    @property
+    def text(self) -> str:
+        return self.encoded(JSON_CODEC)  # type: ignore[return-value]
+
+    def encoded(self, codec: Codec) -> Union[bytes, str]:
+        """The frame of this event for a codec, encoded once"""
+        try:
+            return self._encoded[codec.name]
+        except KeyError:
+            return self._encoded.setdefault(codec.name, codec.encode(self.message))
+
+    def __repr__(self) -> str:
+        return f"EventMessage({self.text})"
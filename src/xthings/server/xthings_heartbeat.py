@@ -0,0 +1,122 @@
+"""
+Application-level websocket heartbeats, to reap dead connections
+
+A connection is reaped, and its subscriptions released:
+* if its client answered pings before, but then sent nothing for `idle_timeout`
+* if none of the events waiting in its queue could be sent for `idle_timeout`,
+  whatever the client, as its connection is stalled (e.g. half-open)
+
+ASGI servers do not expose websocket ping frames to the application, and answer
+the ones of clients by themselves (e.g. uvicorn's `--ws-ping-interval`). With a
+`ping_interval`, the server also sends {"messageType": "ping"} messages, which
+clients answer with {"messageType": "pong"}. This is opt-in, as clients which
+reject unknown message types would break. Clients which never answer pings are
+only reaped when stalled.
+"""
+
+from __future__ import annotations
+from anyio import ClosedResourceError, sleep, sleep_forever
+from pydantic import BaseModel
+from typing import Optional
+import logging
+import time
+
+from .xthings_subscriber import SubscriberQueue
+
+PING = {"messageType": "ping"}
+PONG = {"messageType": "pong"}
+
+
+class HeartbeatStatistics(BaseModel):
+    ping_interval: Optional[float]
+    idle_timeout: Optional[float]
+    pings_sent: int
+    reaped_silent: int
+    reaped_stalled: int
+
+
+class ConnectionActivity:
+    """When a client was last heard of, and whether it answers pings"""
+
+    __slots__ = ("last_received", "answers_pings")
+
+    def __init__(self):
+        self.last_received = time.monotonic()
+        self.answers_pings = False
+
+    def received(self, pong: bool = False) -> None:
+        self.last_received = time.monotonic()
+        if pong:
+            self.answers_pings = True
+
+
+class Heartbeat:
+    """Ping the websocket clients of a server and count the reaped connections"""
+
+    def __init__(
+        self,
+        ping_interval: Optional[float] = None,
+        idle_timeout: Optional[float] = 60.0,
+    ):
+        for value in (ping_interval, idle_timeout):
+            if value is not None and value <= 0:
+                raise ValueError("ping_interval and idle_timeout must be > 0")
+        self._ping_interval = ping_interval
+        self._idle_timeout = idle_timeout
+        self._pings_sent = 0
+        self._reaped_silent = 0
+        self._reaped_stalled = 0
+
+    @property
+    def reaped(self) -> int:
+        return self._reaped_silent + self._reaped_stalled
+
+    def statistics(self) -> HeartbeatStatistics:
+        return HeartbeatStatistics(
+            ping_interval=self._ping_interval,
+            idle_timeout=self._idle_timeout,
+            pings_sent=self._pings_sent,
+            reaped_silent=self._reaped_silent,
+            reaped_stalled=self._reaped_stalled,
+        )
+
+    async def watch(self, queue: SubscriberQueue, activity: ConnectionActivity) -> bool:
+        """Ping a client through its queue
+
+        Return True when the connection must be reaped, or False if its queue
+        was closed.
+        """
+        periods = [self._ping_interval, self._idle_timeout]
+        if self._idle_timeout is not None:
+            periods.append(self._idle_timeout / 4)
+        period = min((p for p in periods if p is not None), default=None)
+        if period is None:
+            await sleep_forever()
+            return False
+
+        last_ping = time.monotonic()
+        while True:
+            await sleep(period)
+            now = time.monotonic()
+            if self._idle_timeout is not None:
+                if (
+                    activity.answers_pings
+                    and now - activity.last_received > self._idle_timeout
+                ):
+                    self._reaped_silent += 1
+                    logging.warning(f"Reaping {queue.name}, it stopped answering")
+                    return True
+                if queue.stalled_for > self._idle_timeout:
+                    self._reaped_stalled += 1
+                    logging.warning(f"Reaping {queue.name}, it stopped receiving")
+                    return True
+            if (
+                self._ping_interval is not None
+                and now - last_ping >= self._ping_interval
+            ):
+                last_ping = now
+                try:
+                    queue.send_nowait(PING)
+                except ClosedResourceError:
+                    return False
+                self._pings_sent += 1
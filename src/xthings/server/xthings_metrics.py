@@ -0,0 +1,303 @@
+"""
+Metrics of a server, in the Prometheus text exposition format
+
+The latencies of property reads and writes, and the queue wait and run time of
+action invocations, are recorded in histograms as they happen. The rest is read
+when `/metrics` is scraped: websocket connections and their send queues, and the
+image streams. Send queues are aggregated per websocket endpoint, as a label per
+connection would make a new series for each client.
+
+Metrics are off unless `metrics_enabled` is set in the server settings. Then the
+server has no `XThingsMetrics`, and instrumented code costs one `is None` check.
+"""
+
+from __future__ import annotations
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Iterable, Sequence
+import threading
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .xthings_server import XThingsServer
+    from .xthings_subscriber import SubscriberQueue
+
+METRICS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+    def samples(self) -> Iterable[str]:
+        return ()
+
+    def render(self) -> list[str]:
+        return self.header() + list(self.samples())
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: tuple = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_value(value)}"
+
+
+class Gauge(Metric):
+    """A gauge, set when the metrics are collected"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def set(self, labels: tuple, value: float) -> None:
+        self._values[labels] = value
+
+    def clear(self) -> None:
+        self._values = {}
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_value(value)}"
+
+
+class CollectedCounter(Gauge):
+    """A counter kept elsewhere, read when the metrics are collected"""
+
+    type = "counter"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count of each bucket, then +Inf], sum
+        self._values: dict[tuple, tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            try:
+                counts, total = self._values[labels]
+            except KeyError:
+                counts, total = self._values[labels] = (
+                    [0] * (len(self.buckets) + 1),
+                    [0.0],
+                )
+            counts[i] += 1
+            total[0] += value
+
+    def count(self, labels: tuple) -> int:
+        entry = self._values.get(labels)
+        return 0 if entry is None else sum(entry[0])
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = [(k, list(c), t[0]) for k, (c, t) in self._values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_value(bound)}"'
+                yield (
+                    f"{self.name}_bucket{_labels(self.labelnames, labels, le)} "
+                    f"{cumulative}"
+                )
+            label_text = _labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {_value(total)}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+
+class XThingsMetrics:
+    """The metrics of an XThingsServer"""
+
+    def __init__(self, server: XThingsServer):
+        self._server = server
+        self.property_latency = Histogram(
+            "xthings_property_request_seconds",
+            "Time to read or write a property over HTTP",
+            ("xthing", "property", "method"),
+        )
+        self.action_queue_wait = Histogram(
+            "xthings_action_queue_wait_seconds",
+            "Time from the request of an invocation to its start in a thread",
+            ("xthing", "action"),
+        )
+        self.action_run_time = Histogram(
+            "xthings_action_run_seconds",
+            "Run time of action invocations",
+            ("xthing", "action"),
+        )
+        self.action_outcomes = Counter(
+            "xthings_action_invocations_total",
+            "Finished action invocations, by status",
+            ("xthing", "action", "status"),
+        )
+        self._websocket_connections = Gauge(
+            "xthings_websocket_connections", "Open websocket connections"
+        )
+        self._send_queue_depth = Gauge(
+            "xthings_websocket_send_queue_depth",
+            "Events waiting in the send queues of the connections to an endpoint",
+            ("endpoint",),
+        )
+        self._send_queue_max_depth = Gauge(
+            "xthings_websocket_send_queue_max_depth",
+            "Events waiting in the fullest send queue of an endpoint",
+            ("endpoint",),
+        )
+        self._send_queue_dropped = CollectedCounter(
+            "xthings_websocket_send_queue_dropped_total",
+            "Events dropped from the send queues of the connections to an endpoint",
+            ("endpoint",),
+        )
+        # events dropped from the send queues of the connections which closed
+        self._closed_queues_dropped: dict[str, int] = {}
+        stream = ("xthing", "stream")
+        self._stream_frames = CollectedCounter(
+            "xthings_stream_frames_total", "Frames added to an image stream", stream
+        )
+        self._stream_fps = Gauge(
+            "xthings_stream_fps", "Frames per second added to an image stream", stream
+        )
+        self._stream_encode_seconds = CollectedCounter(
+            "xthings_stream_encode_seconds_total", "Time spent encoding frames", stream
+        )
+        self._stream_occupancy = Gauge(
+            "xthings_stream_ringbuffer_occupancy",
+            "Ring buffer entries holding a frame",
+            stream,
+        )
+        self._stream_size = Gauge(
+            "xthings_stream_ringbuffer_size", "Ring buffer entries", stream
+        )
+        self._stream_viewers = Gauge(
+            "xthings_stream_viewers", "Clients viewing an image stream", stream
+        )
+        self._stream_skipped = CollectedCounter(
+            "xthings_stream_skipped_frames_total",
+            "Frames skipped by viewers which were too slow",
+            stream,
+        )
+        self._metrics: list[Metric] = [
+            self.property_latency,
+            self.action_queue_wait,
+            self.action_run_time,
+            self.action_outcomes,
+            self._websocket_connections,
+            self._send_queue_depth,
+            self._send_queue_max_depth,
+            self._send_queue_dropped,
+            self._stream_frames,
+            self._stream_fps,
+            self._stream_encode_seconds,
+            self._stream_occupancy,
+            self._stream_size,
+            self._stream_viewers,
+            self._stream_skipped,
+        ]
+        self._gauges = [m for m in self._metrics if isinstance(m, Gauge)]
+
+    def subscriber_queue_closed(self, queue: SubscriberQueue) -> None:
+        """Keep the count of events dropped by a connection which closed"""
+        dropped = self._closed_queues_dropped.get(queue.endpoint, 0)
+        self._closed_queues_dropped[queue.endpoint] = dropped + queue.dropped
+
+    def _collect(self) -> None:
+        for gauge in self._gauges:
+            gauge.clear()
+        queues = self._server.websocket_queues()
+        self._websocket_connections.set((), len(queues))
+        depths: dict[str, list[int]] = {}
+        dropped = dict(self._closed_queues_dropped)
+        for queue in queues:
+            depths.setdefault(queue.endpoint, []).append(len(queue))
+            dropped[queue.endpoint] = dropped.get(queue.endpoint, 0) + queue.dropped
+        for endpoint, endpoint_depths in depths.items():
+            self._send_queue_depth.set((endpoint,), sum(endpoint_depths))
+            self._send_queue_max_depth.set((endpoint,), max(endpoint_depths))
+        for endpoint, count in dropped.items():
+            self._send_queue_dropped.set((endpoint,), count)
+        for xthing in self._server.xthings.values():
+            for name, descriptor in xthing._streams.items():
+                labels = (xthing.path, name)
+                statistics = descriptor.__get__(xthing).statistics()
+                self._stream_frames.set(labels, statistics.frames)
+                self._stream_fps.set(labels, statistics.fps)
+                self._stream_encode_seconds.set(labels, statistics.encode_seconds_total)
+                self._stream_occupancy.set(labels, statistics.ringbuffer_occupancy)
+                self._stream_size.set(labels, statistics.ringbuffer_size)
+                self._stream_viewers.set(labels, statistics.viewers)
+                self._stream_skipped.set(labels, statistics.skipped_frames)
+
+    def render(self) -> str:
+        self._collect()
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
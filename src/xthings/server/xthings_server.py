@@ -3,24 +3,69 @@ A FastAPI server to host the XThings service - XThingsServer
 """
 
 from __future__ import annotations
+from anyio import create_task_group, to_thread
+from anyio.abc import TaskGroup
 from anyio.from_thread import BlockingPortal
-from contextlib import asynccontextmanager, AsyncExitStack
-from fastapi import FastAPI
+from contextlib import asynccontextmanager, nullcontext
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional, TYPE_CHECKING
+from typing import Annotated, Optional, Sequence, TYPE_CHECKING
 from weakref import WeakSet
+import logging
 import os
-import yaml
 
 from ..action import ActionManager
-from .xthings_zeroconf import run_mdns_in_executor, stop_mdns_thread
+from ..errors import RemoteInteractionError
+from ..profiling import ProfilingReport, ProfilingRequest, ProfilingSession
+from .xthings_compression import CompressionMiddleware
+from .xthings_heartbeat import Heartbeat, HeartbeatStatistics
+from .xthings_metrics import METRICS_MEDIA_TYPE, XThingsMetrics
+from .xthings_sessions import SessionStore
+from .xthings_settings import (
+    CompressionRoute,
+    ServerSettings,
+    default_settings_folder,
+    load_server_settings,
+)
+from .xthings_settings_store import SettingsStore
+from .xthings_sse import EventLog, sse_response
+from .xthings_startup import (
+    StartupSupervisor,
+    UnavailableXThingsMiddleware,
+    XThingLifecycle,
+    XThingStartup,
+)
+from .xthings_subscriber import OverflowPolicy, SubscriberQueue, SubscriberStatistics
+from .xthings_websocket import WebSocket, multiplexed_websocket_endpoint
+from .xthings_workers import (
+    IPC_PATH_ENVIRONMENT_VARIABLE,
+    ROLE_ENVIRONMENT_VARIABLE,
+    OwnerBridge,
+    ServerRole,
+    WorkerBridge,
+)
+from .xthings_zeroconf import MdnsRegistration
 
 if TYPE_CHECKING:  # pragma: no cover
     from ..xthing import XThing
 
 _xthings_servers: WeakSet[XThingsServer] = WeakSet()
 
-port = 8000  # TODO: configurable in settings.yaml
+
+async def remote_interaction_error(request: Request, exc: RemoteInteractionError):
+    """Map the errors of interactions forwarded to the owner process"""
+    status_code = exc.status_code or {
+        "UnknownAffordance": 404,
+        "UnknownInvocation": 404,
+        "BadKey": 400,
+        "ValidationError": 422,
+        "OwnerDisconnected": 503,
+        "Timeout": 504,
+    }.get(exc.error_message, 502)
+    return JSONResponse(
+        {"detail": exc.detail or exc.error_message}, status_code=status_code
+    )
 
 
 class XThingsServer:
@@ -31,7 +76,41 @@ class XThingsServer:
     _blocking_portal: Optional[BlockingPortal]
     _xthings: dict[str, XThing]
 
-    def __init__(self, settings_folder: Optional[str] = None):
+    def __init__(
+        self,
+        settings_folder: Optional[str] = None,
+        websocket_queue_size: int = 100,
+        websocket_overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        event_log_length: int = 1000,
+        websocket_session_ttl: float = 300.0,
+        websocket_ping_interval: Optional[float] = None,
+        websocket_idle_timeout: Optional[float] = 60.0,
+        role: Optional[ServerRole] = None,
+        ipc_path: Optional[str] = None,
+        server_settings: Optional[ServerSettings] = None,
+        setup_timeout: Optional[float] = None,
+        degraded_startup: bool = False,
+        setup_retry_interval: float = 5.0,
+    ):
+        """Create a server
+
+        In multi-worker mode, `role` is "owner" in the process which sets up the
+        XThings, and "worker" in the HTTP worker processes, which connect to the
+        owner at the Unix socket `ipc_path`, see `run_workers`. They default to
+        the XTHINGS_ROLE and XTHINGS_IPC_PATH environment variables.
+
+        `server_settings` default to the ones of `server.yaml` in the settings
+        folder, see `load_server_settings`.
+
+        Websocket connections which stalled for `websocket_idle_timeout` are
+        reaped. `websocket_ping_interval` opts in to {"messageType": "ping"}
+        messages, see `Heartbeat`.
+
+        The XThings are set up concurrently, see `add_xthing` for dependencies
+        between them. `setup_timeout` is the default timeout of their setup. With
+        `degraded_startup`, the server starts even if some XThings fail to set up,
+        and retries them every `setup_retry_interval` seconds.
+        """
         self._app = FastAPI(lifespan=self.lifespan)
 
         self._app.add_middleware(
@@ -42,18 +121,114 @@ class XThingsServer:
             allow_headers=["*"],
         )
 
-        self._settings_folder = settings_folder or "./settings"
+        self._settings_folder = settings_folder or default_settings_folder()
+        self._server_settings = server_settings or load_server_settings(
+            self._settings_folder
+        )
         self._action_manager = ActionManager().attach_to_app(self._app)
         self._blocking_portal: Optional[BlockingPortal] = None
         self._lifecycle_status: str = None
         self._xthings: dict[str, XThing] = {}
+        self._websocket_queue_size = websocket_queue_size
+        self._websocket_overflow_policy = OverflowPolicy(websocket_overflow_policy)
+        self._subscriber_queues: WeakSet[SubscriberQueue] = WeakSet()
+        self._app.get("/websockets", response_model=list[SubscriberStatistics])(
+            self.websocket_statistics
+        )
+        self._app.websocket("/ws")(self.websocket)
+        self._event_log = EventLog(event_log_length)
+        self._sessions = SessionStore(ttl=websocket_session_ttl)
+        self._heartbeat = Heartbeat(websocket_ping_interval, websocket_idle_timeout)
+        self._app.get("/websockets/heartbeat", response_model=HeartbeatStatistics)(
+            self.heartbeat_statistics
+        )
+        self._app.get("/events")(self.events)
+        self._app.exception_handler(RemoteInteractionError)(remote_interaction_error)
+        self._setup_timeout = setup_timeout
+        self._degraded_startup = degraded_startup
+        self._setup_retry_interval = setup_retry_interval
+        self._lifecycles: dict[str, XThingLifecycle] = {}
+        self._supervisor: Optional[StartupSupervisor] = None
+        self._app.get("/startup", response_model=list[XThingStartup])(
+            self.startup_status
+        )
+        self._app.add_middleware(
+            UnavailableXThingsMiddleware,
+            unavailable=self.unavailable_xthings,
+            retry_after=setup_retry_interval,
+        )
+        self._metrics: Optional[XThingsMetrics] = None
+        if self._server_settings.metrics_enabled:
+            self._metrics = XThingsMetrics(self)
+            self._app.get("/metrics", response_class=Response)(self.metrics_endpoint)
+        self._task_group: Optional[TaskGroup] = None
+        self._profiling_sessions: dict[str, ProfilingSession] = {}
+        if self._server_settings.profiling_enabled:
+            self._app.post(
+                "/admin/profiling", response_model=ProfilingReport, status_code=201
+            )(self.start_profiling)
+            self._app.get("/admin/profiling", response_model=list[ProfilingReport])(
+                self.profiling_sessions
+            )
+            self._app.get("/admin/profiling/{id}", response_model=ProfilingReport)(
+                self.profiling_session
+            )
+        self._app.add_middleware(
+            CompressionMiddleware, settings=lambda: self._server_settings.compression
+        )
+        self._role = ServerRole(
+            role or os.environ.get(ROLE_ENVIRONMENT_VARIABLE, ServerRole.STANDALONE)
+        )
+        self._ipc_path = ipc_path or os.environ.get(IPC_PATH_ENVIRONMENT_VARIABLE)
+        self._worker_bridge: Optional[WorkerBridge] = None
+        if self._role == ServerRole.WORKER:
+            self._worker_bridge = WorkerBridge(self, self._ipc_path)
+            self._action_manager._remote = self._worker_bridge
         global _xthings_servers
         _xthings_servers.add(self)
 
+    async def __call__(self, scope, receive, send):
+        """Serve the app, so that a server can be given to uvicorn"""
+        await self._app(scope, receive, send)
+
     @property
     def app(self):
         return self._app
 
+    @property
+    def server_settings(self) -> ServerSettings:
+        return self._server_settings
+
+    def set_compression(
+        self,
+        path: str,
+        enabled: bool = True,
+        minimum_size: Optional[int] = None,
+        level: Optional[int] = None,
+    ) -> None:
+        """Override the compression of the responses under a path prefix
+
+        e.g. `server.set_compression("/camera", enabled=False)`. Unset values
+        are the ones of the server settings.
+        """
+        self._server_settings.compression.routes[path] = CompressionRoute(
+            enabled=enabled, minimum_size=minimum_size, level=level
+        )
+
+    @property
+    def metrics(self) -> Optional[XThingsMetrics]:
+        """The metrics of the server, None unless `metrics_enabled` is set"""
+        return self._metrics
+
+    @property
+    def role(self) -> ServerRole:
+        return self._role
+
+    @property
+    def worker_bridge(self) -> Optional[WorkerBridge]:
+        """The connection of a worker process to the owner process"""
+        return self._worker_bridge
+
     @property
     def xthings(self):
         return self._xthings
@@ -62,6 +237,106 @@ class XThingsServer:
     def action_manager(self):
         return self._action_manager
 
+    @property
+    def event_log(self) -> EventLog:
+        """The log of the events of all the XThings of this server"""
+        return self._event_log
+
+    @property
+    def sessions(self) -> SessionStore:
+        """The websocket sessions, open or which may be resumed"""
+        return self._sessions
+
+    @property
+    def heartbeat(self) -> Heartbeat:
+        """Pings websocket clients and reaps the dead connections"""
+        return self._heartbeat
+
+    def create_subscriber_queue(self, name: str = "") -> SubscriberQueue:
+        """Create the event queue of a new websocket connection"""
+        queue = SubscriberQueue(
+            self._websocket_queue_size, self._websocket_overflow_policy, name
+        )
+        if self._metrics is not None:
+            queue.on_close = self._metrics.subscriber_queue_closed
+        self._subscriber_queues.add(queue)
+        return queue
+
+    async def websocket(self, websocket: WebSocket):
+        """One websocket for the events of all the XThings of this server"""
+        await multiplexed_websocket_endpoint(
+            self._xthings,
+            websocket,
+            self.create_subscriber_queue(),
+            self._sessions,
+            self._heartbeat,
+        )
+
+    async def events(self, last_event_id: Annotated[Optional[str], Header()] = None):
+        """Server-Sent Events of all the XThings of this server"""
+        for xthing in self._xthings.values():
+            xthing.start_sampling()
+        return sse_response(self._event_log, last_event_id)
+
+    def websocket_queues(self) -> list[SubscriberQueue]:
+        """The send queues of the open websocket connections"""
+        return [q for q in self._subscriber_queues if not q.closed]
+
+    async def websocket_statistics(self) -> list[SubscriberStatistics]:
+        """Queue depth, drops and lag of each open websocket connection"""
+        return [q.statistics() for q in self.websocket_queues()]
+
+    async def metrics_endpoint(self) -> Response:
+        """The metrics of the server, in the Prometheus text format"""
+        assert self._metrics is not None
+        return Response(self._metrics.render(), media_type=METRICS_MEDIA_TYPE)
+
+    async def heartbeat_statistics(self) -> HeartbeatStatistics:
+        """Pings sent and dead websocket connections reaped"""
+        return self._heartbeat.statistics()
+
+    async def startup_status(self) -> list[XThingStartup]:
+        """The state, setup attempts and setup/teardown times of each XThing"""
+        return [lc.report() for lc in self._lifecycles.values()]
+
+    async def start_profiling(self, request: ProfilingRequest) -> ProfilingReport:
+        """Profile the process, an action or a property for a time window"""
+        if self._task_group is None:
+            raise HTTPException(503, "The server is not running")
+        if any(s.running for s in self._profiling_sessions.values()):
+            raise HTTPException(409, "A profiling session is running already")
+        if request.xthing is not None:
+            xthing = self._xthings.get(request.xthing)
+            if xthing is None:
+                raise HTTPException(404, f"No XThing at {request.xthing}")
+            affordances = (
+                xthing.actions if request.scope == "action" else xthing.properties
+            )
+            if request.name not in affordances:
+                raise HTTPException(
+                    404, f"{request.xthing} has no {request.scope.value} {request.name}"
+                )
+        session = ProfilingSession(request, self._server_settings.profiling_folder)
+        self._profiling_sessions[session.id] = session
+        self._task_group.start_soon(session.run)
+        return session.report()
+
+    async def profiling_sessions(self) -> list[ProfilingReport]:
+        """The profiling sessions, running or finished"""
+        return [s.report() for s in self._profiling_sessions.values()]
+
+    async def profiling_session(self, id: str) -> ProfilingReport:
+        session = self._profiling_sessions.get(id)
+        if session is None:
+            raise HTTPException(404, f"No profiling session {id}")
+        return session.report()
+
+    def unavailable_xthings(self) -> frozenset[str]:
+        """The paths of the XThings which are not set up, in degraded mode"""
+        if self._supervisor is None:
+            return frozenset()
+        return self._supervisor.unavailable
+
     @asynccontextmanager
     async def lifespan(self, app: FastAPI):
         """Manage setup and teardown
@@ -70,8 +345,20 @@ class XThingsServer:
         * It sets up the blocking portal such that background threads can run async code
           in the event loop thread. This is important for events.
         * It runs setup/teardown code for the XThing(s) hosted in this server.
+        * It provides a task group for background tasks of the XThing(s), such as
+          property sampling, which are cancelled before the XThing(s) are shut down.
         """
         self._lifecycle_status = "startup..."
+        settings = self._server_settings
+        if settings.thread_pool_size is not None:
+            limiter = to_thread.current_default_thread_limiter()
+            limiter.total_tokens = settings.thread_pool_size
+        if self._worker_bridge is None:
+            supervisor = StartupSupervisor(
+                list(self._lifecycles.values()),
+                self._degraded_startup,
+                self._setup_retry_interval,
+            )
         async with BlockingPortal() as portal:
             self._blocking_portal = portal
 
@@ -79,18 +366,53 @@ class XThingsServer:
             for xthing in self._xthings.values():
                 xthing._blocking_portal = portal
 
-            async with AsyncExitStack() as stack:
-                xthing_services = []
-                for xthing in self._xthings.values():
-                    await stack.enter_async_context(xthing)
-                    xthing_services.append((xthing._service_type, xthing._service_name))
-                properties = {"key": "value"}  # TODO: settings.yaml
-                server = "myserver.local."  # TODO: settings.yaml
-                cancellation_token = run_mdns_in_executor(
-                    xthing_services, port, properties, server
-                )
-                yield
-                stop_mdns_thread(cancellation_token)
+            if self._worker_bridge is not None:
+                # the XThings are set up by the owner process
+                async with create_task_group() as tg:
+                    self._task_group = tg
+                    tg.start_soon(self._worker_bridge.run)
+                    yield
+                    tg.cancel_scope.cancel()
+                self._task_group = None
+            else:
+                # no zeroconf instance, nor its sockets, unless mDNS is enabled
+                mdns: Optional[MdnsRegistration] = None
+                if settings.mdns_enabled:
+                    mdns = MdnsRegistration(
+                        settings.port,
+                        settings.mdns_properties,
+                        settings.mdns_server_name,
+                        settings.mdns_interfaces,
+                    )
+                try:
+                    async with mdns or nullcontext(), create_task_group() as tg:
+
+                        def on_ready(xthing: XThing):
+                            xthing._task_group = tg
+                            xthing.start_background_tasks()
+                            if mdns is not None:
+                                service = (xthing._service_type, xthing._service_name)
+                                tg.start_soon(mdns.register, [service])
+
+                        for xthing in self._xthings.values():
+                            tg.start_soon(self._persist_settings, xthing)
+                        self._supervisor = supervisor
+                        self._task_group = tg
+                        await supervisor.start(tg, on_ready)
+                        if self._role == ServerRole.OWNER:
+                            bridge = OwnerBridge(self, self._ipc_path)
+                            await tg.start(bridge.run)
+                        self._log_startup()
+                        yield
+                        tg.cancel_scope.cancel()
+                finally:
+                    self._task_group = None
+                    for xthing in self._xthings.values():
+                        xthing._task_group = None
+                    await supervisor.stop()
+                    # the changes made until teardown
+                    for xthing in self._xthings.values():
+                        await self._flush_settings(xthing)
 
             # detach the blocking portal from each of the XThing
             for xthing in self._xthings.values():
@@ -99,19 +421,66 @@ class XThingsServer:
             self._lifecycle_status = "shutdown..."
         self._blocking_portal = None
 
-    def add_xthing(self, xthing: XThing, path: str):
-        """Add an XThing to the XThingsServer"""
+    async def _persist_settings(self, xthing: XThing) -> None:
+        store = xthing._settings_store
+        if store is None:
+            return
+
+        async def on_reload(keys: set[str]):
+            logging.info(f"{store.filename} was edited: {', '.join(sorted(keys))}")
+            try:
+                await to_thread.run_sync(xthing.settings_changed, keys)
+            except Exception as e:
+                logging.error(f"Failed to apply the settings of {xthing.path}: {e!r}")
+
+        await store.run(on_reload)
+
+    async def _flush_settings(self, xthing: XThing) -> None:
+        if xthing._settings_store is None:
+            return
+        try:
+            await xthing._settings_store.flush()
+        except OSError as e:
+            logging.error(f"Failed to write the settings of {xthing.path}: {e!r}")
+
+    def _log_startup(self) -> None:
+        for lc in self._lifecycles.values():
+            setup_time = f"{lc.setup_time:.3f}s" if lc.setup_time is not None else "-"
+            logging.info(f"{lc.path}: {lc.state.value} (setup {setup_time})")
+
+    def add_xthing(
+        self,
+        xthing: XThing,
+        path: str,
+        depends_on: Sequence[str] = (),
+        setup_timeout: Optional[float] = None,
+    ):
+        """Add an XThing to the XThingsServer
+
+        The XThing is set up once the XThings at the paths `depends_on` are, and
+        torn down before them. `setup_timeout` overrides the one of the server.
+        """
         if path in self._xthings:
             raise KeyError(f"{path} has already been added to this XThingsServer")
         self._xthings[path] = xthing
+        self._lifecycles[path] = XThingLifecycle(
+            xthing, path, depends_on, setup_timeout or self._setup_timeout
+        )
 
         settings_folder = os.path.join(self._settings_folder)
         os.makedirs(settings_folder, exist_ok=True)
         filename = os.path.join(settings_folder, f"{path.strip('/')}.settings.yaml")
-        if os.path.exists(filename):
-            with open(filename, "r") as f:
-                xthing.settings = yaml.safe_load(f)
-        else:
-            xthing.settings = {}
+        store = SettingsStore(
+            filename,
+            self._server_settings.settings_write_delay,
+            self._server_settings.settings_poll_interval,
+        )
+        store.load()
+        xthing._settings_store = store
 
         xthing.attach_to_app(self, path)
+        # FastAPI generates the OpenAPI schema when it is first requested, and
+        # caches it: it must include the routes of XThings added since
+        self._app.openapi_schema = None
+        if self._worker_bridge is not None:
+            xthing._remote = self._worker_bridge
@@ -0,0 +1,88 @@
+"""
+Websocket sessions, which a client can resume after a disconnection
+"""
+
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Optional
+import time
+import uuid
+
+from .xthings_subscriptions import Topic
+
+
+class WebSocketSession:
+    """The subscriptions of a websocket connection, by XThing path
+
+    The subscriptions are recorded when the connection closes, so that a new
+    connection resuming the session can restore them.
+    """
+
+    __slots__ = ("session_id", "subscriptions", "released_at")
+
+    def __init__(self, session_id: Optional[str] = None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.subscriptions: dict[str, frozenset[Topic]] = {}
+        self.released_at: Optional[float] = None
+
+
+class SessionStore:
+    """The sessions of the open websockets, and of the recently closed ones
+
+    Closed sessions are kept `ttl` seconds, and at most `max_sessions` of them,
+    the oldest being forgotten first. The store is used from the event loop
+    thread only.
+    """
+
+    def __init__(self, max_sessions: int = 1000, ttl: float = 300.0):
+        self._max_sessions = max_sessions
+        self._ttl = ttl
+        self._active: dict[str, WebSocketSession] = {}
+        self._released: OrderedDict[str, WebSocketSession] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._active) + len(self._released)
+
+    def create(self) -> WebSocketSession:
+        session = WebSocketSession()
+        self._active[session.session_id] = session
+        return session
+
+    def release(
+        self, session: WebSocketSession, subscriptions: dict[str, frozenset[Topic]]
+    ) -> None:
+        """Record the subscriptions of a closed connection for it to be resumed"""
+        self._active.pop(session.session_id, None)
+        session.subscriptions = {k: v for k, v in subscriptions.items() if v}
+        session.released_at = time.monotonic()
+        self._released[session.session_id] = session
+        self._expire()
+
+    def resume(
+        self, session: WebSocketSession, session_id: str
+    ) -> Optional[WebSocketSession]:
+        """Let an open connection take over a closed session
+
+        Return the closed session, whose subscriptions should be restored, or
+        None if it is unknown, expired or still open.
+        """
+        self._expire()
+        previous = self._released.pop(session_id, None)
+        if previous is None:
+            return None
+        self._active.pop(session.session_id, None)
+        session.session_id = session_id
+        self._active[session_id] = session
+        return previous
+
+    def _expire(self) -> None:
+        deadline = time.monotonic() - self._ttl
+        while self._released:
+            session = next(iter(self._released.values()))
+            if (
+                len(self._released) <= self._max_sessions
+                and session.released_at is not None
+                and session.released_at >= deadline
+            ):
+                break
+            self._released.popitem(last=False)
@@ -0,0 +1,186 @@
+"""
+Server-level settings, read from `server.yaml` in the settings folder
+
+The settings of the XThings are in `<path>.settings.yaml` files in the same
+folder. A setting which is not in `server.yaml` keeps its default value, e.g.
+
+    port: 8080
+    workers: 4
+    thread_pool_size: 64
+    loop: uvloop
+    keep_alive: 10
+    compression:
+      minimum_size: 512
+      routes:
+        /camera/history: {level: 9}
+        /stage: {enabled: false}
+
+`xthings serve` passes the effective settings, including its command line
+overrides, to the server of each process in the XTHINGS_SERVER_SETTINGS
+environment variable.
+"""
+
+from __future__ import annotations
+from importlib.util import find_spec
+from pydantic import BaseModel, Field
+from typing import Literal, Optional
+import os
+import socket
+import yaml
+
+# the C implementations of libyaml are much faster, if PyYAML was built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+SERVER_SETTINGS_FILENAME = "server.yaml"
+SERVER_SETTINGS_ENVIRONMENT_VARIABLE = "XTHINGS_SERVER_SETTINGS"
+SETTINGS_FOLDER_ENVIRONMENT_VARIABLE = "XTHINGS_SETTINGS_FOLDER"
+
+
+class CompressionRoute(BaseModel):
+    """The compression of the responses under a path, see `CompressionSettings`"""
+
+    enabled: bool = True
+    minimum_size: Optional[int] = Field(None, ge=0)
+    level: Optional[int] = Field(None, ge=1, le=9)
+
+
+class CompressionSettings(BaseModel):
+    """The compression of responses, with gzip or deflate
+
+    Only text and JSON responses of at least `minimum_size` bytes are compressed.
+    Image streams, Server-Sent Events and responses which are compressed already
+    never are. `routes` override the defaults under path prefixes, the longest
+    matching prefix wins.
+    """
+
+    enabled: bool = True
+    minimum_size: int = Field(1024, ge=0)
+    level: int = Field(6, ge=1, le=9)
+    routes: dict[str, CompressionRoute] = {}
+
+    def route(self, path: str) -> CompressionRoute:
+        """The compression of the responses to a request path"""
+        best = ""
+        for prefix in self.routes:
+            if len(prefix) > len(best) and (
+                path == prefix or path.startswith(prefix.rstrip("/") + "/")
+            ):
+                best = prefix
+        route = self.routes.get(best, CompressionRoute())
+        return CompressionRoute.model_construct(
+            enabled=self.enabled and route.enabled,
+            minimum_size=(
+                self.minimum_size if route.minimum_size is None else route.minimum_size
+            ),
+            level=self.level if route.level is None else route.level,
+        )
+
+
+class ServerSettings(BaseModel):
+    host: str = "0.0.0.0"
+    port: int = Field(8000, ge=0, le=65535)
+    workers: int = Field(1, ge=1)
+    thread_pool_size: Optional[int] = Field(
+        None, ge=1, description="Worker threads of sync handlers, 40 if not set"
+    )
+    loop: Literal["auto", "asyncio", "uvloop"] = "auto"
+    http: Literal["auto", "h11", "httptools"] = "auto"
+    backlog: int = Field(2048, ge=1)
+    keep_alive: float = Field(5.0, ge=0, description="Keep-alive timeout in seconds")
+    mdns_server: Optional[str] = Field(
+        None, description='The mDNS host name, "<hostname>.local." if not set'
+    )
+    mdns_properties: dict[str, str] = {}
+    mdns_interfaces: Optional[list[str]] = Field(
+        None, description="The IPv4 addresses to announce from, all if not set"
+    )
+    mdns_enabled: bool = True
+    compression: CompressionSettings = Field(default_factory=CompressionSettings)
+    metrics_enabled: bool = Field(
+        False, description="Serve Prometheus metrics at /metrics"
+    )
+    profiling_enabled: bool = Field(
+        False, description="Serve the profiling endpoints at /admin/profiling"
+    )
+    profiling_folder: str = Field(
+        "./profiles", description="The folder profiling sessions write to"
+    )
+    settings_write_delay: float = Field(
+        1.0, gt=0, description="Seconds for XThing settings to settle before written"
+    )
+    settings_poll_interval: Optional[float] = Field(
+        2.0, gt=0, description="Seconds between checks for edits of settings files"
+    )
+
+    @property
+    def mdns_server_name(self) -> str:
+        return self.mdns_server or f"{socket.gethostname()}.local."
+
+    @property
+    def effective_loop(self) -> str:
+        """The event loop implementation, uvloop if "auto" and it is installed"""
+        if self.loop == "auto":
+            return "uvloop" if find_spec("uvloop") is not None else "asyncio"
+        return self.loop
+
+    @property
+    def effective_http(self) -> str:
+        """The HTTP parser, httptools if "auto" and it is installed"""
+        if self.http == "auto":
+            return "httptools" if find_spec("httptools") is not None else "h11"
+        return self.http
+
+    def uvicorn_options(self) -> dict:
+        return {
+            "host": self.host,
+            "port": self.port,
+            "loop": self.effective_loop,
+            "http": self.effective_http,
+            "backlog": self.backlog,
+            "timeout_keep_alive": self.keep_alive,
+        }
+
+    def describe(self) -> str:
+        """The effective performance configuration, one setting per line"""
+        threads = self.thread_pool_size or 40
+        mdns_server = self.mdns_server_name if self.mdns_enabled else "disabled"
+        compression = (
+            f">= {self.compression.minimum_size}B, level {self.compression.level}"
+            if self.compression.enabled
+            else "disabled"
+        )
+        profiling = self.profiling_folder if self.profiling_enabled else "disabled"
+        return "\n".join(
+            [
+                f"listening on    {self.host}:{self.port}",
+                f"workers         {self.workers}",
+                f"thread pool     {threads}",
+                f"event loop      {self.effective_loop}",
+                f"http parser     {self.effective_http}",
+                f"backlog         {self.backlog}",
+                f"keep-alive      {self.keep_alive:g}s",
+                f"mdns server     {mdns_server}",
+                f"compression     {compression}",
+                f"metrics         {'/metrics' if self.metrics_enabled else 'disabled'}",
+                f"profiling       {profiling}",
+            ]
+        )
+
+
+def default_settings_folder() -> str:
+    return os.environ.get(SETTINGS_FOLDER_ENVIRONMENT_VARIABLE, "./settings")
+
+
+def load_server_settings(settings_folder: Optional[str] = None) -> ServerSettings:
+    """The settings given by `xthings serve`, or else the ones of `server.yaml`"""
+    from_environment = os.environ.get(SERVER_SETTINGS_ENVIRONMENT_VARIABLE)
+    if from_environment:
+        return ServerSettings.model_validate_json(from_environment)
+    filename = os.path.join(
+        settings_folder or default_settings_folder(), SERVER_SETTINGS_FILENAME
+    )
+    if not os.path.exists(filename):
+        return ServerSettings()
+    with open(filename, "r") as f:
+        return ServerSettings.model_validate(yaml.load(f, Loader=YamlLoader) or {})
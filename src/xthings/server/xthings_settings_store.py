@@ -0,0 +1,259 @@
+"""
+Persist the settings of an XThing to `<path>.settings.yaml`
+
+Changes to `XThing.settings` are not written as they are made, which would
+block the threads of the handlers on the disk: they are batched, and written
+once they settled for `write_delay` seconds, by a background task of the server.
+The file is replaced atomically, so that a crash cannot leave it truncated.
+
+The file is also polled, by its modification time, for edits made by hand or by
+other tools. These are loaded, and the XThing is told which keys changed, see
+`XThing.settings_changed`.
+"""
+
+from __future__ import annotations
+from anyio import sleep, to_thread
+from collections.abc import Iterator, MutableMapping
+from typing import Any, Callable, Optional
+import copy
+import logging
+import os
+import tempfile
+import threading
+import time
+import yaml
+
+from .xthings_settings import YamlDumper, YamlLoader
+
+
+class ObservedSettings(MutableMapping):
+    """A dictionary of settings, which records the keys changed in it
+
+    Values changed in place, e.g. a list appended to, are not seen: call
+    `changed(key)` after doing so.
+
+    The settings are changed from the threads of the handlers, and written from
+    the event loop: `lock` guards them.
+    """
+
+    def __init__(
+        self,
+        data: dict,
+        on_change: Callable[[str], None],
+        lock: Optional[threading.RLock] = None,
+    ):
+        self._data = data
+        self._on_change = on_change
+        self._lock = lock or threading.RLock()
+
+    def __getitem__(self, key: str) -> Any:
+        return self._data[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._on_change(key)
+
+    def __delitem__(self, key: str) -> None:
+        with self._lock:
+            del self._data[key]
+            self._on_change(key)
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._data))
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"ObservedSettings({self._data!r})"
+
+    def changed(self, key: str) -> None:
+        """Mark a key changed, after its value was changed in place"""
+        with self._lock:
+            self._on_change(key)
+
+
+class SettingsStore:
+    """The settings of an XThing, and the YAML file they are persisted to"""
+
+    def __init__(
+        self,
+        filename: str,
+        write_delay: float = 1.0,
+        poll_interval: Optional[float] = 2.0,
+    ):
+        self._filename = filename
+        self._write_delay = write_delay
+        self._poll_interval = poll_interval
+        self._data: dict = {}
+        # guards _data and _dirty, changed in worker threads
+        self._lock = threading.RLock()
+        self._settings = ObservedSettings(self._data, self._on_change, self._lock)
+        self._dirty: set[str] = set()
+        self._first_change: Optional[float] = None
+        self._last_change: Optional[float] = None
+        # (st_mtime_ns, st_size, st_ino) of the file as last read or written
+        self._file_stat: Optional[tuple[int, int, int]] = None
+        self._writes = 0
+
+    @property
+    def filename(self) -> str:
+        return self._filename
+
+    @property
+    def settings(self) -> ObservedSettings:
+        return self._settings
+
+    @property
+    def dirty(self) -> bool:
+        """Whether there are changes which are not written yet"""
+        return bool(self._dirty)
+
+    @property
+    def writes(self) -> int:
+        """The number of times the file was written"""
+        return self._writes
+
+    def _on_change(self, key: str) -> None:
+        """Record a change, with the lock held"""
+        now = time.monotonic()
+        self._dirty.add(key)
+        if self._first_change is None:
+            self._first_change = now
+        self._last_change = now
+
+    def _stat(self) -> Optional[tuple[int, int, int]]:
+        try:
+            st = os.stat(self._filename)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _read(self) -> dict:
+        with open(self._filename, "r") as f:
+            return yaml.load(f, Loader=YamlLoader) or {}
+
+    def load(self) -> None:
+        """Read the file, if it exists"""
+        self._file_stat = self._stat()
+        if self._file_stat is not None:
+            data = self._read()
+            with self._lock:
+                self._data.clear()
+                self._data.update(data)
+
+    def replace(self, data: dict) -> None:
+        """Replace all the settings"""
+        with self._lock:
+            for key in set(self._data) | set(data):
+                self._on_change(key)
+            self._data.clear()
+            self._data.update(data)
+
+    def _write(self, data: dict) -> None:
+        folder = os.path.dirname(os.path.abspath(self._filename))
+        fd, tmp = tempfile.mkstemp(
+            dir=folder, prefix=f".{os.path.basename(self._filename)}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                yaml.dump(data, f, Dumper=YamlDumper, sort_keys=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self._filename)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self._file_stat = self._stat()
+        self._writes += 1
+
+    async def flush(self) -> None:
+        """Write the changes now, if there are any"""
+        with self._lock:
+            if not self._dirty:
+                return
+            # the snapshot and the keys it holds are taken together
+            data = copy.deepcopy(self._data)
+            keys, self._dirty = self._dirty, set()
+            self._first_change = self._last_change = None
+        try:
+            await to_thread.run_sync(self._write, data)
+        except BaseException:
+            # try again later, with the changes made since
+            with self._lock:
+                self._dirty |= keys
+                self._first_change = self._last_change = time.monotonic()
+            raise
+
+    def _due(self, now: float) -> bool:
+        """Whether the changes settled, or waited too long already"""
+        if not self._dirty or self._last_change is None:
+            return False
+        assert self._first_change is not None
+        return (
+            now - self._last_change >= self._write_delay
+            or now - self._first_change >= 10 * self._write_delay
+        )
+
+    async def reload_if_modified(self) -> set[str]:
+        """Load the file if it was edited by someone else, return changed keys
+
+        Changes which are not written yet win over the ones of the file.
+        """
+        stat = self._stat()
+        if stat is None or stat == self._file_stat:
+            return set()
+        try:
+            data = await to_thread.run_sync(self._read)
+        except (OSError, yaml.YAMLError) as e:
+            # e.g. the file is being written, try again at the next poll
+            logging.warning(f"Failed to reload {self._filename}: {e!r}")
+            return set()
+        self._file_stat = stat
+        with self._lock:
+            for key in self._dirty:
+                if key in self._data:
+                    data[key] = self._data[key]
+                else:
+                    data.pop(key, None)
+            changed = {
+                key
+                for key in set(self._data) | set(data)
+                if key not in data
+                or key not in self._data
+                or data[key] != self._data[key]
+            }
+            for key in changed:
+                if key in data:
+                    self._data[key] = data[key]
+                else:
+                    del self._data[key]
+        return changed
+
+    async def run(self, on_reload: Optional[Callable[[set[str]], Any]] = None):
+        """Write the changes once settled, and reload the file when edited
+
+        `on_reload` is awaited with the keys changed by an edit of the file.
+        """
+        tick = self._write_delay / 4
+        if self._poll_interval is not None:
+            tick = min(tick, self._poll_interval)
+        last_poll = time.monotonic()
+        while True:
+            await sleep(tick)
+            now = time.monotonic()
+            if self._due(now):
+                try:
+                    await self.flush()
+                except OSError as e:
+                    logging.error(f"Failed to write {self._filename}: {e!r}")
+            if (
+                self._poll_interval is not None
+                and now - last_poll >= self._poll_interval
+            ):
+                last_poll = now
+                changed = await self.reload_if_modified()
+                if changed and on_reload is not None:
+                    await on_reload(changed)
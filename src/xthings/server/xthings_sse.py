@@ -0,0 +1,150 @@
+"""
+Server-Sent Events, replayed from a bounded event log
+
+Every event published by an XThing is appended to the event log of the XThing and
+to the one of its server, under a monotonically increasing id. A client which
+reconnects with the `Last-Event-ID` header gets the events it missed from the log,
+or a `reset` event if they are not in the log anymore, in which case it should
+read the state it is interested in again.
+
+Ids start from the time the log was created, in microseconds, so the ids of a
+restarted server are larger than the ones of the previous run, and a client
+reconnecting to it gets a `reset` event rather than a wrong replay.
+"""
+
+from __future__ import annotations
+from anyio import Event
+from collections import deque
+from fastapi.responses import StreamingResponse
+from itertools import islice
+from typing import AsyncIterator, Optional
+import time
+
+from .xthings_events import EventMessage
+
+SSE_MEDIA_TYPE = "text/event-stream"
+
+
+class EventLog:
+    """The last `max_length` events, by id
+
+    The log is used from the event loop thread only.
+    """
+
+    def __init__(self, max_length: int = 1000):
+        if max_length <= 0:
+            raise ValueError("max_length must be > 0")
+        self._events: deque[tuple[int, EventMessage]] = deque(maxlen=max_length)
+        self._last_id = time.time_ns() // 1000
+        self._changed: Optional[Event] = None
+        self._followers = 0
+
+    @property
+    def last_id(self) -> int:
+        """The id of the last event, or of the start of the log if there is none"""
+        return self._last_id
+
+    @property
+    def next_id(self) -> int:
+        """The id the next appended event will get"""
+        return self._last_id + 1
+
+    @property
+    def followers(self) -> int:
+        """The number of clients following the log"""
+        return self._followers
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def append(self, event: EventMessage, event_id: Optional[int] = None) -> int:
+        """Log an event under the next id, or under `event_id`
+
+        Ids given by another log, e.g. in another process, may skip some. The
+        events logged before a skipped id are dropped, as they could not be
+        replayed without a gap.
+        """
+        if event_id is None:
+            event_id = self._last_id + 1
+        elif event_id != self._last_id + 1:
+            self._events.clear()
+        self._last_id = event_id
+        self._events.append((event_id, event))
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+        return self._last_id
+
+    def reset(self, last_id: int) -> None:
+        """Drop the logged events and continue after `last_id`"""
+        self._events.clear()
+        self._last_id = last_id
+
+    def since(self, last_id: int) -> Optional[list[tuple[int, EventMessage]]]:
+        """The events after `last_id`, or None if some of them are not logged"""
+        if last_id > self._last_id:
+            return None
+        first_id = self._events[0][0] if self._events else self._last_id + 1
+        if last_id < first_id - 1:
+            return None
+        return list(islice(self._events, last_id - first_id + 1, None))
+
+    async def follow(
+        self, last_id: Optional[int] = None
+    ) -> AsyncIterator[tuple[int, Optional[EventMessage]]]:
+        """Yield the events after `last_id`, then the new ones as they come
+
+        Following starts at the end of the log if `last_id` is None. If events
+        were missed, because the follower fell behind or `last_id` is unknown,
+        `(id, None)` is yielded and following resumes at the end of the log.
+        """
+        cursor = self._last_id if last_id is None else last_id
+        self._followers += 1
+        try:
+            while True:
+                events = self.since(cursor)
+                if events is None:
+                    cursor = self._last_id
+                    yield cursor, None
+                    continue
+                for cursor, event in events:
+                    yield cursor, event
+                if cursor == self._last_id:
+                    if self._changed is None:
+                        self._changed = Event()
+                    await self._changed.wait()
+        finally:
+            self._followers -= 1
+
+
+def format_sse(event_id: int, event: Optional[EventMessage]) -> str:
+    """An event frame, or a `reset` frame if `event` is None"""
+    if event is None:
+        return f"id: {event_id}\nevent: reset\ndata: {{}}\n\n"
+    return f"id: {event_id}\nevent: {event.message_type}\ndata: {event.text}\n\n"
+
+
+def parse_last_event_id(last_event_id: Optional[str]) -> Optional[int]:
+    """The id to resume from, -1 (always missed events) if it is not an id"""
+    if last_event_id is None:
+        return None
+    try:
+        return int(last_event_id)
+    except ValueError:
+        return -1
+
+
+async def sse_stream(
+    log: EventLog, last_event_id: Optional[str] = None
+) -> AsyncIterator[str]:
+    async for event_id, event in log.follow(parse_last_event_id(last_event_id)):
+        yield format_sse(event_id, event)
+
+
+def sse_response(log: EventLog, last_event_id: Optional[str] = None):
+    """Stream the events of a log, resuming after `last_event_id` if given"""
+    return StreamingResponse(
+        sse_stream(log, last_event_id),
+        media_type=SSE_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,302 @@
+"""
+Concurrent setup and teardown of the XThings of a server
+
+XThings are set up concurrently, each one once the XThings it depends on are
+up, and torn down concurrently, each one once the XThings which depend on it
+are down. Each setup may have a timeout.
+
+By default, the server does not start if an XThing fails to set up. In degraded
+mode, it serves the XThings which came up, and keeps retrying the others in the
+background. Until they are up, their routes answer 503 Service Unavailable.
+
+A setup which times out keeps running in its thread: it is not retried until
+that thread finishes, and the XThing is torn down if the setup completes.
+"""
+
+from __future__ import annotations
+from anyio import Event, create_task_group, fail_after, sleep
+from anyio.abc import TaskGroup
+from enum import Enum
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from typing import TYPE_CHECKING, Callable, Optional, Sequence
+import logging
+import time
+
+if TYPE_CHECKING:  # pragma: no cover
+    from ..xthing import XThing
+
+
+class StartupState(str, Enum):
+    PENDING = "pending"
+    STARTING = "starting"
+    READY = "ready"
+    FAILED = "failed"
+    STOPPED = "stopped"
+
+
+class XThingStartup(BaseModel):
+    path: str
+    state: StartupState
+    depends_on: list[str]
+    attempts: int
+    setup_time: Optional[float]
+    teardown_time: Optional[float]
+    error: Optional[str]
+
+
+class XThingLifecycle:
+    """The setup and teardown of one XThing"""
+
+    def __init__(
+        self,
+        xthing: XThing,
+        path: str,
+        depends_on: Sequence[str] = (),
+        timeout: Optional[float] = None,
+    ):
+        self.xthing = xthing
+        self.path = path
+        self.depends_on = tuple(depends_on)
+        self.timeout = timeout
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the previous lifespan of the server, if any"""
+        self.state = StartupState.PENDING
+        self.attempts = 0
+        self.setup_time: Optional[float] = None
+        self.teardown_time: Optional[float] = None
+        self.error: Optional[BaseException] = None
+        self.ready = Event()
+        self.settled = Event()
+        self.stopped = Event()
+
+    def report(self) -> XThingStartup:
+        return XThingStartup(
+            path=self.path,
+            state=self.state,
+            depends_on=list(self.depends_on),
+            attempts=self.attempts,
+            setup_time=self.setup_time,
+            teardown_time=self.teardown_time,
+            error=None if self.error is None else repr(self.error),
+        )
+
+    async def setup(self) -> None:
+        self.state = StartupState.STARTING
+        self.attempts += 1
+        start = time.perf_counter()
+        try:
+            with fail_after(self.timeout):
+                await self.xthing.__aenter__()
+        except BaseException as e:
+            self.state = StartupState.FAILED
+            self.error = e
+            raise
+        finally:
+            self.setup_time = time.perf_counter() - start
+        self.state = StartupState.READY
+        self.error = None
+        self.ready.set()
+        logging.info(f"{self.path} is up after {self.setup_time:.3f}s")
+
+    async def teardown(self) -> None:
+        start = time.perf_counter()
+        try:
+            with fail_after(self.timeout):
+                await self.xthing.__aexit__(None, None, None)
+        except Exception as e:
+            self.error = e
+            logging.error(f"Failed to tear down {self.path}: {e!r}")
+        finally:
+            self.teardown_time = time.perf_counter() - start
+            self.state = StartupState.STOPPED
+
+
+class StartupSupervisor:
+    """Set up and tear down XThings concurrently, in dependency order"""
+
+    def __init__(
+        self,
+        lifecycles: Sequence[XThingLifecycle],
+        degraded: bool = False,
+        retry_interval: float = 5.0,
+    ):
+        self._lifecycles = {lc.path: lc for lc in lifecycles}
+        self._degraded = degraded
+        self._retry_interval = retry_interval
+        self._changed = Event()
+        self._check_dependencies()
+
+    def _check_dependencies(self) -> None:
+        for lc in self._lifecycles.values():
+            for path in lc.depends_on:
+                if path not in self._lifecycles:
+                    raise ValueError(f"{lc.path} depends on unknown XThing {path}")
+        visiting: set[str] = set()
+        done: set[str] = set()
+
+        def visit(path: str) -> None:
+            if path in done:
+                return
+            if path in visiting:
+                raise ValueError(f"Circular dependency of XThing {path}")
+            visiting.add(path)
+            for dependency in self._lifecycles[path].depends_on:
+                visit(dependency)
+            visiting.discard(path)
+            done.add(path)
+
+        for path in self._lifecycles:
+            visit(path)
+
+    @property
+    def unavailable(self) -> frozenset[str]:
+        """The paths of the XThings which are not up"""
+        return frozenset(
+            path
+            for path, lc in self._lifecycles.items()
+            if lc.state != StartupState.READY
+        )
+
+    def reports(self) -> list[XThingStartup]:
+        return [lc.report() for lc in self._lifecycles.values()]
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = Event()
+
+    def _blocked(self, lc: XThingLifecycle) -> bool:
+        """Whether an XThing waits for a dependency which failed to set up"""
+        for path in lc.depends_on:
+            dependency = self._lifecycles[path]
+            if dependency.state == StartupState.READY:
+                continue
+            if dependency.settled.is_set() or self._blocked(dependency):
+                return True
+        return False
+
+    async def start(
+        self,
+        task_group: TaskGroup,
+        on_ready: Optional[Callable[[XThing], None]] = None,
+    ) -> None:
+        """Set up the XThings concurrently
+
+        Each XThing is passed to `on_ready` once it is up. Raise the first setup
+        error, once the XThings which were set up are torn down again. In
+        degraded mode, return once each XThing is up, or failed to set up once,
+        or waits for one which did: these are retried in `task_group`.
+        """
+        for lc in self._lifecycles.values():
+            lc.reset()
+        if not self._degraded:
+            errors: list[BaseException] = []
+
+            async def start_one(lc: XThingLifecycle):
+                try:
+                    await self._wait_for_dependencies(lc)
+                    await lc.setup()
+                except Exception as e:
+                    errors.append(e)
+                    tg.cancel_scope.cancel()
+                    return
+                if on_ready is not None:
+                    on_ready(lc.xthing)
+
+            async with create_task_group() as tg:
+                for lc in self._lifecycles.values():
+                    tg.start_soon(start_one, lc)
+            if errors:
+                await self.stop()
+                raise errors[0]
+            return
+
+        for lc in self._lifecycles.values():
+            task_group.start_soon(self._keep_starting, lc, on_ready)
+        while not all(
+            lc.settled.is_set() or self._blocked(lc) for lc in self._lifecycles.values()
+        ):
+            await self._changed.wait()
+
+    async def _wait_for_dependencies(self, lc: XThingLifecycle) -> None:
+        for path in lc.depends_on:
+            await self._lifecycles[path].ready.wait()
+
+    async def _keep_starting(
+        self,
+        lc: XThingLifecycle,
+        on_ready: Optional[Callable[[XThing], None]],
+    ) -> None:
+        await self._wait_for_dependencies(lc)
+        while True:
+            try:
+                await lc.setup()
+                break
+            except Exception as e:
+                logging.error(
+                    f"Failed to set up {lc.path} ({e!r}), "
+                    f"retrying in {self._retry_interval}s"
+                )
+                lc.settled.set()
+                self._notify()
+            await sleep(self._retry_interval)
+            # a setup which timed out still runs in its thread
+            while lc.xthing.setup_running:
+                await sleep(self._retry_interval)
+        lc.settled.set()
+        self._notify()
+        if on_ready is not None:
+            on_ready(lc.xthing)
+
+    async def stop(self) -> None:
+        """Tear down the XThings which are up, concurrently"""
+
+        async def stop_one(lc: XThingLifecycle):
+            for dependent in self._lifecycles.values():
+                if lc.path in dependent.depends_on:
+                    await dependent.stopped.wait()
+            if lc.state == StartupState.READY:
+                await lc.teardown()
+            lc.stopped.set()
+
+        async with create_task_group() as tg:
+            for lc in self._lifecycles.values():
+                tg.start_soon(stop_one, lc)
+
+
+class UnavailableXThingsMiddleware:
+    """Answer 503 to the requests to XThings which are not up"""
+
+    def __init__(
+        self,
+        app,
+        unavailable: Callable[[], frozenset[str]],
+        retry_after: float = 5.0,
+    ):
+        self.app = app
+        self.unavailable = unavailable
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            unavailable = self.unavailable()
+            if unavailable:
+                path = scope["path"]
+                for prefix in unavailable:
+                    if path == prefix or path.startswith(prefix + "/"):
+                        await self._refuse(scope, receive, send, prefix)
+                        return
+        await self.app(scope, receive, send)
+
+    async def _refuse(self, scope, receive, send, prefix: str) -> None:
+        if scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1013})
+            return
+        response = JSONResponse(
+            {"detail": f"{prefix} is not available"},
+            status_code=503,
+            headers={"Retry-After": str(max(1, round(self.retry_after)))},
+        )
+        await response(scope, receive, send)
@@ -0,0 +1,225 @@
+"""
+Bounded per-subscriber event queues, so a slow client never blocks the emitter
+"""
+
+from __future__ import annotations
+from anyio import ClosedResourceError, EndOfStream, Event
+from collections import deque
+from enum import Enum
+from pydantic import BaseModel
+from typing import Any, Callable, Hashable, Optional
+import time
+
+from .xthings_events import EventMessage
+
+
+class OverflowPolicy(str, Enum):
+    DROP_OLDEST = "drop_oldest"
+    CONFLATE = "conflate"
+    DISCONNECT = "disconnect"
+
+
+class SubscriberStatistics(BaseModel):
+    name: str
+    policy: OverflowPolicy
+    max_size: int
+    depth: int
+    max_depth: int
+    enqueued: int
+    delivered: int
+    dropped: int
+    conflated: int
+    overflowed: bool
+    lag_seconds: float
+    stalled_seconds: float
+    last_latency_seconds: float
+
+
+def event_key(item: Any) -> Optional[Hashable]:
+    """The key under which events are conflated: XThing, message type, affordance
+
+    Action status events are not conflated, see `EventMessage.key`.
+    """
+    if isinstance(item, EventMessage):
+        return item.key
+    try:
+        if item["messageType"] == "actionStatus":
+            return None
+        return (item.get("thing"), item["messageType"], next(iter(item["data"])))
+    except (AttributeError, KeyError, TypeError, StopIteration):
+        return None
+
+
+class SubscriberQueue:
+    """A bounded queue of events for one subscriber
+
+    `send` never waits for the subscriber. When the queue is full the overflow
+    policy decides what happens:
+    * drop_oldest: the oldest queued event is dropped
+    * conflate: an older queued property event of the same affordance is
+      replaced, or the oldest event is dropped if there is none
+    * disconnect: the queue is closed, and the subscriber should be disconnected
+
+    The queue is used from the event loop thread only.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 100,
+        policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        name: str = "",
+    ):
+        if max_size <= 0:
+            raise ValueError("max_size must be > 0")
+        self.name = name
+        # the path of the websocket endpoint the subscriber is connected to
+        self.endpoint = ""
+        # called once, when the queue is closed
+        self.on_close: Optional[Callable[[SubscriberQueue], None]] = None
+        self._max_size = max_size
+        self._policy = OverflowPolicy(policy)
+        self._queue: deque[tuple[float, Any]] = deque()
+        self._waiter: Optional[Event] = None
+        self._closed = False
+        self._overflowed = False
+        self._max_depth = 0
+        self._enqueued = 0
+        self._delivered = 0
+        self._dropped = 0
+        self._conflated = 0
+        self._last_latency = 0.0
+        # when events were last delivered, or arrived in an empty queue
+        self._progress_at = time.monotonic()
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def overflowed(self) -> bool:
+        return self._overflowed
+
+    @property
+    def dropped(self) -> int:
+        """The number of events dropped as the queue was full"""
+        return self._dropped
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    @property
+    def lag(self) -> float:
+        """How long the oldest queued event has been waiting, in seconds"""
+        return time.monotonic() - self._queue[0][0] if self._queue else 0.0
+
+    @property
+    def stalled_for(self) -> float:
+        """How long events have been queued without any being delivered
+
+        Unlike `lag`, this does not drop when the oldest events are dropped or
+        conflated to make room.
+        """
+        return time.monotonic() - self._progress_at if self._queue else 0.0
+
+    async def send(self, item: Any) -> None:
+        self.send_nowait(item)
+
+    def send_nowait(self, item: Any) -> None:
+        if self._closed:
+            raise ClosedResourceError
+        if len(self._queue) >= self._max_size and not self._make_room(item):
+            return
+        now = time.monotonic()
+        if not self._queue:
+            self._progress_at = now
+        self._queue.append((now, item))
+        self._enqueued += 1
+        self._max_depth = max(self._max_depth, len(self._queue))
+        self._wake_receiver()
+
+    def _make_room(self, item: Any) -> bool:
+        """Apply the overflow policy, return False if the item must not be queued"""
+        if self._policy == OverflowPolicy.DISCONNECT:
+            self._overflowed = True
+            self._dropped += 1
+            self.close()
+            return False
+        if self._policy == OverflowPolicy.CONFLATE:
+            key = event_key(item)
+            if key is not None:
+                for i, (_, queued) in enumerate(self._queue):
+                    if event_key(queued) == key:
+                        del self._queue[i]
+                        self._conflated += 1
+                        return True
+        self._queue.popleft()
+        self._dropped += 1
+        return True
+
+    async def receive(self) -> Any:
+        while not self._queue:
+            if self._closed:
+                raise EndOfStream
+            self._waiter = Event()
+            await self._waiter.wait()
+        enqueued_at, item = self._queue.popleft()
+        self._delivered += 1
+        self._progress_at = time.monotonic()
+        self._last_latency = self._progress_at - enqueued_at
+        return item
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            return await self.receive()
+        except EndOfStream:
+            raise StopAsyncIteration
+
+    def close(self) -> None:
+        """Stop accepting events, the receiver gets the ones already queued
+
+        An overflowed queue drops the queued events, as its subscriber is gone.
+        """
+        if not self._closed and self.on_close is not None:
+            self.on_close(self)
+        self._closed = True
+        if self._overflowed:
+            self._queue.clear()
+        self._wake_receiver()
+
+    def _wake_receiver(self) -> None:
+        if self._waiter is not None:
+            self._waiter.set()
+            self._waiter = None
+
+    async def aclose(self) -> None:
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_t, exc_v, exc_tb):
+        self.close()
+
+    def statistics(self) -> SubscriberStatistics:
+        return SubscriberStatistics(
+            name=self.name,
+            policy=self._policy,
+            max_size=self._max_size,
+            depth=len(self._queue),
+            max_depth=self._max_depth,
+            enqueued=self._enqueued,
+            delivered=self._delivered,
+            dropped=self._dropped,
+            conflated=self._conflated,
+            overflowed=self._overflowed,
+            lag_seconds=self.lag,
+            stalled_seconds=self.stalled_for,
+            last_latency_seconds=self._last_latency,
+        )
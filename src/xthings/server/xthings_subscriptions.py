@@ -0,0 +1,87 @@
+"""
+The registry of the event subscriptions of an XThing
+"""
+
+from __future__ import annotations
+from typing import Any, Hashable
+import threading
+
+WILDCARD = "*"
+
+Topic = tuple[str, str]
+
+
+class SubscriptionRegistry:
+    """Subscribers of one XThing, indexed by topic: (kind, affordance name)
+
+    The kind is "property" or "action", and the affordance name may be the
+    wildcard "*" to subscribe to every affordance of that kind.
+
+    Changes are made under a lock and replace the tuple of subscribers of a topic
+    (copy-on-write), so fanning out an event iterates over an immutable snapshot
+    without locking, even while other connections subscribe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics: dict[Topic, tuple[Any, ...]] = {}
+        self._subscriptions: dict[Hashable, frozenset[Topic]] = {}
+
+    def subscribe(self, kind: str, name: str, subscriber: Any) -> bool:
+        """Add a subscription, return False if it already existed"""
+        topic = (kind, name)
+        with self._lock:
+            subscribers = self._topics.get(topic, ())
+            if subscriber in subscribers:
+                return False
+            self._topics[topic] = subscribers + (subscriber,)
+            topics = self._subscriptions.get(subscriber, frozenset())
+            self._subscriptions[subscriber] = topics | {topic}
+            return True
+
+    def unsubscribe(self, kind: str, name: str, subscriber: Any) -> bool:
+        """Remove a subscription, return False if there was none"""
+        with self._lock:
+            return self._unsubscribe((kind, name), subscriber)
+
+    def _unsubscribe(self, topic: Topic, subscriber: Any) -> bool:
+        subscribers = self._topics.get(topic, ())
+        if subscriber not in subscribers:
+            return False
+        remaining = tuple(s for s in subscribers if s is not subscriber)
+        if remaining:
+            self._topics[topic] = remaining
+        else:
+            del self._topics[topic]
+        topics = self._subscriptions[subscriber] - {topic}
+        if topics:
+            self._subscriptions[subscriber] = topics
+        else:
+            del self._subscriptions[subscriber]
+        return True
+
+    def unsubscribe_all(self, subscriber: Any) -> frozenset[Topic]:
+        """Remove every subscription of a subscriber, return their topics"""
+        with self._lock:
+            topics = self._subscriptions.get(subscriber, frozenset())
+            for topic in topics:
+                self._unsubscribe(topic, subscriber)
+            return topics
+
+    def subscribers(self, kind: str, name: str) -> tuple[Any, ...]:
+        """Snapshot of the subscribers of an affordance, wildcards included"""
+        exact = self._topics.get((kind, name), ())
+        wildcard = self._topics.get((kind, WILDCARD), ())
+        if not wildcard or name == WILDCARD:
+            return exact
+        if not exact:
+            return wildcard
+        return tuple(dict.fromkeys(exact + wildcard))
+
+    def topics(self, subscriber: Any) -> frozenset[Topic]:
+        """The topics a subscriber is subscribed to"""
+        return self._subscriptions.get(subscriber, frozenset())
+
+    def __len__(self) -> int:
+        """The number of subscribers"""
+        return len(self._subscriptions)
@@ -3,49 +3,96 @@ Handle notification events, property and actionstatus change via websocket
 """
 
 from __future__ import annotations
-from anyio import create_memory_object_stream, create_task_group
-from anyio.abc import ObjectReceiveStream, ObjectSendStream
+from anyio import Semaphore, WouldBlock, create_task_group
 from fastapi import WebSocket, WebSocketDisconnect
-from fastapi.encoders import jsonable_encoder
-from json import JSONDecodeError
+from pydantic import ValidationError
 import logging
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Mapping, Optional
+
+from .xthings_encoding import Codec, JSON_CODEC, negotiate_codec
+from .xthings_events import EventMessage
+from .xthings_heartbeat import PONG, ConnectionActivity, Heartbeat
+from .xthings_sessions import SessionStore, WebSocketSession
+from .xthings_subscriber import SubscriberQueue
+from .xthings_subscriptions import Topic, WILDCARD
 
 
 if TYPE_CHECKING:  # pragma: no cover
     from ..xthing import XThing
 
+INTERACTION_MESSAGE_TYPES = frozenset(
+    {"readProperty", "writeProperty", "readMultipleProperties", "invokeAction"}
+)
+MAX_CONCURRENT_REQUESTS = 32
+
+
+async def send_to_websocket(websocket: WebSocket, item: Any, codec: Codec):
+    """Send one message, binary codecs send bytes and the others text
+
+    Events come pre-encoded and are sent as they are.
+    """
+    if isinstance(item, EventMessage):
+        frame = item.encoded(codec)
+    else:
+        frame = codec.encode(item)
+    if isinstance(frame, bytes):
+        await websocket.send_bytes(frame)
+    else:
+        await websocket.send_text(frame)
+
+
+async def receive_from_websocket(websocket: WebSocket, codec: Codec) -> Any:
+    """Receive and decode one message, text or binary"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    if message.get("bytes") is not None:
+        return codec.decode(message["bytes"])
+    return codec.decode(message.get("text") or "")
+
 
 async def send_message_to_websocket(
-    websocket: WebSocket, receive_stream: ObjectReceiveStream
+    websocket: WebSocket, receive_stream: SubscriberQueue, codec: Codec = JSON_CODEC
 ):
-    """Send objects from a stream to a websocket"""
+    """Send objects from a subscriber queue to a websocket"""
     async with receive_stream:
         async for item in receive_stream:
-            await websocket.send_json(jsonable_encoder(item))
+            await send_to_websocket(websocket, item, codec)
 
 
 async def receive_message_from_websocket(
-    websocket: WebSocket, send_stream: ObjectSendStream, xthing: XThing
+    websocket: WebSocket,
+    send_stream: SubscriberQueue,
+    dispatch: Callable[[Any, SubscriberQueue], Awaitable[Optional[dict]]],
+    codec: Codec = JSON_CODEC,
 ):
-    """Receive and relay message received from a websocket"""
+    """Receive and relay message received from a websocket
+
+    Replies are sent at once, unless `dispatch` sends them through the queue, in
+    order with the events, and returns None.
+    """
     while True:
         try:
-            data = await websocket.receive_json()
-            result = dispatch_message(data, send_stream, xthing)
-            await websocket.send_json(jsonable_encoder(result))
+            data = await receive_from_websocket(websocket, codec)
+            result = await dispatch(data, send_stream)
+            if result is not None:
+                await send_to_websocket(websocket, result, codec)
         except WebSocketDisconnect:
             await send_stream.aclose()
             return
-        except JSONDecodeError:
-            await websocket.send_json(
-                jsonable_encoder(
-                    {"status": "error", "errorMessage": "JSONDecoderError"}
-                )
+        except ValueError:
+            # JSONDecodeError, and the decoding errors of the binary codecs
+            error = "JSONDecoderError" if codec.name == "json" else "DecodeError"
+            await send_to_websocket(
+                websocket, {"status": "error", "errorMessage": error}, codec
             )
 
 
-def dispatch_message(data, send_stream: ObjectSendStream, xthing: XThing):
+def dispatch_message(data, send_stream: SubscriberQueue, xthing: XThing):
+    """Add or remove the observations requested by a message
+
+    Observing the affordance "*" observes every property or action of the XThing.
+    """
     try:
         if data["messageType"] == "addPropertyObservation":
             for key in data["data"].keys():
@@ -53,13 +100,21 @@ def dispatch_message(data, send_stream: ObjectSendStream, xthing: XThing):
         elif data["messageType"] == "addActionObservation":
             for key in data["data"].keys():
                 xthing.add_action_observer_by_attr(key, send_stream)
+        elif data["messageType"] == "removePropertyObservation":
+            for key in data["data"].keys():
+                xthing.remove_property_observer_by_attr(key, send_stream)
+        elif data["messageType"] == "removeActionObservation":
+            for key in data["data"].keys():
+                xthing.remove_action_observer_by_attr(key, send_stream)
         else:
             raise ValueError(
-                "messageType must be 'addPropertyObservation' or 'addActionObservation'"
+                "messageType must be 'addPropertyObservation', "
+                "'addActionObservation', 'removePropertyObservation' or "
+                "'removeActionObservation'"
             )
         return {"status": "success"}
-    except KeyError as e:
-        logging.error(f"Got a bad websocket message: {data}, caused KeyError {e}")
+    except (KeyError, TypeError) as e:
+        logging.error(f"Got a bad websocket message: {data}, caused {e!r}")
         return {"status": "error", "errorMessage": "BadKey"}
     except ValueError as e:
         logging.error(f"Got a bad value for 'messateType' caused ValueError {e}")
@@ -69,11 +124,318 @@ def dispatch_message(data, send_stream: ObjectSendStream, xthing: XThing):
         return {"status": "error", "errorMessage": "BadAttribute"}
 
 
-async def websocket_endpoint(xthing: XThing, websocket: WebSocket):
-    """Handle communication to a client via websocket"""
-    await websocket.accept()
-    send_stream, receive_stream = create_memory_object_stream[dict]()
+def find_xthing(
+    data, xthings: Mapping[str, XThing], default: Optional[str] = None
+) -> Optional[XThing]:
+    """The XThing a message is about, by its "thing" path or the default one"""
+    try:
+        path = data.get("thing", default)
+    except AttributeError:
+        path = default
+    return xthings.get(path) if isinstance(path, str) else None
+
+
+async def handle_interaction(data, xthing: XThing) -> dict:
+    """Read or write properties, or invoke an action, and return the reply
+
+    Replies carry the "requestId" of the request, as requests are handled
+    concurrently and may complete in any order.
+    """
+    reply: dict[str, Any] = {"requestId": data.get("requestId")}
+    try:
+        message_type = data["messageType"]
+        if message_type == "readMultipleProperties":
+            names = list(data["names"])
+        else:
+            names = [data["name"]]
+        if message_type == "invokeAction":
+            affordances: Mapping[str, Any] = xthing.actions
+        else:
+            affordances = xthing.properties
+        for name in names:
+            if name not in affordances:
+                reply.update(status="error", errorMessage="UnknownAffordance")
+                reply["name"] = name
+                return reply
+
+        if message_type == "readProperty":
+            reply["value"] = await xthing.read_property(data["name"])
+        elif message_type == "writeProperty":
+            await xthing.write_property(data["name"], data["value"])
+        elif message_type == "readMultipleProperties":
+            values: dict[str, Any] = {}
+
+            async def read(name: str):
+                values[name] = await xthing.read_property(name)
+
+            async with create_task_group() as tg:
+                for name in names:
+                    tg.start_soon(read, name)
+            reply["values"] = {name: values[name] for name in names}
+        else:
+            reply["invocation"] = await xthing.invoke_action(
+                data["name"], data.get("input")
+            )
+        reply["status"] = "success"
+    except (KeyError, TypeError) as e:
+        logging.error(f"Got a bad websocket request: {data}, caused {e!r}")
+        reply.update(status="error", errorMessage="BadKey")
+    except ValidationError as e:
+        reply.update(status="error", errorMessage="ValidationError")
+        reply["detail"] = e.errors(include_url=False, include_context=False)
+    except Exception as e:
+        logging.error(f"Failed to handle websocket request {data}: {e!r}")
+        reply.update(status="error", errorMessage="InteractionError", detail=str(e))
+    return reply
+
+
+async def snapshot(xthing: XThing, topics: frozenset[Topic]) -> dict:
+    """The current values of the properties among some topics of an XThing"""
+    seq = xthing.event_log.last_id
+    if ("property", WILDCARD) in topics:
+        names = list(xthing.properties)
+    else:
+        names = [name for kind, name in topics if kind == "property"]
+    values = {}
+    for name in names:
+        try:
+            values[name] = await xthing.read_property(name)
+        except Exception as e:
+            logging.error(f"Failed to read property {name} for a snapshot: {e}")
+    return {"messageType": "snapshot", "thing": xthing.path, "seq": seq, "data": values}
+
+
+async def resume_session(
+    data,
+    send_stream: SubscriberQueue,
+    session: WebSocketSession,
+    sessions: Optional[SessionStore],
+    xthings: Mapping[str, XThing],
+) -> Optional[dict]:
+    """Take over a closed session: restore its subscriptions and send what was missed
+
+    "lastSeq" is the "seq" of the last event received from the XThing, or a
+    mapping of XThing path to it on the multiplexed websocket. The events after
+    it are replayed if they are all still in the event log of the XThing and fit
+    in the queue, otherwise a snapshot of the observed properties is sent.
+
+    The reply, the replayed events and the snapshots go through the queue, so
+    they are received in order.
+    """
+    try:
+        session_id = data["sessionId"]
+        last_seq = data.get("lastSeq")
+    except (KeyError, TypeError, AttributeError):
+        return {"status": "error", "errorMessage": "BadKey"}
+    previous = None
+    if sessions is not None and isinstance(session_id, str):
+        previous = sessions.resume(session, session_id)
+    if previous is None:
+        return {
+            "status": "error",
+            "errorMessage": "UnknownSession",
+            "sessionId": session.session_id,
+        }
+    if not isinstance(last_seq, dict):
+        last_seq = {path: last_seq for path in previous.subscriptions}
+
+    send_stream.send_nowait({"status": "success", "sessionId": session.session_id})
+    for path, topics in previous.subscriptions.items():
+        xthing = xthings.get(path)
+        if xthing is None:
+            continue
+        for kind, name in topics:
+            if kind == "property":
+                xthing.add_property_observer_by_attr(name, send_stream)
+            else:
+                xthing.add_action_observer_by_attr(name, send_stream)
+
+        seq = last_seq.get(path)
+        events = xthing.event_log.since(seq) if isinstance(seq, int) else None
+        if events is not None:
+            missed = [
+                event
+                for _, event in events
+                if event.topic in topics or (event.topic[0], WILDCARD) in topics
+            ]
+            if len(missed) < send_stream.max_size - len(send_stream):
+                for event in missed:
+                    send_stream.send_nowait(event)
+                continue
+        send_stream.send_nowait(await snapshot(xthing, topics))
+    return None
+
+
+async def serve_websocket(
+    websocket: WebSocket,
+    queue: Optional[SubscriberQueue],
+    xthings: Mapping[str, XThing],
+    sessions: Optional[SessionStore],
+    name: str,
+    default_thing: Optional[str] = None,
+    heartbeat: Optional[Heartbeat] = None,
+):
+    """Run the send and receive loops of a websocket until it closes
+
+    Messages are about the XThing of their "thing" path, or `default_thing`.
+    Replies to messages which name their XThing name it too.
+
+    The connection is a session of `sessions`, whose id is in the replies to
+    successful requests. Once the connection is closed, its subscriptions to
+    `xthings` are dropped, and recorded for a new connection to resume them.
+
+    `heartbeat` pings the client, and reaps the connection if it is dead.
+    """
+    codec = negotiate_codec(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=codec.subprotocol)
+    if queue is None:
+        queue = SubscriberQueue()
+    if not queue.name and websocket.client is not None:
+        queue.name = f"{websocket.client.host}:{websocket.client.port}{name}"
+    queue.endpoint = name
+    session = sessions.create() if sessions is not None else WebSocketSession()
+    requests = Semaphore(MAX_CONCURRENT_REQUESTS)
+    activity = ConnectionActivity()
+    reaped = False
+
+    async def interact(data, xthing: XThing, thing: dict):
+        try:
+            reply = {**thing, **await handle_interaction(data, xthing)}
+            try:
+                await send_to_websocket(websocket, reply, codec)
+            except Exception as e:
+                # e.g. a value the codec can not encode, the client still
+                # expects a reply to its request
+                logging.warning(f"Failed to reply to websocket request {data}: {e!r}")
+                error = {"requestId": reply.get("requestId"), "status": "error"}
+                error.update(errorMessage="InteractionError", detail=str(e))
+                await send_to_websocket(websocket, {**thing, **error}, codec)
+        except Exception as e:
+            logging.warning(f"Failed to reply to websocket request {data}: {e!r}")
+        finally:
+            requests.release()
+
+    try:
+        async with create_task_group() as tg:
+
+            async def dispatch(data, send_stream: SubscriberQueue):
+                is_dict = isinstance(data, dict)
+                message_type = data.get("messageType") if is_dict else None
+                activity.received(pong=message_type == "pong")
+                if message_type == "pong":
+                    return None
+                if message_type == "ping":
+                    return PONG
+                if message_type == "resume":
+                    return await resume_session(
+                        data, send_stream, session, sessions, xthings
+                    )
+                xthing = find_xthing(data, xthings, default_thing)
+                if xthing is None:
+                    logging.error(f"Got a websocket message for no XThing: {data}")
+                    return {"status": "error", "errorMessage": "UnknownThing"}
+                thing = {"thing": xthing.path} if is_dict and "thing" in data else {}
+                if message_type in INTERACTION_MESSAGE_TYPES:
+                    # handled concurrently, the number of requests in flight is
+                    # bounded, past it requests are refused rather than queued
+                    try:
+                        requests.acquire_nowait()
+                    except WouldBlock:
+                        logging.warning(f"Refused websocket request {data}, busy")
+                        busy = {"requestId": data.get("requestId"), "status": "error"}
+                        return {**thing, **busy, "errorMessage": "Busy"}
+                    tg.start_soon(interact, data, xthing, thing)
+                    return None
+                result = dispatch_message(data, send_stream, xthing)
+                if sessions is not None and result.get("status") == "success":
+                    result["sessionId"] = session.session_id
+                return {**thing, **result}
+
+            async def send_until_closed():
+                await send_message_to_websocket(websocket, queue, codec)
+                tg.cancel_scope.cancel()
+
+            async def reap_if_dead(heartbeat: Heartbeat):
+                nonlocal reaped
+                reaped = await heartbeat.watch(queue, activity)
+                tg.cancel_scope.cancel()
+
+            tg.start_soon(send_until_closed)
+            if heartbeat is not None:
+                tg.start_soon(reap_if_dead, heartbeat)
+            tg.start_soon(
+                receive_message_from_websocket, websocket, queue, dispatch, codec
+            )
+    finally:
+        subscriptions = {
+            path: xthing.remove_observer(queue) for path, xthing in xthings.items()
+        }
+        if sessions is not None:
+            sessions.release(session, subscriptions)
+        queue.close()
+    if queue.overflowed:
+        logging.warning(f"Disconnecting {queue.name}, it fell too far behind")
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            ...
+    elif reaped:
+        try:
+            await websocket.close(code=1001)
+        except Exception:
+            ...
+
+
+async def websocket_endpoint(
+    xthing: XThing,
+    websocket: WebSocket,
+    queue: Optional[SubscriberQueue] = None,
+    sessions: Optional[SessionStore] = None,
+    heartbeat: Optional[Heartbeat] = None,
+):
+    """Handle communication to a client via websocket
+
+    Events for the client are buffered in a bounded queue of its own, so a slow
+    client only ever delays itself. A client which overflows a queue with the
+    "disconnect" policy is disconnected.
+
+    Besides observations, clients may send "readProperty", "writeProperty",
+    "readMultipleProperties" and "invokeAction" requests, see
+    `handle_interaction`. Past `MAX_CONCURRENT_REQUESTS` requests in flight,
+    requests are refused with a "Busy" error.
+
+    Dead connections are reaped by the `heartbeat`, which may also ping the
+    client with {"messageType": "ping"}, see `Heartbeat`.
+
+    A client which was disconnected may send a "resume" message with its former
+    "sessionId" and the "lastSeq" it received, see `resume_session`.
+
+    Messages are JSON text unless the client asks for the "xthings.msgpack" or
+    "xthings.cbor" subprotocol, which are binary.
+    """
+    await serve_websocket(
+        websocket,
+        queue,
+        {xthing.path: xthing},
+        sessions,
+        xthing.path,
+        xthing.path,
+        heartbeat,
+    )
+
+
+async def multiplexed_websocket_endpoint(
+    xthings: Mapping[str, XThing],
+    websocket: WebSocket,
+    queue: Optional[SubscriberQueue] = None,
+    sessions: Optional[SessionStore] = None,
+    heartbeat: Optional[Heartbeat] = None,
+):
+    """Handle communication to a client observing several XThings on one websocket
 
-    async with create_task_group() as tg:
-        tg.start_soon(send_message_to_websocket, websocket, receive_stream)
-        tg.start_soon(receive_message_from_websocket, websocket, send_stream, xthing)
+    Messages carry the path of the XThing they are about in "thing", events for
+    all XThings share the send queue of the connection.
+    """
+    await serve_websocket(
+        websocket, queue, xthings, sessions, "/ws", heartbeat=heartbeat
+    )
@@ -0,0 +1,619 @@
+"""
+Serve the XThings of one process from several HTTP worker processes
+
+In multi-worker mode, the owner process sets up the XThings and owns their
+hardware, and runs no HTTP server. Worker processes serve HTTP and websockets
+for the same XThings, without setting them up:
+* the owner publishes every event to the workers over a Unix socket, and the
+  workers fan them out to their own observers, with the same ids and "seq"
+* the encoded frames of image streams are copied to shared memory rings, and
+  the workers are notified of each new frame over the socket
+* workers forward property reads and writes, and action invocations, to the
+  owner, which handles them as websocket interaction requests
+* workers forward the queries and cancellations of invocations to the owner,
+  where the invocations run
+* workers forward the list, create, retrieve, update, delete and batch
+  requests of LCRUD collections to the owner, where the collections live
+
+Messages on the socket are JSON, prefixed by their length as 4 bytes.
+
+Workers follow the event log of the owner server, so polled properties are
+sampled as long as workers are connected, as for Server-Sent Events clients.
+Property histories are per process.
+
+A forwarded request which the owner does not reply to within the
+`request_timeout` of the `WorkerBridge` fails, with a 504 over HTTP.
+"""
+
+from __future__ import annotations
+from anyio import (
+    BrokenResourceError,
+    ClosedResourceError,
+    EndOfStream,
+    Event,
+    IncompleteRead,
+    Lock,
+    TASK_STATUS_IGNORED,
+    connect_unix,
+    create_task_group,
+    create_unix_listener,
+    fail_after,
+    sleep,
+)
+from anyio.abc import ByteStream, TaskStatus
+from anyio.streams.buffered import BufferedByteReceiveStream
+from enum import Enum
+from fastapi import HTTPException
+from multiprocessing import resource_tracker, shared_memory
+from typing import TYPE_CHECKING, Any, Optional, cast
+import itertools
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+import pydantic
+
+from ..errors import RemoteInteractionError
+from .xthings_encoding import encode_json
+from .xthings_events import EventMessage
+from .xthings_websocket import handle_interaction
+
+if TYPE_CHECKING:  # pragma: no cover
+    from ..streaming import ImageStream
+    from ..xthing import XThing
+    from .xthings_server import XThingsServer
+
+ROLE_ENVIRONMENT_VARIABLE = "XTHINGS_ROLE"
+IPC_PATH_ENVIRONMENT_VARIABLE = "XTHINGS_IPC_PATH"
+
+_LENGTH = struct.Struct(">I")
+_DISCONNECTED = (EndOfStream, IncompleteRead, BrokenResourceError, ClosedResourceError)
+
+INVOCATION_MESSAGE_TYPES = frozenset({"queryAction", "queryAllActions", "cancelAction"})
+
+
+class ServerRole(str, Enum):
+    STANDALONE = "standalone"
+    OWNER = "owner"
+    WORKER = "worker"
+
+
+def default_ipc_path() -> str:
+    return os.path.join(tempfile.gettempdir(), f"xthings-{os.getuid()}.sock")
+
+
+async def send_ipc_message(stream: ByteStream, lock: Lock, payload: bytes) -> None:
+    async with lock:
+        await stream.send(_LENGTH.pack(len(payload)) + payload)
+
+
+async def receive_ipc_message(receiver: BufferedByteReceiveStream) -> Any:
+    (length,) = _LENGTH.unpack(await receiver.receive_exactly(_LENGTH.size))
+    return json.loads(await receiver.receive_exactly(length))
+
+
+class SharedFrameRing:
+    """A ring of encoded frames in shared memory, written by one process
+
+    Each slot starts with the index and the size of its frame. The writer sets
+    the index to -1 while it writes a slot, and readers check the index again
+    after copying a frame, so they never return a frame being overwritten.
+    """
+
+    HEADER = struct.Struct("<qq")
+
+    def __init__(
+        self,
+        name: Optional[str] = None,
+        slots: int = 10,
+        slot_size: int = 4 * 2**20,
+        create: bool = False,
+    ):
+        self.slots = slots
+        self.slot_size = slot_size
+        self._stride = self.HEADER.size + slot_size
+        if create:
+            self._shm = shared_memory.SharedMemory(
+                name, create=True, size=slots * self._stride
+            )
+            for slot in range(slots):
+                self.HEADER.pack_into(self._buffer, slot * self._stride, -1, 0)
+        elif sys.version_info >= (3, 13):
+            # the memory belongs to the writer, it must not be unlinked when a
+            # reader process exits
+            self._shm = shared_memory.SharedMemory(name, track=False)
+        else:
+            self._shm = shared_memory.SharedMemory(name)
+            name = self._shm._name  # type: ignore[attr-defined]
+            resource_tracker.unregister(name, "shared_memory")
+        self._owner = create
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def _buffer(self) -> memoryview:
+        return cast(memoryview, self._shm.buf)
+
+    def write(self, index: int, frame: bytes) -> bool:
+        """Copy a frame to its slot, return False if it is too large"""
+        if len(frame) > self.slot_size:
+            return False
+        offset = (index % self.slots) * self._stride
+        buffer = self._buffer
+        self.HEADER.pack_into(buffer, offset, -1, 0)
+        start = offset + self.HEADER.size
+        buffer[start : start + len(frame)] = frame
+        self.HEADER.pack_into(buffer, offset, index, len(frame))
+        return True
+
+    def read(self, index: int) -> Optional[bytes]:
+        """A copy of a frame, or None if it was overwritten"""
+        offset = (index % self.slots) * self._stride
+        buffer = self._buffer
+        slot_index, size = self.HEADER.unpack_from(buffer, offset)
+        if slot_index != index:
+            return None
+        start = offset + self.HEADER.size
+        frame = bytes(buffer[start : start + size])
+        if self.HEADER.unpack_from(buffer, offset)[0] != index:
+            return None
+        return frame
+
+    def close(self) -> None:
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def _image_streams(server: XThingsServer):
+    for path, xthing in server.xthings.items():
+        for name, descriptor in xthing._streams.items():
+            yield path, name, descriptor.__get__(xthing)
+
+
+class OwnerBridge:
+    """Publish the events and frames of the XThings of the owner process to
+    worker processes, and handle the interactions they forward"""
+
+    def __init__(
+        self,
+        server: XThingsServer,
+        path: Optional[str] = None,
+        frame_slots: int = 10,
+        frame_slot_size: int = 4 * 2**20,
+    ):
+        self._server = server
+        self._path = path or default_ipc_path()
+        self._frame_slots = frame_slots
+        self._frame_slot_size = frame_slot_size
+        self._rings: dict[tuple[str, str], SharedFrameRing] = {}
+        self._workers: dict[ByteStream, Lock] = {}
+
+    @property
+    def workers(self) -> int:
+        """The number of connected worker processes"""
+        return len(self._workers)
+
+    async def run(self, *, task_status: TaskStatus = TASK_STATUS_IGNORED) -> None:
+        """Serve the workers until cancelled"""
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        listener = await create_unix_listener(self._path)
+        try:
+            for path, name, _ in _image_streams(self._server):
+                self._rings[(path, name)] = SharedFrameRing(
+                    slots=self._frame_slots,
+                    slot_size=self._frame_slot_size,
+                    create=True,
+                )
+            async with listener, create_task_group() as tg:
+                for path, name, stream in _image_streams(self._server):
+                    tg.start_soon(self._forward_frames, path, name, stream)
+                task_status.started()
+                await listener.serve(self._serve_worker, tg)
+        finally:
+            for ring in self._rings.values():
+                ring.close()
+            if os.path.exists(self._path):
+                os.unlink(self._path)
+
+    async def _serve_worker(self, stream: ByteStream) -> None:
+        lock = Lock()
+        server = self._server
+        last_id = server.event_log.last_id
+        hello = {
+            "messageType": "hello",
+            "lastId": last_id,
+            "things": {p: x.event_log.last_id for p, x in server.xthings.items()},
+            "streams": [
+                {
+                    "thing": path,
+                    "stream": name,
+                    "shm": ring.name,
+                    "slots": ring.slots,
+                    "slotSize": ring.slot_size,
+                }
+                for (path, name), ring in self._rings.items()
+            ],
+        }
+        await send_ipc_message(stream, lock, encode_json(hello))
+        self._workers[stream] = lock
+        try:
+            async with stream, create_task_group() as tg:
+                tg.start_soon(self._forward_events, stream, lock, last_id)
+                receiver = BufferedByteReceiveStream(stream)
+                try:
+                    while True:
+                        request = await receive_ipc_message(receiver)
+                        tg.start_soon(self._handle_request, stream, lock, request)
+                except _DISCONNECTED:
+                    logging.info("A worker process disconnected")
+                tg.cancel_scope.cancel()
+        finally:
+            self._workers.pop(stream, None)
+
+    async def _forward_events(self, stream: ByteStream, lock: Lock, last_id: int):
+        async for event_id, event in self._server.event_log.follow(last_id):
+            if event is None:
+                logging.warning("A worker process fell behind and missed events")
+                continue
+            payload = f'{{"messageType":"event","id":{event_id},"event":{event.text}}}'
+            try:
+                await send_ipc_message(stream, lock, payload.encode())
+            except (BrokenResourceError, ClosedResourceError):
+                return
+
+    async def _handle_request(self, stream: ByteStream, lock: Lock, request: dict):
+        xthing = self._server.xthings.get(request.get("thing"))
+        if request.get("messageType") in INVOCATION_MESSAGE_TYPES:
+            reply = await self._handle_invocation_request(request, xthing)
+        elif xthing is None:
+            reply = {
+                "requestId": request.get("requestId"),
+                "status": "error",
+                "errorMessage": "UnknownThing",
+            }
+        elif request.get("messageType") == "lcrud":
+            reply = await self._handle_lcrud_request(request, xthing)
+        else:
+            reply = await handle_interaction(request, xthing)
+        reply["messageType"] = "reply"
+        try:
+            await send_ipc_message(stream, lock, encode_json(reply))
+        except (BrokenResourceError, ClosedResourceError):
+            ...
+
+    async def _handle_invocation_request(
+        self, request: dict, xthing: Optional[XThing]
+    ) -> dict:
+        manager = self._server.action_manager
+        reply: dict[str, Any] = {
+            "requestId": request.get("requestId"),
+            "status": "success",
+        }
+        message_type = request["messageType"]
+        if message_type == "queryAllActions":
+            action = None
+            if request.get("thing") is not None:
+                if xthing is None:
+                    reply.update(status="error", errorMessage="UnknownThing")
+                    return reply
+                action = xthing.actions.get(request.get("name") or "")
+            invocations = await manager.list_invocation(action, xthing)
+            reply["invocations"] = [i.model_dump(mode="json") for i in invocations]
+            return reply
+        invocation = await manager.get_invocation(request.get("id"))
+        if invocation is None:
+            reply.update(status="error", errorMessage="UnknownInvocation")
+        elif message_type == "cancelAction":
+            invocation.cancel()
+        else:
+            reply["invocation"] = invocation.response().model_dump(mode="json")
+        return reply
+
+    async def _handle_lcrud_request(self, request: dict, xthing: XThing) -> dict:
+        reply: dict[str, Any] = {
+            "requestId": request.get("requestId"),
+            "status": "success",
+        }
+        descriptor = xthing._lcruds.get(request.get("name") or "")
+        if descriptor is None:
+            reply.update(status="error", errorMessage="UnknownAffordance")
+            return reply
+        try:
+            reply["result"] = await descriptor.handle_remote_call(
+                xthing, request["operation"], list(request.get("args") or [])
+            )
+        except HTTPException as e:
+            reply.update(status="error", errorMessage="HTTPException")
+            reply.update(statusCode=e.status_code, detail=e.detail)
+        except pydantic.ValidationError as e:
+            reply.update(status="error", errorMessage="ValidationError")
+            reply["detail"] = e.errors(include_url=False, include_context=False)
+        except (KeyError, TypeError, ValueError) as e:
+            logging.error(f"Got a bad LCRUD request from a worker: {request}, {e!r}")
+            reply.update(status="error", errorMessage="BadKey")
+        except Exception as e:
+            logging.error(f"Failed to handle LCRUD request {request}: {e!r}")
+            reply.update(status="error", errorMessage="InteractionError")
+            reply["detail"] = str(e)
+        return reply
+
+    async def _forward_frames(self, path: str, name: str, stream: ImageStream):
+        ring = self._rings[(path, name)]
+        while True:
+            index = await stream.next_frame()
+            try:
+                async with stream.buffer_for_reading(index) as frame:
+                    written = ring.write(index, frame)
+            except ValueError:
+                continue
+            if not written:
+                logging.warning(f"A frame of {path}/{name} is too large to share")
+                continue
+            payload = encode_json(
+                {"messageType": "frame", "thing": path, "stream": name, "index": index}
+            )
+            for worker, lock in list(self._workers.items()):
+                try:
+                    await send_ipc_message(worker, lock, payload)
+                except (BrokenResourceError, ClosedResourceError):
+                    ...
+
+
+class WorkerBridge:
+    """Relay the events and frames of the owner process to the observers of a
+    worker process, and forward interactions to the owner"""
+
+    def __init__(
+        self,
+        server: XThingsServer,
+        path: Optional[str] = None,
+        reconnect_interval: float = 1.0,
+        request_timeout: float = 30.0,
+    ):
+        self._server = server
+        self._path = path or default_ipc_path()
+        self._reconnect_interval = reconnect_interval
+        self.request_timeout = request_timeout
+        self._stream: Optional[ByteStream] = None
+        self._lock = Lock()
+        self._request_ids = itertools.count()
+        self._pending: dict[int, tuple[Event, list]] = {}
+        self._rings: dict[tuple[str, str], SharedFrameRing] = {}
+        self._connected = Event()
+        self._dropped_frames = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._stream is not None
+
+    @property
+    def dropped_frames(self) -> int:
+        """Frames which were overwritten, or found their slot still being read"""
+        return self._dropped_frames
+
+    async def wait_connected(self) -> None:
+        await self._connected.wait()
+
+    async def run(self) -> None:
+        """Stay connected to the owner process until cancelled"""
+        while True:
+            try:
+                stream = await connect_unix(self._path)
+            except OSError as e:
+                logging.info(f"Waiting for the owner process at {self._path}: {e}")
+                await sleep(self._reconnect_interval)
+                continue
+            try:
+                async with stream:
+                    await self._relay(stream)
+            except _DISCONNECTED:
+                logging.warning("Lost the connection to the owner process")
+            finally:
+                self._disconnected()
+            await sleep(self._reconnect_interval)
+
+    async def _relay(self, stream: ByteStream) -> None:
+        receiver = BufferedByteReceiveStream(stream)
+        hello = await receive_ipc_message(receiver)
+        self._server.event_log.reset(hello["lastId"])
+        for path, last_id in hello["things"].items():
+            xthing = self._server.xthings.get(path)
+            if xthing is not None:
+                xthing.event_log.reset(last_id)
+        for entry in hello["streams"]:
+            self._rings[(entry["thing"], entry["stream"])] = SharedFrameRing(
+                entry["shm"], entry["slots"], entry["slotSize"]
+            )
+        self._stream = stream
+        self._connected.set()
+        while True:
+            message = await receive_ipc_message(receiver)
+            message_type = message.get("messageType")
+            if message_type == "event":
+                await self._deliver_event(message["id"], message["event"])
+            elif message_type == "frame":
+                await self._deliver_frame(message)
+            elif message_type == "reply":
+                self._deliver_reply(message)
+
+    def _disconnected(self) -> None:
+        self._stream = None
+        self._connected = Event()
+        for ring in self._rings.values():
+            ring.close()
+        self._rings.clear()
+        for event, result in self._pending.values():
+            result.append({"status": "error", "errorMessage": "OwnerDisconnected"})
+            event.set()
+        self._pending.clear()
+
+    async def _deliver_event(self, event_id: int, message: dict) -> None:
+        xthing = self._server.xthings.get(message.get("thing"))
+        if xthing is None:
+            return
+        ((name, value),) = message["data"].items()
+        event = EventMessage(
+            message["messageType"], name, value, xthing.path, message.get("seq")
+        )
+        await xthing.deliver_event(event, event_id)
+
+    async def _deliver_frame(self, message: dict) -> None:
+        ring = self._rings.get((message["thing"], message["stream"]))
+        xthing = self._server.xthings.get(message["thing"])
+        if ring is None or xthing is None:
+            return
+        frame = ring.read(message["index"])
+        if frame is None:
+            self._dropped_frames += 1
+            return
+        stream = xthing._streams[message["stream"]].__get__(xthing)
+        try:
+            await stream.add_encoded_frame(frame)
+        except RuntimeError:
+            # a slow viewer still reads the slot, as in the owner process the
+            # frame is skipped
+            self._dropped_frames += 1
+
+    def _deliver_reply(self, message: dict) -> None:
+        pending = self._pending.pop(message["requestId"], None)
+        if pending is not None:
+            event, result = pending
+            result.append(message)
+            event.set()
+
+    async def request(self, xthing: Optional[XThing], message: dict) -> dict:
+        """Forward an interaction to the owner process, return its reply
+
+        Raise RemoteInteractionError if the owner could not handle it, or did
+        not reply within `request_timeout` seconds.
+        """
+        stream = self._stream
+        if stream is None:
+            raise RemoteInteractionError("OwnerDisconnected")
+        request_id = next(self._request_ids)
+        event, result = Event(), cast(list[dict], [])
+        self._pending[request_id] = (event, result)
+        thing = None if xthing is None else xthing.path
+        payload = encode_json({**message, "thing": thing, "requestId": request_id})
+        try:
+            with fail_after(self.request_timeout):
+                await send_ipc_message(stream, self._lock, payload)
+                await event.wait()
+        except TimeoutError:
+            raise RemoteInteractionError(
+                "Timeout", f"No reply from the owner process in {self.request_timeout}s"
+            )
+        finally:
+            self._pending.pop(request_id, None)
+        reply = result[0]
+        if reply.get("status") != "success":
+            raise RemoteInteractionError(
+                reply["errorMessage"], reply.get("detail"), reply.get("statusCode")
+            )
+        return reply
+
+    async def read_property(self, xthing: XThing, name: str) -> Any:
+        reply = await self.request(
+            xthing, {"messageType": "readProperty", "name": name}
+        )
+        return reply["value"]
+
+    async def write_property(self, xthing: XThing, name: str, value: Any) -> None:
+        await self.request(
+            xthing, {"messageType": "writeProperty", "name": name, "value": value}
+        )
+
+    async def invoke_action(self, xthing: XThing, name: str, input: Any) -> Any:
+        reply = await self.request(
+            xthing, {"messageType": "invokeAction", "name": name, "input": input}
+        )
+        return reply["invocation"]
+
+    async def query_action(self, id: Any) -> dict:
+        reply = await self.request(None, {"messageType": "queryAction", "id": str(id)})
+        return reply["invocation"]
+
+    async def query_all_actions(
+        self, xthing: Optional[XThing] = None, name: Optional[str] = None
+    ) -> list[dict]:
+        reply = await self.request(
+            xthing, {"messageType": "queryAllActions", "name": name}
+        )
+        return reply["invocations"]
+
+    async def cancel_action(self, id: Any) -> None:
+        await self.request(None, {"messageType": "cancelAction", "id": str(id)})
+
+    async def call_lcrud(
+        self, xthing: XThing, name: str, operation: str, args: tuple
+    ) -> Any:
+        reply = await self.request(
+            xthing,
+            {
+                "messageType": "lcrud",
+                "name": name,
+                "operation": operation,
+                "args": list(args),
+            },
+        )
+        return reply["result"]
+
+
+def _run_owner(app_factory: str, ipc_path: str) -> None:  # pragma: no cover
+    """Entry point of the owner process: set up the XThings, serve no HTTP"""
+    import anyio
+    from uvicorn.importer import import_from_string
+
+    os.environ[ROLE_ENVIRONMENT_VARIABLE] = ServerRole.OWNER.value
+    os.environ[IPC_PATH_ENVIRONMENT_VARIABLE] = ipc_path
+    server: XThingsServer = import_from_string(app_factory)()
+
+    async def main():
+        async with server.lifespan(server.app):
+            await anyio.sleep_forever()
+
+    anyio.run(main)
+
+
+def run_workers(
+    app_factory: str,
+    workers: int,
+    host: str = "0.0.0.0",
+    port: int = 8000,
+    ipc_path: Optional[str] = None,
+    **uvicorn_options: Any,
+) -> None:  # pragma: no cover
+    """Run the owner process, and `workers` uvicorn worker processes
+
+    `app_factory` is the "module:function" import string of a function which
+    returns the XThingsServer. It is called in every process, and the server
+    reads its role from the environment.
+    """
+    import multiprocessing
+    import uvicorn
+
+    ipc_path = ipc_path or default_ipc_path()
+    owner = multiprocessing.get_context("spawn").Process(
+        target=_run_owner, args=(app_factory, ipc_path), name="xthings-owner"
+    )
+    owner.start()
+    os.environ[ROLE_ENVIRONMENT_VARIABLE] = ServerRole.WORKER.value
+    os.environ[IPC_PATH_ENVIRONMENT_VARIABLE] = ipc_path
+    try:
+        uvicorn.run(
+            app_factory,
+            factory=True,
+            workers=workers,
+            host=host,
+            port=port,
+            **uvicorn_options,
+        )
+    finally:
+        owner.terminate()
+        owner.join()
@@ -1,54 +1,110 @@
-import asyncio
-import socket
-import time
-from zeroconf import IPVersion, get_all_addresses, Zeroconf, ServiceInfo
+"""
+Announce the XThings of a server over mDNS, with the async zeroconf API
 
+The registration lives in the event loop of the server, from its lifespan: it
+occupies no thread, and services are registered concurrently, so XThings which
+come up late can be announced too.
+"""
 
-class CancelToken:
-    cancelled = False
+from __future__ import annotations
+from typing import Optional, Sequence
+from zeroconf import InterfaceChoice, IPVersion, ServiceInfo
+from zeroconf.asyncio import AsyncZeroconf
+import ifaddr
+import logging
+import socket
 
 
-def register_mdns(xthing_services, port, properties, server, cancel_token):
-    ip_version = IPVersion.V4Only
-    mdns_addresses = [
-        socket.inet_aton(i)
-        for i in get_all_addresses()
-        if i not in ("127.0.0.1", "0.0.0.0") and not i.startswith("169.254")
+def mdns_addresses(interfaces: Optional[Sequence[str]] = None) -> list[bytes]:
+    """The addresses to announce: the given interfaces, or else all the IPv4
+    addresses of the host but loopback and link-local ones"""
+    if interfaces is not None:
+        return [socket.inet_aton(i) for i in interfaces]
+    return [
+        socket.inet_aton(ip.ip)
+        for adapter in ifaddr.get_adapters()
+        for ip in adapter.ips
+        if isinstance(ip.ip, str)
+        and ip.ip not in ("127.0.0.1", "0.0.0.0")
+        and not ip.ip.startswith("169.254")
     ]
 
-    infos = []
-    for service_type, service_name in xthing_services:
-        infos.append(
-            ServiceInfo(
+
+class MdnsRegistration:
+    """Register services while the registration is open
+
+    `interfaces` are the IPv4 addresses to announce from, all of them if None.
+    Use ["127.0.0.1"] to keep the announcements on the host, e.g. in tests.
+    """
+
+    def __init__(
+        self,
+        port: int,
+        properties: Optional[dict[str, str]] = None,
+        server: Optional[str] = None,
+        interfaces: Optional[Sequence[str]] = None,
+    ):
+        self._port = port
+        self._properties = properties or {}
+        self._server = server
+        self._interfaces = interfaces
+        self._zeroconf: Optional[AsyncZeroconf] = None
+        self._registered: list[ServiceInfo] = []
+
+    @property
+    def registered(self) -> list[str]:
+        """The names of the registered services"""
+        return [info.name for info in self._registered]
+
+    async def __aenter__(self) -> MdnsRegistration:
+        self._zeroconf = AsyncZeroconf(
+            interfaces=(
+                list(self._interfaces)
+                if self._interfaces is not None
+                else InterfaceChoice.All
+            ),
+            ip_version=IPVersion.V4Only,
+        )
+        return self
+
+    async def __aexit__(self, exc_t, exc_v, exc_tb) -> None:
+        zeroconf, self._zeroconf = self._zeroconf, None
+        if zeroconf is None:
+            return
+        try:
+            await zeroconf.async_unregister_all_services()
+        finally:
+            self._registered.clear()
+            await zeroconf.async_close()
+
+    async def register(self, services: Sequence[tuple[str, str]]) -> None:
+        """Register (service type, service name) pairs concurrently
+
+        A service which cannot be registered, e.g. as its name is taken on the
+        network, is logged and skipped.
+        """
+        if self._zeroconf is None:
+            raise RuntimeError("The mDNS registration is not open")
+        addresses = mdns_addresses(self._interfaces)
+        pending = []
+        for service_type, service_name in services:
+            info = ServiceInfo(
                 service_type,
                 service_name,
-                addresses=mdns_addresses,
-                port=port,
-                properties=properties,
-                server=server,
+                addresses=addresses,
+                port=self._port,
+                properties=self._properties,
+                server=self._server,
             )
-        )
-
-    zeroconf = Zeroconf(ip_version=ip_version)
-    for info in infos:
-        zeroconf.register_service(info)
-    try:
-        while not cancel_token.cancelled:
-            time.sleep(0.1)
-    finally:
-        print("Unregistering...")
-        for info in infos:
-            zeroconf.unregister_service(info)
-        zeroconf.close()
-
-
-def run_mdns_in_executor(xthing_services, port, properties, server):
-    cancel_token = CancelToken()
-    asyncio.get_running_loop().run_in_executor(
-        None, register_mdns, xthing_services, port, properties, server, cancel_token
-    )
-    return cancel_token
-
-
-def stop_mdns_thread(cancel_token):
-    cancel_token.cancelled = True
+            try:
+                task = await self._zeroconf.async_register_service(info)
+                pending.append((info, task))
+            except Exception as e:
+                logging.error(f"Failed to register {service_name} over mDNS: {e!r}")
+        for info, task in pending:
+            try:
+                await task
+            except Exception as e:
+                logging.error(f"Failed to register {info.name} over mDNS: {e!r}")
+                continue
+            self._registered.append(info)
@@ -1,6 +1,7 @@
-from .image_streaming import ImageStream, ImageStreamResponse
+from .image_streaming import ImageStream, ImageStreamResponse, ImageStreamStatistics
 
 __all__ = [
     "ImageStream",
     "ImageStreamResponse",
+    "ImageStreamStatistics",
 ]
@@ -1,5 +1,7 @@
+from collections import deque
 from dataclasses import dataclass
 from datetime import datetime
+from pydantic import BaseModel
 from typing import (
     AsyncIterator,
     Optional,
@@ -12,6 +14,7 @@ from contextlib import asynccontextmanager
 import anyio
 
 import numpy as np
+import time
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:  # pragma: no cover
@@ -26,6 +29,16 @@ class RingBuffEntry:
     readers_refcount: int = 0
 
 
+class ImageStreamStatistics(BaseModel):
+    frames: int
+    fps: float
+    encode_seconds_total: float
+    ringbuffer_size: int
+    ringbuffer_occupancy: int
+    viewers: int
+    skipped_frames: int
+
+
 class ImageStreamResponse(StreamingResponse):
     media_type = "multipart/x-mixed-replace; boundary=frame"
 
@@ -65,6 +78,12 @@ class ImageStream:
         self.imencode = imencode_func
         self.stream_response_type = stream_response_type_func
         self.get_content_type = get_content_type_func
+        # counted whether metrics are enabled or not, as they cost next to nothing
+        self._frames = 0
+        self._frame_times: deque[float] = deque(maxlen=32)
+        self._encode_seconds = 0.0
+        self._viewers = 0
+        self._skipped_frames = 0
 
         self.reset(ringbuffer_size=ringbuffer_size)
 
@@ -115,13 +134,43 @@ class ImageStream:
             return self.last_frame_i
 
     async def frame_async_generator(self) -> AsyncGenerator[bytes, None]:
-        while self._streaming:
-            try:
-                i = await self.next_frame()
-                async with self.buffer_for_reading(i) as frame:
-                    yield frame
-            except Exception:
-                return
+        self._viewers += 1
+        last_i: Optional[int] = None
+        try:
+            while self._streaming:
+                try:
+                    i = await self.next_frame()
+                    if last_i is not None and i > last_i + 1:
+                        # the viewer was too slow for the frames in between
+                        self._skipped_frames += i - last_i - 1
+                    last_i = i
+                    async with self.buffer_for_reading(i) as frame:
+                        yield frame
+                except Exception:
+                    return
+        finally:
+            self._viewers -= 1
+
+    def _count_frame(self) -> None:
+        now = time.monotonic()
+        self._frames += 1
+        self._frame_times.append(now)
+
+    def statistics(self) -> ImageStreamStatistics:
+        """Frames in, encode time, ring buffer occupancy and viewers"""
+        times = self._frame_times
+        fps = 0.0
+        if len(times) >= 2 and time.monotonic() - times[-1] < 2.0:
+            fps = (len(times) - 1) / max(times[-1] - times[0], 1e-9)
+        return ImageStreamStatistics(
+            frames=self._frames,
+            fps=fps,
+            encode_seconds_total=self._encode_seconds,
+            ringbuffer_size=len(self._ringbuffer),
+            ringbuffer_occupancy=sum(1 for e in self._ringbuffer if e.index >= 0),
+            viewers=self._viewers,
+            skipped_frames=self._skipped_frames,
+        )
 
     async def image_stream_response(self) -> ImageStreamResponse:
         return ImageStreamResponse(self.frame_async_generator(), self.get_content_type)
@@ -134,8 +183,11 @@ class ImageStream:
             if entry.readers_refcount > 0:
                 raise RuntimeError("Cannot write to ringbuffer while it is being read")
             entry.timestamp = datetime.now()
+            start = time.perf_counter()
             success, array = self.imencode(frame)
+            self._encode_seconds += time.perf_counter() - start
             if success:
+                self._count_frame()
                 entry.frame = array.tobytes()
                 entry.index = self.last_frame_i + 1
                 if (
@@ -148,6 +200,20 @@ class ImageStream:
 
             return success
 
+    async def add_encoded_frame(self, frame: bytes) -> None:
+        """Add a frame encoded elsewhere, e.g. in another process
+
+        This method runs in the event loop thread."""
+        with self._lock:
+            entry = self._ringbuffer[(self.last_frame_i + 1) % len(self._ringbuffer)]
+            if entry.readers_refcount > 0:
+                raise RuntimeError("Cannot write to ringbuffer while it is being read")
+            entry.timestamp = datetime.now()
+            entry.frame = frame
+            entry.index = self.last_frame_i + 1
+            self._count_frame()
+        await self.notify_new_frame(entry.index)
+
     async def notify_new_frame(self, i):
         """Notify any waiting tasks that a new frame is available
 
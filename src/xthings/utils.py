@@ -1,5 +1,20 @@
+from anyio import CapacityLimiter
+from typing import Any, Callable, Optional
+import anyio.to_thread
+import inspect
+
+
 def pathjoin(pa, pb):
     pa = pa.rstrip("/")
     pb = pb.lstrip("/")
 
     return pa + "/" + pb
+
+
+async def run_handler(
+    func: Callable, *args, limiter: Optional[CapacityLimiter] = None
+) -> Any:
+    """Await an async handler directly, or run a sync one in a worker thread"""
+    if inspect.iscoroutinefunction(func):
+        return await func(*args)
+    return await anyio.to_thread.run_sync(func, *args, limiter=limiter)
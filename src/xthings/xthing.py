@@ -3,23 +3,52 @@ The XThing class
 """
 
 from __future__ import annotations
+from anyio import CapacityLimiter, get_cancelled_exc_class
 from anyio.to_thread import run_sync
 from anyio.from_thread import BlockingPortal
-from anyio.abc import ObjectSendStream
-from fastapi import Request
-from typing import Any, TYPE_CHECKING, Optional
-from weakref import WeakSet
+from anyio.abc import TaskGroup
+from fastapi import Header, Request
+from typing import Annotated, Any, TYPE_CHECKING, Optional
+import inspect
+import logging
+import threading
 
-from .server import websocket_endpoint, WebSocket
+from .server import (
+    websocket_endpoint,
+    WebSocket,
+    SubscriberQueue,
+    EventMessage,
+    SubscriptionRegistry,
+    Topic,
+    WILDCARD,
+    EventLog,
+    sse_response,
+)
+from .server.xthings_description import EncodedDescription, description_response
 from .descriptors import (
     XThingsDescriptor,
     ActionDescriptor,
     PropertyDescriptor,
     ImageStreamDescriptor,
+    LcrudDescriptor,
 )
+from .descriptors.xthings import is_descriptor
 
 if TYPE_CHECKING:  # pragma: no cover
     from .server import XThingsServer
+    from .server.xthings_metrics import XThingsMetrics
+    from .server.xthings_settings_store import SettingsStore
+    from .server.xthings_workers import WorkerBridge
+
+
+class _SetupThread:
+    """A setup running in a worker thread, which the event loop may abandon"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.completed = False
+        self.abandoned = False
+        self.finished = False
 
 
 class XThing:
@@ -27,25 +56,85 @@ class XThing:
     _properties: dict[str, Any] = {}
     _actions: dict[str, Any] = {}
     _streams: dict[str, Any] = {}
+    _lcruds: dict[str, Any] = {}
     _components: dict[str, Any] = {}
     _blocking_portal: Optional[BlockingPortal] = None
-    _observers: dict[str, WeakSet[ObjectSendStream]] = {}
-    _property_observers: dict[str, WeakSet[ObjectSendStream]] = {}
-    _action_observers: dict[str, WeakSet[ObjectSendStream]] = {}
+    _task_group: Optional[TaskGroup] = None
     _settings: dict = {}
+    _thread_limit: int = 8
+    _event_log_length: int = 1000
+    _server_event_log: Optional[EventLog] = None
+    _remote: Optional[WorkerBridge] = None
+    _settings_store: Optional[SettingsStore] = None
+    _metrics: Optional[XThingsMetrics] = None
+    _setup_thread: Optional[_SetupThread] = None
     _ut_probe: Any
 
     def __init__(self, service_type, service_name):
         self._service_type = service_type
         self._service_name = service_name
+        self._capacity_limiters: dict[str, CapacityLimiter] = {}
+        self._subscriptions = SubscriptionRegistry()
+        self._event_log = EventLog(self._event_log_length)
+        # base URL -> encoded Thing Description
+        self._encoded_descriptions: dict[str, EncodedDescription] = {}
 
     async def __aenter__(self):
-        """Asynchronous Context management is used to setup the XThing"""
-        return await run_sync(self.setup)
+        """Asynchronous Context management is used to setup the XThing
+
+        If the setup times out, its thread is abandoned rather than waited for.
+        The XThing is torn down once an abandoned setup completes, and
+        `setup_running` is True until then.
+        """
+        attempt = _SetupThread()
+        self._setup_thread = attempt
+
+        def setup():
+            try:
+                result = self.setup()
+            except BaseException:
+                attempt.finished = True
+                raise
+            with attempt.lock:
+                attempt.completed = True
+                attempt.finished = not attempt.abandoned
+            if not attempt.finished:
+                self._teardown_abandoned_setup(attempt)
+            return result
+
+        try:
+            return await run_sync(setup, abandon_on_cancel=True)
+        except get_cancelled_exc_class():
+            with attempt.lock:
+                attempt.abandoned = True
+                # the setup completed as it was cancelled, nothing waits for it
+                late = attempt.completed and attempt.finished
+                if late:
+                    attempt.finished = False
+            if late:
+                threading.Thread(
+                    target=self._teardown_abandoned_setup, args=(attempt,)
+                ).start()
+            raise
+
+    @property
+    def setup_running(self) -> bool:
+        """Whether a setup runs, including one which timed out"""
+        attempt = self._setup_thread
+        return attempt is not None and not attempt.finished
+
+    def _teardown_abandoned_setup(self, attempt: _SetupThread):
+        logging.warning(f"An abandoned setup of {self.path} completed, tearing down")
+        try:
+            self.teardown()
+        except Exception as e:
+            logging.error(f"Failed to tear down {self.path}: {e!r}")
+        finally:
+            attempt.finished = True
 
     async def __aexit__(self, exc_t, exc_v, exc_tb):
         """Asynchronous Context management is used to shutdown the XThing"""
-        return await run_sync(self.teardown)
+        return await run_sync(self.teardown, abandon_on_cancel=True)
 
     @property
     def path(self):
@@ -53,16 +142,61 @@ class XThing:
 
     @property
     def settings(self):
+        """The settings of the XThing
+
+        Once the XThing is added to a server, changes to them are written to its
+        settings file, see `SettingsStore`.
+        """
+        if self._settings_store is not None:
+            return self._settings_store.settings
         return self._settings
 
     @settings.setter  # type: ignore[no-redef]
     def settings(self, val):
-        self._settings = val
+        if self._settings_store is not None:
+            self._settings_store.replace(val)
+        else:
+            self._settings = val
+
+    def settings_changed(self, keys: set[str]):
+        """Apply settings which were changed by an edit of the settings file
+
+        Subclass may override this method. It runs in a worker thread.
+        """
 
     @property
     def action_manager(self):
         return self._action_manager
 
+    @property
+    def thread_limit(self) -> int:
+        """Max number of worker threads running sync handlers of this XThing"""
+        return self._thread_limit
+
+    @thread_limit.setter
+    def thread_limit(self, val: int):
+        self._thread_limit = val
+        limiter = self._capacity_limiters.get("")
+        if limiter is not None:
+            limiter.total_tokens = val
+
+    def capacity_limiter(
+        self, name: str = "", total_tokens: Optional[int] = None
+    ) -> CapacityLimiter:
+        """The capacity limiter for sync property and LCRUD handlers
+
+        All handlers of this XThing share the unnamed limiter, so a burst of slow
+        hardware calls cannot exhaust the worker threads of the whole server. A
+        descriptor may ask for a named limiter of its own instead.
+
+        Limiters are created lazily as they must be created in the event loop.
+        """
+        if name not in self._capacity_limiters:
+            self._capacity_limiters[name] = CapacityLimiter(
+                total_tokens or self._thread_limit
+            )
+        return self._capacity_limiters[name]
+
     def setup(self):
         """Setup the XThing hardware or other initialization operations
 
@@ -89,61 +223,242 @@ class XThing:
         """Add HTTP handlers to the app for this XThing"""
         self._path = path
         self._action_manager = server.action_manager
+        self._server_event_log = server.event_log
+        self._metrics = server.metrics
+        self._properties = {}
+        self._actions = {}
+        self._streams = {}
+        self._lcruds = {}
+        self.invalidate_description()
 
         for name, xdescriptor in XThingsDescriptor.get_xthings_descriptors(self):
-            if isinstance(xdescriptor, PropertyDescriptor):
+            if is_descriptor(xdescriptor, PropertyDescriptor):
                 self._properties[name] = xdescriptor
-            elif isinstance(xdescriptor, ActionDescriptor):
+            elif is_descriptor(xdescriptor, ActionDescriptor):
                 self._actions[name] = xdescriptor
-            elif isinstance(xdescriptor, ImageStreamDescriptor):
+            elif is_descriptor(xdescriptor, ImageStreamDescriptor):
                 self._streams[name] = xdescriptor
+            elif is_descriptor(xdescriptor, LcrudDescriptor):
+                self._lcruds[name] = xdescriptor
             else:
                 pass
             xdescriptor.add_to_app(server.app, self)
 
         # register XThing description endpoint
         def get_TD(request: Request):
-            return self.description(base=str(request.base_url))
+            return description_response(
+                request, self.encoded_description(str(request.base_url))
+            )
 
-        server.app.get(
-            self.path, response_model_exclude_none=True, response_model_by_alias=True
-        )(get_TD)
+        server.app.get(self.path)(get_TD)
 
         # register XThing websocket endpoint
         async def websocket(ws: WebSocket):
-            await websocket_endpoint(self, ws)
+            await websocket_endpoint(
+                self,
+                ws,
+                server.create_subscriber_queue(),
+                server.sessions,
+                server.heartbeat,
+            )
 
         server.app.websocket(self.path + "/ws")(websocket)
 
-    def property_observers(self, attr: str) -> WeakSet[ObjectSendStream[Any]]:
-        if attr not in self._property_observers.keys():
-            self._property_observers[attr] = WeakSet()
-        return self._property_observers[attr]
+        # register XThing Server-Sent Events endpoint
+        async def events(last_event_id: Annotated[Optional[str], Header()] = None):
+            self.start_sampling()
+            return sse_response(self._event_log, last_event_id)
 
-    def action_observers(self, attr: str) -> WeakSet[ObjectSendStream[Any]]:
-        if attr not in self._action_observers.keys():
-            self._action_observers[attr] = WeakSet()
-        return self._action_observers[attr]
+        server.app.get(self.path + "/events")(events)
+
+    @property
+    def subscriptions(self) -> SubscriptionRegistry:
+        return self._subscriptions
+
+    @property
+    def properties(self) -> dict[str, PropertyDescriptor]:
+        return self._properties
+
+    @property
+    def actions(self) -> dict[str, ActionDescriptor]:
+        return self._actions
+
+    async def read_property(self, name: str) -> Any:
+        """Read a property from the event loop thread"""
+        return await self._properties[name].aget(self)
+
+    async def write_property(self, name: str, value: Any) -> None:
+        """Validate and write a property from the event loop thread"""
+        descriptor = self._properties[name]
+        await descriptor.aset(self, descriptor.validate(value))
+
+    async def invoke_action(self, name: str, input: Any = None) -> Any:
+        """Validate the input and start an action, return the invocation model"""
+        if self._remote is not None:
+            return await self._remote.invoke_action(self, name, input)
+        descriptor = self._actions[name]
+        invocation = await descriptor.invoke(self, descriptor.validate_input(input))
+        return invocation.response()
+
+    @property
+    def event_log(self) -> EventLog:
+        return self._event_log
+
+    def has_property_observers(self, attr: str) -> bool:
+        """Whether events of a property are observed or followed over SSE"""
+        return (
+            len(self.property_observers(attr)) > 0
+            or self._event_log.followers > 0
+            or (
+                self._server_event_log is not None
+                and self._server_event_log.followers > 0
+            )
+        )
+
+    def property_observers(self, attr: str) -> tuple[SubscriberQueue, ...]:
+        """Snapshot of the observers of a property, wildcard observers included"""
+        return self._subscriptions.subscribers("property", attr)
+
+    def action_observers(self, attr: str) -> tuple[SubscriberQueue, ...]:
+        """Snapshot of the observers of an action, wildcard observers included"""
+        return self._subscriptions.subscribers("action", attr)
 
     def add_property_observer_by_attr(
-        self, attr: str, observer_stream: ObjectSendStream
+        self, attr: str, observer_stream: SubscriberQueue
     ) -> None:
-        self.property_observers(attr).add(observer_stream)
+        self._subscriptions.subscribe("property", attr, observer_stream)
+        if attr == WILDCARD:
+            self.start_sampling()
+        elif attr in self._properties:
+            self._properties[attr].start_sampling(self)
 
     def add_action_observer_by_attr(
-        self, attr: str, observer_stream: ObjectSendStream
+        self, attr: str, observer_stream: SubscriberQueue
+    ) -> None:
+        self._subscriptions.subscribe("action", attr, observer_stream)
+
+    def remove_property_observer_by_attr(
+        self, attr: str, observer_stream: SubscriberQueue
     ) -> None:
-        self.action_observers(attr).add(observer_stream)
+        self._subscriptions.unsubscribe("property", attr, observer_stream)
+
+    def remove_action_observer_by_attr(
+        self, attr: str, observer_stream: SubscriberQueue
+    ) -> None:
+        self._subscriptions.unsubscribe("action", attr, observer_stream)
+
+    async def publish_event(self, message_type: str, name: str, value: Any) -> None:
+        """Send a propertyStatus or actionStatus event to its observers
 
-    def description(self, path: Optional[str] = None, base: Optional[str] = None):
-        return {
+        The event is encoded once, whatever the number of observers, and logged
+        for Server-Sent Events clients. An event which cannot be encoded is
+        logged and dropped, as the change it reports has been made already. This
+        method runs in the event loop thread.
+        """
+        try:
+            event = EventMessage(
+                message_type,
+                name,
+                value,
+                getattr(self, "_path", None),
+                self._event_log.next_id,
+            )
+        except (TypeError, ValueError) as e:
+            logging.error(f"Failed to encode the {message_type} of {name}: {e!r}")
+            return
+        await self.deliver_event(event)
+
+    async def deliver_event(
+        self, event: EventMessage, server_event_id: Optional[int] = None
+    ) -> None:
+        """Log an event and send it to its observers
+
+        Events relayed from another process keep their "seq", and the id they
+        were given by the server of that process.
+        """
+        self._event_log.append(event, event.seq)
+        if self._server_event_log is not None:
+            self._server_event_log.append(event, server_event_id)
+        if event.message_type == "propertyStatus":
+            observers = self.property_observers(event.name)
+        else:
+            observers = self.action_observers(event.name)
+        for observer in observers:
+            try:
+                await observer.send(event)
+            except Exception as e:
+                # a closed observer must not stop the others from being notified
+                logging.debug(f"Failed to notify an observer of {event.name}: {e}")
+
+    def start_sampling(self) -> None:
+        """Start sampling all the properties which have a poll interval"""
+        for descriptor in self._properties.values():
+            descriptor.start_sampling(self)
+
+    def start_background_tasks(self) -> None:
+        """Start sampling the properties that keep a history"""
+        for descriptor in self._properties.values():
+            if descriptor.history_length is not None:
+                descriptor.start_sampling(self)
+
+    def remove_observer(self, observer_stream: SubscriberQueue) -> frozenset[Topic]:
+        """Stop sending property and action events to an observer stream
+
+        Return the topics it was subscribed to.
+        """
+        return self._subscriptions.unsubscribe_all(observer_stream)
+
+    def description(self, base: Optional[str] = None) -> dict[str, Any]:
+        """The W3C Thing Description of the XThing, built from its descriptors"""
+        description: dict[str, Any] = {
+            "@context": "https://www.w3.org/2022/wot/td/v1.1",
+            "id": f"urn:xthings:{self._service_name}",
+            "title": type(self).__name__,
+            "securityDefinitions": {"nosec_sc": {"scheme": "nosec"}},
+            "security": "nosec_sc",
             "properties": {
-                key: item.description() for (key, item) in self._properties.items()
+                key: item.description(self) for (key, item) in self._properties.items()
             },
             "actions": {
-                key: item.description() for (key, item) in self._actions.items()
+                key: item.description(self) for (key, item) in self._actions.items()
             },
             "streams": {
-                key: item.description() for (key, item) in self._streams.items()
+                key: item.description(self) for (key, item) in self._streams.items()
             },
+            "forms": [
+                {
+                    "href": self.path + "/events",
+                    "op": ["subscribeallevents", "unsubscribeallevents"],
+                    "subprotocol": "sse",
+                    "contentType": "text/event-stream",
+                },
+                {
+                    "href": self.path + "/ws",
+                    "op": ["observeallproperties", "unobserveallproperties"],
+                    "contentType": "application/json",
+                },
+            ],
         }
+        doc = inspect.getdoc(type(self))
+        if doc:
+            description["description"] = doc
+        if base is not None:
+            description["base"] = base
+        return description
+
+    def encoded_description(self, base: str) -> EncodedDescription:
+        """The Thing Description, encoded once for each base URL it is served at"""
+        try:
+            return self._encoded_descriptions[base]
+        except KeyError:
+            pass
+        if len(self._encoded_descriptions) >= 16:
+            # e.g. a client sending random Host headers
+            self._encoded_descriptions.clear()
+        encoded = EncodedDescription.encode(self.description(base=base))
+        self._encoded_descriptions[base] = encoded
+        return encoded
+
+    def invalidate_description(self) -> None:
+        """Drop the encoded Thing Description, once affordances changed"""
+        self._encoded_descriptions.clear()
@@ -0,0 +1,64 @@
+"""
+Benchmark fanning out one property event to N websocket subscribers
+
+Compares encoding the event in every subscriber's send task, as the websocket
+endpoint used to, with encoding it once at emit time. Run with:
+
+    python tests/benchmarks/bench_fanout.py
+"""
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+import anyio
+import json
+import time
+
+from xthings.server import SubscriberQueue
+from xthings.xthing import XThing
+
+SUBSCRIBERS = (1, 100, 1000)
+EVENTS = 20
+
+
+class Reading(BaseModel):
+    name: str
+    values: list[float]
+
+
+async def fan_out(n_subscribers: int, encode_once: bool) -> float:
+    """Return the mean time to deliver one event to all subscribers, in seconds"""
+    xthing = XThing("_http._tcp.local.", "bench._http._tcp.local.")
+    queues = [SubscriberQueue(max_size=EVENTS + 1) for _ in range(n_subscribers)]
+    for queue in queues:
+        xthing.add_property_observer_by_attr("reading", queue)
+    value = Reading(name="sensor", values=[float(i) for i in range(100)])
+    sent: list[str] = []
+
+    start = time.perf_counter()
+    for _ in range(EVENTS):
+        if encode_once:
+            await xthing.publish_event("propertyStatus", "reading", value)
+        else:
+            for queue in queues:
+                await queue.send(
+                    {"messageType": "propertyStatus", "data": {"reading": value}}
+                )
+        for queue in queues:
+            item = await queue.receive()
+            if encode_once:
+                sent.append(item.text)
+            else:
+                sent.append(json.dumps(jsonable_encoder(item)))
+    return (time.perf_counter() - start) / EVENTS
+
+
+def main():
+    print(f"{'subscribers':>12} {'per client (ms)':>16} {'encode once (ms)':>17}")
+    for n in SUBSCRIBERS:
+        per_client = anyio.run(fan_out, n, False)
+        once = anyio.run(fan_out, n, True)
+        print(f"{n:>12} {per_client * 1e3:>16.3f} {once * 1e3:>17.3f}")
+
+
+if __name__ == "__main__":
+    main()
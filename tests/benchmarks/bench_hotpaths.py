@@ -0,0 +1,372 @@
+"""
+Benchmark the hot paths of the framework, each in isolation
+
+* property GET and PUT round trips through the FastAPI test client
+* `ActionManager.invoke_action` to completion
+* a property event fanned out to N websocket subscribers
+* `ImageStream.add_frame` throughput, for each encoder
+* a multipart image stream served to N viewers
+
+The frames come from a synthetic camera, like the `MockCamera` of
+`examples/demo_server.py`. The results are written as JSON, to compare them
+between versions. Run with:
+
+    python tests/benchmarks/bench_hotpaths.py --output before.json
+    python tests/benchmarks/bench_hotpaths.py --output after.json --compare before.json
+
+`--quick` runs fewer iterations, e.g. to check that the suite still works.
+"""
+
+from __future__ import annotations
+from fastapi.testclient import TestClient
+from importlib.metadata import PackageNotFoundError, version
+from pydantic import StrictInt
+from typing import Any, Callable, Optional
+import anyio
+import argparse
+import cv2 as cv
+import datetime
+import json
+import numpy as np
+import platform
+import statistics
+import tempfile
+import threading
+import time
+
+from xthings import XThing, xaction, xproperty
+from xthings.action import InvocationStatus
+from xthings.descriptors import ImageStreamDescriptor, PngImageStreamDescriptor
+from xthings.server import ServerSettings, XThingsServer
+from xthings.streaming import ImageStream
+
+service_type = "_http._tcp.local."
+
+ENCODERS: dict[str, tuple[Callable, Callable]] = {
+    "raw": (lambda frame: (True, frame), lambda: b"application/octet-stream"),
+    "jpeg": (
+        lambda frame: cv.imencode(".jpg", frame, [cv.IMWRITE_JPEG_QUALITY, 80]),
+        lambda: b"image/jpeg",
+    ),
+    "png": (lambda frame: cv.imencode(".png", frame), lambda: b"image/png"),
+}
+
+
+class SyntheticCamera:
+    """Frames of a moving gradient with noise, like a camera would produce
+
+    A few frames are generated up front, so that producing them costs nothing.
+    """
+
+    def __init__(self, width: int = 640, height: int = 480, n_frames: int = 8):
+        rng = np.random.default_rng(0)
+        gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+        self._frames = []
+        for i in range(n_frames):
+            noise = rng.normal(0, 8, (height, width, 3)).astype(np.float32)
+            frame = np.roll(gradient, i * 16, axis=1) + noise
+            self._frames.append(np.clip(frame, 0, 255).astype(np.uint8))
+        self._i = 0
+
+    def next_frame(self) -> np.ndarray:
+        self._i = (self._i + 1) % len(self._frames)
+        return self._frames[self._i]
+
+    def stream(self, callback: Callable[[np.ndarray], Any], stop: threading.Event):
+        """Call `callback` with frames as fast as it takes them, until `stop`"""
+        while not stop.is_set():
+            callback(self.next_frame())
+
+
+class BenchXThing(XThing):
+    jpeg_stream = ImageStreamDescriptor(*ENCODERS["jpeg"], ringbuffer_size=10)
+    png_stream = PngImageStreamDescriptor(ringbuffer_size=10)
+
+    def __init__(self):
+        super().__init__(service_type, "bench._http._tcp.local.")
+        self._exposure = 10
+
+    @xproperty(model=int)
+    def exposure(self) -> int:
+        return self._exposure
+
+    @exposure.setter
+    def exposure(self, value: int):
+        self._exposure = value
+
+    @xaction(input_model=StrictInt, output_model=StrictInt)
+    def increment(self, n: StrictInt, apn, cancellation_token, logger) -> int:
+        return n + 1
+
+
+def create_server(settings_folder: str) -> tuple[XThingsServer, BenchXThing]:
+    server = XThingsServer(
+        settings_folder=settings_folder,
+        server_settings=ServerSettings(mdns_enabled=False),
+        websocket_ping_interval=None,
+    )
+    xthing = BenchXThing()
+    server.add_xthing(xthing, "/bench")
+    return server, xthing
+
+
+def latency_result(name: str, params: dict, samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "name": name,
+        "params": params,
+        "unit": "s",
+        "value": statistics.median(ordered),
+        "higher_is_better": False,
+        "samples": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "min": ordered[0],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "ops_per_second": len(ordered) / sum(ordered),
+    }
+
+
+def throughput_result(name: str, params: dict, value: float, unit: str, **extra):
+    return {
+        "name": name,
+        "params": params,
+        "unit": unit,
+        "value": value,
+        "higher_is_better": True,
+        **extra,
+    }
+
+
+def bench_properties(client: TestClient, iterations: int) -> list[dict]:
+    get, put = [], []
+    for i in range(iterations):
+        start = time.perf_counter()
+        client.get("/bench/exposure")
+        get.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        client.put("/bench/exposure", json=i)
+        put.append(time.perf_counter() - start)
+    return [
+        latency_result("property_get", {}, get),
+        latency_result("property_put", {}, put),
+    ]
+
+
+def bench_actions(client: TestClient, xthing: BenchXThing, iterations: int):
+    action = xthing.actions["increment"]
+    done = (InvocationStatus.COMPLETED, InvocationStatus.ERROR)
+
+    async def invoke() -> float:
+        start = time.perf_counter()
+        invocation = await action.invoke(xthing, 1)
+        while invocation.status not in done:
+            await anyio.sleep(0)
+        return time.perf_counter() - start
+
+    samples = [client.portal.call(invoke) for _ in range(iterations)]
+    return [latency_result("action_invoke", {}, samples)]
+
+
+def bench_fanout(client: TestClient, subscribers: int, events: int) -> dict:
+    samples = []
+    websockets = []
+    try:
+        for _ in range(subscribers):
+            ws = client.websocket_connect("/bench/ws").__enter__()
+            websockets.append(ws)
+            ws.send_json(
+                {"messageType": "addPropertyObservation", "data": {"exposure": 1}}
+            )
+            assert ws.receive_json()["status"] == "success"
+        for i in range(events):
+            start = time.perf_counter()
+            client.put("/bench/exposure", json=i)
+            for ws in websockets:
+                ws.receive_json()
+            samples.append(time.perf_counter() - start)
+    finally:
+        for ws in websockets:
+            ws.__exit__(None, None, None)
+    return latency_result("websocket_fanout", {"subscribers": subscribers}, samples)
+
+
+def bench_add_frame(encoder: str, frames: int) -> dict:
+    camera = SyntheticCamera()
+    imencode, content_type = ENCODERS[encoder]
+    stream = ImageStream(imencode, None, content_type, None, ringbuffer_size=10)
+    start = time.perf_counter()
+    for _ in range(frames):
+        stream.add_frame(camera.next_frame())
+        # as the event loop would, once it is notified of the frame
+        stream.last_frame_i += 1
+    elapsed = time.perf_counter() - start
+    return throughput_result(
+        "add_frame",
+        {"encoder": encoder, "width": 640, "height": 480},
+        frames / elapsed,
+        "frames/s",
+        encode_seconds=stream.statistics().encode_seconds_total / frames,
+    )
+
+
+async def view_stream(app, path: str, frames: list[int], i: int, duration: float):
+    """Request an image stream through the ASGI app, count the frames received"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench"), (b"accept-encoding", b"gzip")],
+        "client": ("127.0.0.1", 10000 + i),
+        "server": ("bench", 80),
+    }
+    disconnected = anyio.Event()
+
+    async def receive():
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            if message.get("body", b"").startswith(b"--frame"):
+                frames[i] += 1
+
+    with anyio.move_on_after(duration):
+        await app(scope, receive, send)
+    disconnected.set()
+
+
+def bench_viewers(settings_folder: str, viewers: int, duration: float) -> dict:
+    server, xthing = create_server(settings_folder)
+    camera = SyntheticCamera()
+    frames = [0] * viewers
+
+    async def main() -> int:
+        async with server.lifespan(server.app):
+            stream = xthing.jpeg_stream
+            stop = threading.Event()
+            added = 0
+
+            def add_frame(frame):
+                nonlocal added
+                stream.add_frame(frame)
+                added += 1
+                # let the event loop notify the viewers, as a camera would
+                time.sleep(0.001)
+
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(
+                    lambda: anyio.to_thread.run_sync(camera.stream, add_frame, stop)
+                )
+                for i in range(viewers):
+                    tg.start_soon(
+                        view_stream, server, "/bench/jpeg_stream", frames, i, duration
+                    )
+                await anyio.sleep(duration)
+                stop.set()
+            return added
+
+    added = anyio.run(main)
+    delivered = statistics.fmean(frames)
+    return throughput_result(
+        "multipart_viewers",
+        {"viewers": viewers, "encoder": "jpeg"},
+        delivered / duration,
+        "frames/s per viewer",
+        frames_added=added,
+        delivered_ratio=delivered / max(added, 1),
+    )
+
+
+def run(quick: bool) -> list[dict]:
+    results: list[dict] = []
+    scale = 10 if quick else 1
+    with tempfile.TemporaryDirectory() as settings_folder:
+        server, xthing = create_server(settings_folder)
+        with TestClient(server.app) as client:
+            results += bench_properties(client, 1000 // scale)
+            results += bench_actions(client, xthing, 200 // scale)
+            for subscribers in (1, 10, 50):
+                results.append(bench_fanout(client, subscribers, 50 // scale))
+        for encoder in ENCODERS:
+            results.append(bench_add_frame(encoder, 200 // scale))
+        for viewers in (1, 4, 16):
+            results.append(bench_viewers(settings_folder, viewers, 2.0 / scale))
+    return results
+
+
+def environment() -> dict:
+    try:
+        xthings_version = version("xthings")
+    except PackageNotFoundError:
+        xthings_version = "unknown"
+    return {
+        "xthings": xthings_version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def key(result: dict) -> str:
+    return f"{result['name']}{json.dumps(result['params'], sort_keys=True)}"
+
+
+def describe(result: dict) -> str:
+    params = ", ".join(f"{k}={v}" for k, v in result["params"].items())
+    return f"{result['name']}({params})"
+
+
+def compare(results: list[dict], baseline: dict, threshold: float = 0.1) -> int:
+    """Print the change of each result, return the number of regressions"""
+    before = {key(r): r for r in baseline["results"]}
+    regressions = 0
+    print(f"\ncompared with xthings {baseline['environment']['xthings']}:")
+    for result in results:
+        old = before.get(key(result))
+        if old is None or old["value"] == 0:
+            continue
+        change = result["value"] / old["value"] - 1
+        worse = -change if result["higher_is_better"] else change
+        flag = ""
+        if worse > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{describe(result):>44} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare with the results of this file")
+    parser.add_argument("--quick", action="store_true", help="Fewer iterations")
+    args = parser.parse_args(argv)
+
+    results = run(args.quick)
+    for result in results:
+        value = result["value"]
+        if result["unit"] == "s":
+            text = f"{value * 1e3:.3f} ms (p95 {result['p95'] * 1e3:.3f} ms)"
+        else:
+            text = f"{value:.1f} {result['unit']}"
+        print(f"{describe(result):>44} {text}")
+
+    report = {"environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            return 1 if compare(results, json.load(f)) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,70 @@
+"""
+Benchmark the startup of a server hosting 100 XThings with 20 affordances each
+
+Each XThing has 10 properties and 10 actions. The XThings are either all of one
+class, or each of its own class, as when a server hosts many kinds of devices.
+Run with:
+
+    python tests/benchmarks/bench_startup.py
+"""
+
+from pydantic import StrictInt
+import tempfile
+import time
+
+from xthings import XThing, xaction, xproperty
+from xthings.server import ServerSettings, XThingsServer
+
+XTHINGS = 100
+AFFORDANCES = 20
+
+
+def xthing_class(i: int) -> type[XThing]:
+    namespace: dict = {}
+    for j in range(AFFORDANCES // 2):
+
+        def getter(self, j=j) -> int:
+            return j
+
+        def action(self, x, apn, cancellation_token, logger):
+            return x
+
+        namespace[f"property{j}"] = xproperty(model=int)(getter)
+        namespace[f"action{j}"] = xaction(
+            input_model=StrictInt, output_model=StrictInt
+        )(action)
+    return type(f"BenchXThing{i}", (XThing,), namespace)
+
+
+def start(one_class: bool) -> tuple[float, float, float]:
+    """Return the time to define the classes, to add the XThings, and to
+    generate the OpenAPI schema, in seconds"""
+    start = time.perf_counter()
+    if one_class:
+        classes = [xthing_class(0)] * XTHINGS
+    else:
+        classes = [xthing_class(i) for i in range(XTHINGS)]
+    defined = time.perf_counter()
+    with tempfile.TemporaryDirectory() as settings_folder:
+        server = XThingsServer(
+            settings_folder=settings_folder, server_settings=ServerSettings()
+        )
+        for i, cls in enumerate(classes):
+            xthing = cls("_http._tcp.local.", f"bench{i}._http._tcp.local.")
+            server.add_xthing(xthing, f"/xthing{i}")
+    added = time.perf_counter()
+    server.app.openapi()
+    return defined - start, added - defined, time.perf_counter() - added
+
+
+def main():
+    print(f"{XTHINGS} XThings with {AFFORDANCES} affordances each")
+    print(f"{'classes':>10} {'define (s)':>11} {'add (s)':>8} {'openapi (s)':>12}")
+    for one_class in (True, False):
+        define, add, openapi = start(one_class)
+        label = "one" if one_class else "one each"
+        print(f"{label:>10} {define:>11.3f} {add:>8.3f} {openapi:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
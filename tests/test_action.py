@@ -121,3 +121,18 @@ def test_action_add_to_app():
             "/invocations"
         )  # Fixme: get twice to wait for next task in the event loop
         assert r.json()[3]["status"] == "error"
+
+
+def test_action_invocation_model():
+    class OtherXThing(XThing):
+        @xaction(input_model=StrictInt, output_model=StrictInt)
+        def func(self, i: StrictInt, apn, cancellation_token, logger) -> StrictInt:
+            return i
+
+    descriptor = OtherXThing.func
+    assert descriptor._invocation_model is None
+    model = descriptor.invocation_model
+    assert model.__name__ == "func_invocation"
+    # actions with the same name and models share their invocation model
+    assert model is MyXThing.func.invocation_model
+    assert MyXThing.func_slow.invocation_model is not model
@@ -0,0 +1,105 @@
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from xthings.server import XThingsServer
+from xthings.server.xthings_compression import is_compressible, preferred_encoding
+from xthings.server.xthings_settings import CompressionSettings
+from xthings.streaming import ImageStreamResponse
+from xthings.xthing import XThing
+
+service_type = "_http._tcp.local."
+service_name = "thing._http._tcp.local."
+
+
+def create() -> XThingsServer:
+    server = XThingsServer()
+    server.add_xthing(XThing(service_type, service_name), "/xthing")
+
+    @server.app.get("/xthing/items")
+    def items():
+        return [{"id": i, "name": f"item {i}"} for i in range(200)]
+
+    @server.app.get("/xthing/small")
+    def small():
+        return {"id": 1}
+
+    async def frames():
+        for _ in range(3):
+            yield b"\xff\xd8" * 1000
+
+    @server.app.get("/xthing/frames")
+    def stream_frames():
+        return ImageStreamResponse(frames(), lambda: b"image/jpeg")
+
+    async def lines():
+        for i in range(100):
+            yield f"line {i}\n" * 10
+
+    @server.app.get("/xthing/lines")
+    def stream_lines():
+        return StreamingResponse(lines(), media_type="text/plain")
+
+    return server
+
+
+def test_compression():
+    server = create()
+    with TestClient(server.app) as client:
+        r = client.get("/xthing/items", headers={"Accept-Encoding": "gzip"})
+        assert r.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in r.headers["vary"]
+        assert int(r.headers["content-length"]) < len(r.content)
+        assert len(r.json()) == 200
+
+        r = client.get("/xthing/items", headers={"Accept-Encoding": "deflate"})
+        assert r.headers["content-encoding"] == "deflate"
+        assert len(r.json()) == 200
+
+        r = client.get("/xthing/items", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in r.headers
+
+        r = client.get("/xthing/small", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in r.headers
+
+        # streaming text is flushed chunk by chunk
+        r = client.get("/xthing/lines", headers={"Accept-Encoding": "gzip"})
+        assert r.headers["content-encoding"] == "gzip"
+        assert r.text.count("\n") == 1000
+
+        r = client.get("/xthing/frames", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in r.headers
+        assert r.headers["content-type"].startswith("multipart/x-mixed-replace")
+
+
+def test_compression_per_route():
+    server = create()
+    server.set_compression("/xthing", enabled=False)
+    server.set_compression("/xthing/small", minimum_size=1)
+    with TestClient(server.app) as client:
+        r = client.get("/xthing/items", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in r.headers
+        # the longest prefix wins
+        r = client.get("/xthing/small", headers={"Accept-Encoding": "gzip"})
+        assert r.headers["content-encoding"] == "gzip"
+        assert r.json() == {"id": 1}
+
+
+def test_compression_settings():
+    settings = CompressionSettings.model_validate(
+        {"minimum_size": 10, "routes": {"/a": {"level": 9}, "/a/b": {"enabled": 0}}}
+    )
+    assert settings.route("/a/c").level == 9
+    assert settings.route("/a/c").minimum_size == 10
+    assert not settings.route("/a/b/c").enabled
+    assert settings.route("/ab").level == 6
+
+    assert preferred_encoding("gzip, deflate, br") == "gzip"
+    assert preferred_encoding("gzip;q=0.5, deflate") == "deflate"
+    assert preferred_encoding("gzip;q=0, br") is None
+    assert preferred_encoding("*") == "gzip"
+    assert is_compressible("application/json")
+    assert is_compressible("application/td+json")
+    assert is_compressible("text/html; charset=utf-8")
+    assert not is_compressible("text/event-stream")
+    assert not is_compressible("multipart/x-mixed-replace; boundary=frame")
+    assert not is_compressible("image/png")
@@ -0,0 +1,111 @@
+from fastapi.testclient import TestClient
+from pydantic import BaseModel, StrictInt
+import gzip
+import json
+
+from xthings import xaction, xproperty
+from xthings.descriptors import PngImageStreamDescriptor
+from xthings.server import XThingsServer
+from xthings.server.xthings_description import accepts_gzip, etag_matches
+from xthings.xthing import XThing
+
+service_type = "_http._tcp.local."
+service_name = "thing._http._tcp.local."
+
+
+class Position(BaseModel):
+    x: float
+    y: float
+
+
+class Stage(XThing):
+    """A motorised stage"""
+
+    camera = PngImageStreamDescriptor(ringbuffer_size=4)
+
+    @xproperty(model=Position, history_length=10)
+    def position(self) -> Position:
+        """The position of the stage"""
+        return Position(x=0, y=0)
+
+    @xaction(input_model=Position, output_model=StrictInt)
+    def move(self, position: Position, cancellation_token, logger) -> int:
+        """Move the stage"""
+        return 0
+
+
+def create() -> tuple[XThingsServer, Stage]:
+    server = XThingsServer()
+    stage = Stage(service_type, service_name)
+    server.add_xthing(stage, "/stage")
+    return server, stage
+
+
+def test_description():
+    server, stage = create()
+    with TestClient(server.app) as client:
+        r = client.get("/stage")
+        assert r.status_code == 200
+        assert r.headers["content-type"] == "application/td+json"
+        td = r.json()
+
+    assert td["title"] == "Stage"
+    assert td["description"] == "A motorised stage"
+    assert td["base"] == "http://testserver/"
+    position = td["properties"]["position"]
+    assert position["description"] == "The position of the stage"
+    assert set(position["properties"]) == {"x", "y"}
+    assert position["observable"] is True
+    assert [f["href"] for f in position["forms"]] == [
+        "/stage/position",
+        "/stage/position/history",
+    ]
+    move = td["actions"]["move"]
+    assert move["input"]["properties"]["x"]["type"] == "number"
+    assert move["output"]["type"] == "integer"
+    assert move["forms"][0] == {
+        "href": "/stage/move",
+        "op": "invokeaction",
+        "htv:methodName": "POST",
+        "contentType": "application/json",
+    }
+    camera = td["streams"]["camera"]
+    assert camera["frameContentType"] == "image/png"
+    assert camera["forms"][0]["href"] == "/stage/camera"
+
+
+def test_description_etag_and_gzip():
+    server, stage = create()
+    with TestClient(server.app) as client:
+        r = client.get("/stage", headers={"Accept-Encoding": "identity"})
+        etag = r.headers["etag"]
+        assert "content-encoding" not in r.headers
+        assert "Accept-Encoding" in r.headers["vary"]
+
+        r = client.get("/stage", headers={"If-None-Match": etag})
+        assert r.status_code == 304
+        assert r.content == b""
+        r = client.get("/stage", headers={"If-None-Match": f'"other", W/{etag}'})
+        assert r.status_code == 304
+
+        r = client.get("/stage", headers={"Accept-Encoding": "gzip"})
+        assert r.headers["content-encoding"] == "gzip"
+        assert r.headers["etag"] == etag
+        encoded = stage.encoded_description("http://testserver/")
+        assert json.loads(gzip.decompress(encoded.gzipped)) == r.json()
+
+        # the same encoded copy is served until affordances change
+        assert stage.encoded_description("http://testserver/") is encoded
+        stage.invalidate_description()
+        assert stage.encoded_description("http://testserver/") is not encoded
+
+
+def test_accept_encoding():
+    assert accepts_gzip("gzip")
+    assert accepts_gzip("br, gzip;q=0.5")
+    assert accepts_gzip("*")
+    assert not accepts_gzip("gzip;q=0")
+    assert not accepts_gzip("br, deflate")
+    assert not accepts_gzip("")
+    assert etag_matches("*", '"a"')
+    assert not etag_matches('"b"', '"a"')
@@ -0,0 +1,74 @@
+import anyio
+import pytest
+
+from xthings.discovery import XThingsBrowser
+from xthings.server import MdnsRegistration, ServerSettings, XThingsServer
+from xthings.xthing import XThing
+
+service_type = "_xthings._tcp.local."
+loopback = ["127.0.0.1"]
+
+
+def test_browser_caches_services():
+    async def main():
+        registration = MdnsRegistration(
+            8123, {"kind": "camera"}, "xthings-test.local.", loopback
+        )
+        browser = XThingsBrowser([service_type], ttl=1.0, interfaces=loopback)
+        async with browser:
+            assert browser.services() == []
+            async with registration:
+                await registration.register([(service_type, f"camera.{service_type}")])
+                name = f"camera.{service_type}"
+                assert registration.registered == [name]
+                service = await browser.wait_for(name, timeout=10)
+                assert service.addresses == ["127.0.0.1"]
+                assert service.port == 8123
+                assert service.url == "http://127.0.0.1:8123"
+                assert service.properties == {"kind": "camera"}
+                assert browser.services(service_type) == [service]
+                assert browser.services("_other._tcp.local.") == []
+
+                # the entry is resolved again before it expires
+                await anyio.sleep(1.5)
+                assert browser.get(name) is not None
+
+            # unregistered services are dropped
+            with anyio.fail_after(10):
+                while browser.get(name) is not None:
+                    await anyio.sleep(0.05)
+
+            with pytest.raises(TimeoutError):
+                await browser.wait_for(name, timeout=0.1)
+
+    anyio.run(main)
+
+
+def test_server_announces_xthings():
+    settings = ServerSettings(port=8124, mdns_interfaces=loopback)
+    server = XThingsServer(server_settings=settings)
+    server.add_xthing(XThing(service_type, f"thing.{service_type}"), "/thing")
+
+    async def main():
+        async with XThingsBrowser([service_type], interfaces=loopback) as browser:
+            async with server.lifespan(server.app):
+                service = await browser.wait_for(f"thing.{service_type}", timeout=10)
+                assert service.port == 8124
+
+    anyio.run(main)
+
+
+def test_server_without_mdns(monkeypatch):
+    def no_zeroconf(*args, **kwargs):
+        raise AssertionError("zeroconf is not used when mDNS is disabled")
+
+    monkeypatch.setattr("xthings.server.xthings_zeroconf.AsyncZeroconf", no_zeroconf)
+    server = XThingsServer(server_settings=ServerSettings(mdns_enabled=False))
+    xthing = XThing(service_type, f"thing.{service_type}")
+    server.add_xthing(xthing, "/thing")
+
+    async def main():
+        async with server.lifespan(server.app):
+            assert xthing._task_group is not None
+
+    anyio.run(main)
@@ -0,0 +1,161 @@
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+import anyio
+import numpy as np
+import pytest
+
+from xthings.descriptors import PropertyDescriptor
+from xthings.server import SubscriberQueue, XThingsServer
+from xthings.server.xthings_encoding import (
+    CODECS,
+    JSON_CODEC,
+    encode_json,
+    negotiate_codec,
+    to_primitive,
+)
+from xthings.server.xthings_events import EventMessage
+from xthings.xthing import XThing
+
+service_type = "_http._tcp.local."
+service_name = "thing._http._tcp.local."
+
+
+class Reading(BaseModel):
+    name: str
+    values: list[float]
+
+
+class MyXThing(XThing):
+    reading = PropertyDescriptor(Reading, Reading(name="r", values=[]))
+    calibration = PropertyDescriptor(dict[int, float], {})
+
+
+def test_to_primitive():
+    assert to_primitive({"r": Reading(name="r", values=[1.0]), "t": (1, 2)}) == {
+        "r": {"name": "r", "values": [1.0]},
+        "t": [1, 2],
+    }
+    array = np.arange(3)
+    assert to_primitive([array])[0] is array
+    assert to_primitive(np.float32(1.5)) == 1.5
+
+
+def test_negotiate_codec():
+    assert negotiate_codec([]) is JSON_CODEC
+    assert negotiate_codec(["unknown"]) is JSON_CODEC
+    assert negotiate_codec(["unknown", "xthings.json"]).subprotocol == "xthings.json"
+
+
+@pytest.mark.parametrize("subprotocol", ["xthings.msgpack", "xthings.cbor"])
+def test_binary_codec_arrays(subprotocol):
+    if subprotocol not in CODECS:
+        pytest.skip(f"{subprotocol} is not installed")
+    codec = CODECS[subprotocol]
+    for array in (
+        np.arange(10, dtype=np.float64),
+        np.arange(12, dtype=np.uint16).reshape(3, 4),
+        np.arange(6, dtype=">i4").reshape(2, 3),
+    ):
+        frame = codec.encode({"data": {"a": array}})
+        assert isinstance(frame, bytes)
+        decoded = codec.decode(frame)["data"]["a"]
+        np.testing.assert_array_equal(decoded, array)
+        assert decoded.shape == array.shape
+
+    # raw array bytes are carried, not lists of numbers
+    array = np.random.rand(1000)
+    assert len(codec.encode(array)) < array.nbytes + 64
+    assert len(codec.encode(array)) < len(JSON_CODEC.encode(array)) / 2
+
+
+def test_event_message_encoded_once_per_codec():
+    event = EventMessage("propertyStatus", "a", [1.0, 2.0])
+    assert event.encoded(JSON_CODEC) is event.text
+    for codec in CODECS.values():
+        assert event.encoded(codec) is event.encoded(codec)
+        assert codec.decode(event.encoded(codec)) == event.message
+
+
+def test_unencodable_event_is_dropped():
+    xthing = MyXThing(service_type, service_name)
+    queue = SubscriberQueue()
+    xthing.add_property_observer_by_attr("reading", queue)
+
+    async def main():
+        last_id = xthing.event_log.last_id
+        await xthing.publish_event("propertyStatus", "reading", object())
+        assert len(queue) == 0
+        assert xthing.event_log.last_id == last_id
+        await xthing.publish_event("propertyStatus", "reading", 1)
+        assert (await queue.receive()).value == 1
+
+    anyio.run(main)
+
+
+@pytest.mark.parametrize("subprotocol", ["xthings.msgpack", "xthings.cbor"])
+def test_websocket_binary_subprotocol(subprotocol):
+    if subprotocol not in CODECS:
+        pytest.skip(f"{subprotocol} is not installed")
+    codec = CODECS[subprotocol]
+    server = XThingsServer()
+    xthing = MyXThing(service_type, service_name)
+    server.add_xthing(xthing, "/xthing")
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect(
+            "/xthing/ws", subprotocols=[subprotocol, "xthings.json"]
+        ) as ws:
+            assert ws.accepted_subprotocol == subprotocol
+            ws.send_bytes(
+                codec.encode(
+                    {"messageType": "addPropertyObservation", "data": {"reading": 1}}
+                )
+            )
+            assert codec.decode(ws.receive_bytes())["status"] == "success"
+
+            client.put("/xthing/reading", json={"name": "r", "values": [1.5, 2.5]})
+            message = codec.decode(ws.receive_bytes())
+            assert message == {
+                "messageType": "propertyStatus",
+                "data": {"reading": {"name": "r", "values": [1.5, 2.5]}},
+                "thing": "/xthing",
+                "seq": xthing.event_log.last_id,
+            }
+
+            ws.send_bytes(b"\xc1")  # never used in either encoding
+            assert codec.decode(ws.receive_bytes()) == {
+                "status": "error",
+                "errorMessage": "DecodeError",
+            }
+
+
+def test_encode_json_keys_and_arrays():
+    assert encode_json({1: 2.0}) == b'{"1":2.0}'
+    transposed = np.arange(6.0).reshape(2, 3).T
+    assert encode_json({"a": transposed}) == b'{"a":[[0.0,3.0],[1.0,4.0],[2.0,5.0]]}'
+
+
+def test_int_keyed_property():
+    server = XThingsServer()
+    xthing = MyXThing(service_type, service_name)
+    server.add_xthing(xthing, "/xthing")
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/xthing/ws") as ws:
+            ws.send_json(
+                {"messageType": "addPropertyObservation", "data": {"calibration": 1}}
+            )
+            assert ws.receive_json()["status"] == "success"
+
+            r = client.put("/xthing/calibration", json={"1": 0.5, "2": 1.5})
+            assert r.status_code == 200
+            assert client.get("/xthing/calibration").json() == {"1": 0.5, "2": 1.5}
+            message = ws.receive_json()
+            assert message["data"] == {"calibration": {"1": 0.5, "2": 1.5}}
+
+            ws.send_json(
+                {"messageType": "readProperty", "requestId": 1, "name": "calibration"}
+            )
+            reply = ws.receive_json()
+            assert reply["requestId"] == 1
+            assert reply["value"] == {"1": 0.5, "2": 1.5}
@@ -0,0 +1,127 @@
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+import anyio
+import pytest
+import time
+
+from xthings.server import XThingsServer, SubscriberQueue, Heartbeat
+from xthings.server.xthings_heartbeat import PING, ConnectionActivity
+from xthings.xthing import XThing
+
+service_type = "_http._tcp.local."
+service_name = "thing._http._tcp.local."
+
+
+def test_heartbeat_pings():
+    async def main():
+        heartbeat = Heartbeat(ping_interval=0.01, idle_timeout=None)
+        queue = SubscriberQueue()
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(heartbeat.watch, queue, ConnectionActivity())
+            assert await queue.receive() == PING
+            assert await queue.receive() == PING
+            tg.cancel_scope.cancel()
+        assert heartbeat.statistics().pings_sent >= 2
+        assert heartbeat.reaped == 0
+
+    anyio.run(main)
+
+
+def test_heartbeat_reaps_stalled_connections():
+    async def main():
+        heartbeat = Heartbeat(ping_interval=None, idle_timeout=0.05)
+        queue = SubscriberQueue()
+        queue.send_nowait({"messageType": "propertyStatus", "data": {"x": 1}})
+        # the client never answered pings, but its connection does not drain
+        with anyio.fail_after(1):
+            assert await heartbeat.watch(queue, ConnectionActivity())
+        assert heartbeat.statistics().reaped_stalled == 1
+
+    anyio.run(main)
+
+
+def test_heartbeat_reaps_stalled_connections_under_steady_events():
+    async def main():
+        heartbeat = Heartbeat(ping_interval=None, idle_timeout=0.1)
+        queue = SubscriberQueue(max_size=2)
+
+        async def emit():
+            for i in range(1000):
+                queue.send_nowait({"messageType": "propertyStatus", "data": {"x": i}})
+                await anyio.sleep(0.01)
+
+        # the oldest events are dropped all the time, but none is delivered
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(emit)
+            with anyio.fail_after(1):
+                assert await heartbeat.watch(queue, ConnectionActivity())
+            tg.cancel_scope.cancel()
+        assert queue.lag < 0.1
+        assert heartbeat.statistics().reaped_stalled == 1
+
+    anyio.run(main)
+
+
+def test_heartbeat_pings_are_opt_in():
+    server = XThingsServer(websocket_idle_timeout=0.2)
+    assert server.heartbeat.statistics().ping_interval is None
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            time.sleep(0.3)
+            ws.send_json({"messageType": "ping"})
+            assert ws.receive_json(mode="text") == {"messageType": "pong"}
+        assert client.get("/websockets/heartbeat").json()["pings_sent"] == 0
+
+
+def test_heartbeat_reaps_silent_clients():
+    async def main():
+        heartbeat = Heartbeat(ping_interval=0.01, idle_timeout=0.05)
+        queue = SubscriberQueue()
+        activity = ConnectionActivity()
+        activity.received(pong=True)
+        with anyio.fail_after(1):
+            assert await heartbeat.watch(queue, activity)
+        assert heartbeat.statistics().reaped_silent == 1
+
+        # a closed queue ends watching without reaping
+        closed = SubscriberQueue()
+        closed.close()
+        assert not await heartbeat.watch(closed, ConnectionActivity())
+        assert heartbeat.reaped == 1
+
+    anyio.run(main)
+
+
+def test_websocket_heartbeat():
+    server = XThingsServer(websocket_ping_interval=0.05, websocket_idle_timeout=0.2)
+    xthing = XThing(service_type, service_name)
+    server.add_xthing(xthing, "/xthing")
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/xthing/ws") as ws:
+            ws.send_json({"messageType": "ping"})
+            assert ws.receive_json(mode="text") == {"messageType": "pong"}
+
+            # a client which does not know about heartbeats is not reaped
+            start = time.monotonic()
+            while time.monotonic() - start < 0.4:
+                assert ws.receive_json(mode="text") == PING
+            ws.send_json(
+                {"messageType": "addPropertyObservation", "data": {"foo": True}}
+            )
+            message = ws.receive_json(mode="text")
+            while message == PING:
+                message = ws.receive_json(mode="text")
+            assert message["status"] == "success"
+
+            # a client which answered pings and stops answering is reaped
+            ws.send_json({"messageType": "pong"})
+            with pytest.raises(WebSocketDisconnect) as e:
+                while True:
+                    assert ws.receive_json(mode="text") == PING
+            assert e.value.code == 1001
+
+        assert len(xthing.subscriptions) == 0
+        statistics = client.get("/websockets/heartbeat").json()
+        assert statistics["reaped_silent"] == 1
+        assert statistics["pings_sent"] >= 8
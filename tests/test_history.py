@@ -0,0 +1,61 @@
+from xthings.history import PropertyHistory
+import numpy as np
+import pytest
+import sys
+import threading
+
+
+def test_history_ring():
+    history = PropertyHistory(10)
+    assert len(history) == 0
+    assert history.query().mean == []
+
+    for i in range(25):
+        assert history.append(i, timestamp=float(i))
+    assert not history.append("not a number")
+
+    assert len(history) == 10
+    timestamps, values = history.snapshot()
+    assert timestamps.tolist() == [float(i) for i in range(15, 25)]
+    assert values.tolist() == [float(i) for i in range(15, 25)]
+
+
+def test_history_query():
+    history = PropertyHistory(1000)
+    for i in range(100):
+        history.append(i, timestamp=float(i))
+
+    result = history.query(start=10.0, stop=19.0)
+    assert result.mean == [float(i) for i in range(10, 20)]
+
+    result = history.query(max_points=4)
+    assert result.count == [25, 25, 25, 25]
+    assert result.min == [0.0, 25.0, 50.0, 75.0]
+    assert result.max == [24.0, 49.0, 74.0, 99.0]
+    assert result.mean == [12.0, 37.0, 62.0, 87.0]
+
+    with pytest.raises(ValueError):
+        PropertyHistory(0)
+
+
+def test_history_concurrent_appends():
+    history = PropertyHistory(40000)
+
+    def append():
+        for i in range(5000):
+            history.append(i)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=append) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    timestamps, _ = history.snapshot()
+    assert len(timestamps) == 40000
+    # the timestamps are in the order of the ring
+    assert np.all(np.diff(timestamps) >= 0)
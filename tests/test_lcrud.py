@@ -0,0 +1,249 @@
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+import json
+import pytest
+import uuid
+
+from xthings import XThing, xlcrud
+from xthings.server import XThingsServer
+
+service_type = "_http._tcp.local."
+service_name = "thing._http._tcp.local."
+
+
+class Item(BaseModel):
+    name: str
+    desc: str
+
+
+class MyXThing(XThing):
+    def setup(self):
+        self._items: dict[str, Item] = {}
+        return super().setup()
+
+    @xlcrud(item_model=Item)
+    def items(self):
+        return self._items
+
+    @items.create_func
+    def items(self, v: Item):
+        id = str(uuid.uuid4())
+        self._items[id] = v
+        return id
+
+    @items.retrieve_func
+    def items(self, id: uuid.UUID) -> Item:
+        try:
+            return self._items[str(id)]
+        except KeyError:
+            raise HTTPException(status_code=404)
+
+    @items.update_func
+    def items(self, id: uuid.UUID, v: Item):
+        self._items[str(id)] = v
+
+    @items.delete_func
+    def items(self, id: uuid.UUID):
+        try:
+            del self._items[str(id)]
+        except KeyError:
+            raise HTTPException(status_code=404)
+
+
+server: XThingsServer
+xthing: MyXThing
+
+
+@pytest.fixture(autouse=True)
+def setup():
+    global server, xthing
+    server = XThingsServer()
+    xthing = MyXThing(service_type, service_name)
+    server.add_xthing(xthing, "/xthing")
+
+
+def test_lcrud_add_to_app():
+    with TestClient(server.app) as client:
+        r = client.post("/xthing/items", json={"name": "a", "desc": "first"})
+        id = r.json()
+        r = client.get(f"/xthing/items/{id}")
+        assert r.json() == {"name": "a", "desc": "first"}
+
+        client.put(f"/xthing/items/{id}", json={"name": "a", "desc": "updated"})
+        r = client.get("/xthing/items")
+        assert r.json() == {id: {"name": "a", "desc": "updated"}}
+
+        r = client.delete(f"/xthing/items/{id}")
+        assert r.status_code == 200
+        r = client.get(f"/xthing/items/{id}")
+        assert r.status_code == 404
+
+
+def test_lcrud_collection_pages_and_filters():
+    with TestClient(server.app) as client:
+        ids = [
+            client.post(
+                "/xthing/items", json={"name": f"item{i}", "desc": str(i % 2)}
+            ).json()
+            for i in range(5)
+        ]
+
+        r = client.get("/xthing/items", params={"limit": 2})
+        assert list(r.json().keys()) == ids[:2]
+        r = client.get(
+            "/xthing/items", params={"limit": 2, "cursor": r.headers["X-Next-Cursor"]}
+        )
+        assert list(r.json().keys()) == ids[2:4]
+        r = client.get(
+            "/xthing/items", params={"limit": 2, "cursor": r.headers["X-Next-Cursor"]}
+        )
+        assert list(r.json().keys()) == ids[4:]
+        assert "X-Next-Cursor" not in r.headers
+
+        r = client.get("/xthing/items", params={"desc": "1"})
+        assert list(r.json().keys()) == [ids[1], ids[3]]
+
+        r = client.get("/xthing/items", params={"cursor": "nope"})
+        assert r.status_code == 400
+
+
+def test_lcrud_collection_etag():
+    with TestClient(server.app) as client:
+        client.post("/xthing/items", json={"name": "a", "desc": "first"})
+        r = client.get("/xthing/items")
+        etag = r.headers["ETag"]
+
+        r = client.get("/xthing/items", headers={"If-None-Match": etag})
+        assert r.status_code == 304
+        assert r.content == b""
+
+        client.post("/xthing/items", json={"name": "b", "desc": "second"})
+        r = client.get("/xthing/items", headers={"If-None-Match": etag})
+        assert r.status_code == 200
+        assert r.headers["ETag"] != etag
+        assert len(r.json()) == 2
+
+        etag = r.headers["ETag"]
+        xthing._items.clear()
+        MyXThing.items.touch(xthing)
+        r = client.get("/xthing/items", headers={"If-None-Match": etag})
+        assert r.json() == {}
+
+
+def test_lcrud_collection_ndjson():
+    with TestClient(server.app) as client:
+        ids = [
+            client.post("/xthing/items", json={"name": f"n{i}", "desc": ""}).json()
+            for i in range(300)
+        ]
+        r = client.get("/xthing/items", headers={"Accept": "application/x-ndjson"})
+        assert r.headers["content-type"] == "application/x-ndjson"
+        lines = r.text.splitlines()
+        assert len(lines) == 300
+        assert json.loads(lines[299]) == {ids[299]: {"name": "n299", "desc": ""}}
+
+        etag = r.headers["ETag"]
+        r = client.get(
+            "/xthing/items",
+            headers={"Accept": "application/x-ndjson", "If-None-Match": etag},
+        )
+        assert r.status_code == 304
+        r = client.get("/xthing/items", headers={"If-None-Match": etag})
+        assert r.status_code == 200
+
+
+def test_lcrud_batch():
+    with TestClient(server.app) as client:
+        r = client.post(
+            "/xthing/items/batch",
+            json=[
+                {"name": "a", "desc": "1"},
+                {"name": "b"},
+                {"name": "c", "desc": "3"},
+            ],
+        )
+        assert r.status_code == 200
+        statuses = r.json()
+        assert [s["status"] for s in statuses] == [201, 422, 201]
+        assert statuses[1]["error"][0]["loc"] == [1, "desc"]
+        ids = [statuses[0]["result"], statuses[2]["result"]]
+        assert list(xthing._items.keys()) == ids
+
+        r = client.put(
+            "/xthing/items/batch",
+            json=[
+                {"id": ids[0], "item": {"name": "a", "desc": "updated"}},
+                {"id": "not-a-uuid", "item": {"name": "x", "desc": "x"}},
+            ],
+        )
+        assert [s["status"] for s in r.json()] == [200, 422]
+        assert xthing._items[ids[0]].desc == "updated"
+
+        missing = str(uuid.uuid4())
+        r = client.request("DELETE", "/xthing/items/batch", json=[ids[1], missing])
+        assert [s["status"] for s in r.json()] == [200, 404]
+        assert list(xthing._items.keys()) == [ids[0]]
+
+
+def test_lcrud_bulk_hooks():
+    class BulkXThing(MyXThing):
+        @xlcrud(item_model=Item)
+        def things(self):
+            return self._items
+
+        @things.bulk_create_func
+        def things(self, items: list[Item]):
+            self.bulk_calls = getattr(self, "bulk_calls", 0) + 1
+            ids = [str(uuid.uuid4()) for _ in items]
+            self._items.update(zip(ids, items))
+            return ids
+
+        @things.bulk_delete_func
+        def things(self, ids: list[uuid.UUID]):
+            for id in ids:
+                self._items.pop(str(id), None)
+
+    server = XThingsServer()
+    xthing = BulkXThing(service_type, service_name)
+    server.add_xthing(xthing, "/bulk")
+
+    with TestClient(server.app) as client:
+        etag = client.get("/bulk/things").headers["ETag"]
+        r = client.post(
+            "/bulk/things/batch", json=[{"name": str(i), "desc": ""} for i in range(50)]
+        )
+        assert all(s["status"] == 201 for s in r.json())
+        assert xthing.bulk_calls == 1
+        assert len(xthing._items) == 50
+
+        r = client.get("/bulk/things", headers={"If-None-Match": etag})
+        assert r.status_code == 200
+
+        r = client.request(
+            "DELETE", "/bulk/things/batch", json=list(xthing._items.keys())
+        )
+        assert all(s["status"] == 200 for s in r.json())
+        assert xthing._items == {}
+
+
+def test_lcrud_bulk_hook_result_count():
+    class ShortXThing(MyXThing):
+        @xlcrud(item_model=Item)
+        def things(self):
+            return self._items
+
+        @things.bulk_create_func
+        def things(self, items: list[Item]):
+            return [str(uuid.uuid4())]
+
+    server = XThingsServer()
+    server.add_xthing(ShortXThing(service_type, service_name), "/short")
+
+    with TestClient(server.app) as client:
+        r = client.post(
+            "/short/things/batch", json=[{"name": str(i), "desc": ""} for i in range(3)]
+        )
+        assert r.status_code == 200
+        assert [s["status"] for s in r.json()] == [500] * 3
+        assert "returned 1 results for 3 items" in r.json()[0]["error"]
@@ -0,0 +1,130 @@
+from fastapi.testclient import TestClient
+from pydantic import StrictInt
+import numpy as np
+import time
+
+from xthings import xaction, xproperty
+from xthings.descriptors import PngImageStreamDescriptor
+from xthings.server import ServerSettings, XThingsServer
+from xthings.server.xthings_metrics import Histogram
+from xthings.xthing import XThing
+
+service_type = "_http._tcp.local."
+service_name = "thing._http._tcp.local."
+
+
+class Camera(XThing):
+    stream = PngImageStreamDescriptor(ringbuffer_size=4)
+
+    @xproperty(model=int)
+    def exposure(self) -> int:
+        return 10
+
+    @exposure.setter
+    def exposure(self, value: int):
+        pass
+
+    @xaction(input_model=StrictInt, output_model=StrictInt)
+    def capture(self, n: StrictInt, apn, cancellation_token, logger) -> int:
+        return n
+
+
+def samples(text: str) -> dict[str, float]:
+    return {
+        line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+        for line in text.splitlines()
+        if not line.startswith("#")
+    }
+
+
+def test_metrics():
+    server = XThingsServer(server_settings=ServerSettings(metrics_enabled=True))
+    camera = Camera(service_type, service_name)
+    server.add_xthing(camera, "/camera")
+
+    with TestClient(server.app) as client:
+        for i in range(3):
+            camera.stream.add_frame(np.zeros((8, 8, 3), dtype=np.uint8))
+            while camera.stream.last_frame_i < i:
+                time.sleep(0.01)
+        client.get("/camera/exposure")
+        client.get("/camera/exposure")
+        client.put("/camera/exposure", json=20)
+        r = client.post("/camera/capture", json=1)
+        assert r.status_code == 201
+        for _ in range(50):
+            if client.get(r.json()["href"]).json()["status"] == "completed":
+                break
+            time.sleep(0.01)
+        with client.websocket_connect("/ws"):
+            r = client.get("/metrics")
+
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    metrics = samples(r.text)
+    get = 'xthing="/camera",property="exposure",method="GET"'
+    assert metrics[f"xthings_property_request_seconds_count{{{get}}}"] == 2
+    assert metrics[f'xthings_property_request_seconds_bucket{{{get},le="+Inf"}}'] == 2
+    put = 'xthing="/camera",property="exposure",method="PUT"'
+    assert metrics[f"xthings_property_request_seconds_count{{{put}}}"] == 1
+    action = 'xthing="/camera",action="capture"'
+    assert metrics[f"xthings_action_run_seconds_count{{{action}}}"] == 1
+    assert metrics[f"xthings_action_queue_wait_seconds_count{{{action}}}"] == 1
+    assert (
+        metrics[f'xthings_action_invocations_total{{{action},status="completed"}}'] == 1
+    )
+    assert metrics["xthings_websocket_connections"] == 1
+    assert metrics['xthings_websocket_send_queue_depth{endpoint="/ws"}'] == 0
+    assert not any("connection=" in sample for sample in metrics)
+    stream = 'xthing="/camera",stream="stream"'
+    assert metrics[f"xthings_stream_frames_total{{{stream}}}"] == 3
+    assert metrics[f"xthings_stream_ringbuffer_occupancy{{{stream}}}"] == 3
+    assert metrics[f"xthings_stream_ringbuffer_size{{{stream}}}"] == 4
+    assert metrics[f"xthings_stream_encode_seconds_total{{{stream}}}"] > 0
+
+
+def test_send_queue_metrics():
+    server = XThingsServer(
+        websocket_queue_size=2,
+        server_settings=ServerSettings(metrics_enabled=True),
+    )
+    queues = [server.create_subscriber_queue(f"client{i}") for i in range(3)]
+    for queue, events in zip(queues, (1, 3, 5)):
+        queue.endpoint = "/ws"
+        for event in range(events):
+            queue.send_nowait(event)
+
+    metrics = samples(server.metrics.render())
+    assert metrics['xthings_websocket_send_queue_depth{endpoint="/ws"}'] == 5
+    assert metrics['xthings_websocket_send_queue_max_depth{endpoint="/ws"}'] == 2
+    assert metrics['xthings_websocket_send_queue_dropped_total{endpoint="/ws"}'] == 4
+
+    # the events dropped by connections which closed are still counted
+    queues[2].close()
+    metrics = samples(server.metrics.render())
+    assert metrics['xthings_websocket_send_queue_depth{endpoint="/ws"}'] == 3
+    assert metrics['xthings_websocket_send_queue_dropped_total{endpoint="/ws"}'] == 4
+
+
+def test_metrics_disabled():
+    server = XThingsServer(server_settings=ServerSettings())
+    camera = Camera(service_type, service_name)
+    server.add_xthing(camera, "/camera")
+    assert server.metrics is None
+    with TestClient(server.app) as client:
+        assert client.get("/camera/exposure").json() == 10
+        assert client.get("/metrics").status_code == 404
+
+
+def test_histogram():
+    histogram = Histogram("latency_seconds", "Latency", ("path",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(('a"b',), value)
+    assert histogram.render() == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{path="a\\"b",le="0.1"} 2',
+        'latency_seconds_bucket{path="a\\"b",le="1"} 3',
+        'latency_seconds_bucket{path="a\\"b",le="+Inf"} 4',
+        'latency_seconds_sum{path="a\\"b"} 2.65',
+        'latency_seconds_count{path="a\\"b"} 4',
+    ]
@@ -0,0 +1,133 @@
+from fastapi.testclient import TestClient
+from pydantic import StrictInt
+import json
+import pstats
+import time
+
+from xthings import profiling, xaction, xproperty
+from xthings.server import ServerSettings, XThingsServer
+from xthings.xthing import XThing
+
+service_type = "_http._tcp.local."
+service_name = "thing._http._tcp.local."
+
+
+class Stage(XThing):
+    @xproperty(model=int)
+    def position(self) -> int:
+        time.sleep(0.05)
+        return 1
+
+    @xaction(input_model=StrictInt, output_model=StrictInt)
+    def move(self, n: StrictInt, apn, cancellation_token, logger) -> int:
+        return sum(range(n))
+
+
+def create(tmp_path) -> XThingsServer:
+    settings = ServerSettings(profiling_enabled=True, profiling_folder=str(tmp_path))
+    server = XThingsServer(server_settings=settings)
+    server.add_xthing(Stage(service_type, service_name), "/stage")
+    return server
+
+
+def wait_until_finished(client: TestClient, id: str) -> dict:
+    for _ in range(100):
+        report = client.get(f"/admin/profiling/{id}").json()
+        if report["state"] != "running":
+            return report
+        time.sleep(0.05)
+    raise TimeoutError(id)
+
+
+def test_deterministic_action_profiling(tmp_path):
+    server = create(tmp_path)
+    with TestClient(server.app) as client:
+        r = client.post(
+            "/admin/profiling",
+            json={
+                "mode": "deterministic",
+                "scope": "action",
+                "xthing": "/stage",
+                "name": "move",
+                "duration": 0.5,
+            },
+        )
+        assert r.status_code == 201
+        id = r.json()["id"]
+        assert client.post("/admin/profiling", json={}).status_code == 409
+        for _ in range(2):
+            client.post("/stage/move", json=1000)
+        client.get("/stage/position")
+        report = wait_until_finished(client, id)
+
+    assert report["state"] == "finished"
+    assert report["calls"] == [
+        {
+            "kind": "action",
+            "xthing": "/stage",
+            "name": "move",
+            "calls": 2,
+            "total_seconds": report["calls"][0]["total_seconds"],
+            "max_seconds": report["calls"][0]["max_seconds"],
+        }
+    ]
+    prof = next(f for f in report["files"] if f.endswith(".prof"))
+    stats = pstats.Stats(prof)
+    assert any(name == "move" for _, _, name in stats.stats)
+    calls = next(f for f in report["files"] if f.endswith(".calls.json"))
+    with open(calls) as f:
+        assert json.load(f)["calls"][0]["calls"] == 2
+
+
+def test_sampling_property_profiling(tmp_path):
+    server = create(tmp_path)
+    with TestClient(server.app) as client:
+        r = client.post(
+            "/admin/profiling",
+            json={
+                "scope": "property",
+                "xthing": "/stage",
+                "name": "position",
+                "duration": 0.5,
+                "interval": 0.001,
+            },
+        )
+        id = r.json()["id"]
+        for _ in range(4):
+            assert client.get("/stage/position").json() == 1
+        report = wait_until_finished(client, id)
+        assert [r["id"] for r in client.get("/admin/profiling").json()] == [id]
+
+    assert report["calls"][0]["calls"] == 4
+    folded = next(f for f in report["files"] if f.endswith(".folded"))
+    with open(folded) as f:
+        stacks = f.read().splitlines()
+    assert stacks
+    assert all(";position (" in line for line in stacks)
+
+
+def test_profiling_requests(tmp_path):
+    server = create(tmp_path)
+    with TestClient(server.app) as client:
+        r = client.post("/admin/profiling", json={"scope": "action"})
+        assert r.status_code == 422
+        r = client.post(
+            "/admin/profiling",
+            json={"scope": "action", "xthing": "/stage", "name": "position"},
+        )
+        assert r.status_code == 404
+        assert client.get("/admin/profiling/nope").status_code == 404
+
+    server = XThingsServer(server_settings=ServerSettings())
+    with TestClient(server.app) as client:
+        assert client.post("/admin/profiling", json={}).status_code == 404
+
+
+def test_profiled_call_without_sessions():
+    class Unprofiled:
+        @property
+        def _path(self):
+            raise AssertionError("looked up the XThing without a session")
+
+    assert profiling.active_sessions == []
+    assert profiling.profiled_call("action", Unprofiled(), "move", sum, [1, 2]) == 3
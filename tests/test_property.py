@@ -4,7 +4,9 @@ from xthings.server import XThingsServer
 from xthings.xthing import XThing
 from xthings.descriptors import PropertyDescriptor
 from xthings import xproperty
-from pydantic import BaseModel
+from pydantic import BaseModel, StrictInt
+import numpy as np
+import time
 
 service_type = "_http._tcp.local."
 service_name = "thing._http._tcp.local."
@@ -42,6 +44,44 @@ class MyXThing(XThing):
     def xyz(self, v: User):
         self._xyz = v
 
+    _counter: int = 0
+
+    @xproperty(model=StrictInt, poll_interval=0.01)
+    def counter(self) -> int:
+        return self._counter
+
+    _temperature: float = 20.0
+
+    @xproperty(model=float, poll_interval=0.01, deadband=0.5)
+    def temperature(self) -> float:
+        return self._temperature
+
+    position = PropertyDescriptor(float, 0.0, history_length=1000)
+
+    _voltage: float = 0.0
+
+    @xproperty(model=float, history_length=10)
+    def voltage(self) -> float:
+        return self._voltage
+
+    _setpoint: float = 0.0
+
+    @xproperty(model=float)
+    async def setpoint(self) -> float:
+        return self._setpoint
+
+    @setpoint.setter
+    async def setpoint(self, v: float):
+        self._setpoint = v
+
+    @xproperty(model=int, max_concurrency=2)
+    def borrowed_tokens(self) -> int:
+        return int(self.capacity_limiter("borrowed_tokens").borrowed_tokens)
+
+    @xproperty(model=int)
+    def shared_borrowed_tokens(self) -> int:
+        return int(self.capacity_limiter().borrowed_tokens)
+
 
 def test_property_initialization():
     p = PropertyDescriptor(User, user1)
@@ -127,3 +167,173 @@ def test_property_observer():
                     message = ws2.receive_json(mode="text")
                     assert message["messageType"] == "propertyStatus"
                     assert User.model_validate(message["data"]["xyz"]) == user2
+
+
+def test_property_sampling():
+    server = XThingsServer()
+    xthing = MyXThing(service_type, service_name)
+    server.add_xthing(xthing, "/xthing")
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/xthing/ws") as ws:
+            ws.send_json(
+                {
+                    "messageType": "addPropertyObservation",
+                    "data": {"counter": True, "temperature": True},
+                }
+            )
+            message = ws.receive_json(mode="text")
+            assert message["status"] == "success"
+            assert xthing in MyXThing.counter._sampled_xthings
+
+            time.sleep(0.05)
+            xthing._temperature = 20.2  # within the deadband, not pushed
+            xthing._counter = 1  # changed behind the getter
+
+            message = ws.receive_json(mode="text")
+            assert message == {
+                "messageType": "propertyStatus",
+                "data": {"counter": 1},
+                "thing": "/xthing",
+                "seq": xthing.event_log.last_id,
+            }
+
+            xthing._temperature = 21.0
+            message = ws.receive_json(mode="text")
+            assert message == {
+                "messageType": "propertyStatus",
+                "data": {"temperature": 21.0},
+                "thing": "/xthing",
+                "seq": xthing.event_log.last_id,
+            }
+
+        # sampling stops once the last observer has left
+        for _ in range(100):
+            if xthing not in MyXThing.counter._sampled_xthings:
+                break
+            time.sleep(0.01)
+        assert xthing not in MyXThing.counter._sampled_xthings
+        assert xthing not in MyXThing.temperature._sampled_xthings
+
+
+def test_property_history():
+    server = XThingsServer()
+    xthing = MyXThing(service_type, service_name)
+    server.add_xthing(xthing, "/xthing")
+
+    with TestClient(server.app) as client:
+        r = client.get("/xthing/p/history")
+        assert r.status_code == 404
+
+        for i in range(100):
+            client.put("/xthing/position", json=float(i))
+
+        r = client.get("/xthing/position/history")
+        history = r.json()
+        assert history["mean"] == [float(i) for i in range(100)]
+
+        r = client.get("/xthing/position/history", params={"max_points": 10})
+        history = r.json()
+        assert 0 < len(history["mean"]) <= 10
+        assert sum(history["count"]) == 100
+        assert history["min"][0] == 0.0
+        assert history["max"][-1] == 99.0
+
+        t = client.get("/xthing/position/history").json()["timestamps"]
+        r = client.get("/xthing/position/history", params={"from": t[50], "to": t[59]})
+        assert r.json()["mean"] == [float(i) for i in range(50, 60)]
+
+        # without a poll_interval, the values read are recorded
+        for voltage in (1.0, 2.0):
+            xthing._voltage = voltage
+            assert client.get("/xthing/voltage").json() == voltage
+        assert client.get("/xthing/voltage/history").json()["mean"] == [1.0, 2.0]
+
+
+def test_property_async_getter_setter():
+    server = XThingsServer()
+    xthing = MyXThing(service_type, service_name)
+    server.add_xthing(xthing, "/xthing")
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/xthing/ws") as ws:
+            ws.send_json(
+                {"messageType": "addPropertyObservation", "data": {"setpoint": True}}
+            )
+            ws.receive_json(mode="text")
+
+            r = client.put("/xthing/setpoint", json=1.5)
+            assert r.status_code == 200
+            message = ws.receive_json(mode="text")
+            assert message == {
+                "messageType": "propertyStatus",
+                "data": {"setpoint": 1.5},
+                "thing": "/xthing",
+                "seq": xthing.event_log.last_id,
+            }
+
+        assert client.get("/xthing/setpoint").json() == 1.5
+        assert xthing._setpoint == 1.5
+
+
+def test_property_capacity_limiter():
+    server = XThingsServer()
+    xthing = MyXThing(service_type, service_name)
+    xthing.thread_limit = 3
+    server.add_xthing(xthing, "/xthing")
+
+    with TestClient(server.app) as client:
+        # sync getters borrow a token from the limiter of the XThing ...
+        assert client.get("/xthing/shared_borrowed_tokens").json() == 1
+        assert xthing.capacity_limiter().total_tokens == 3
+        # ... or from their own one if they declare a max_concurrency
+        assert client.get("/xthing/borrowed_tokens").json() == 1
+        assert xthing.capacity_limiter("borrowed_tokens").total_tokens == 2
+        assert xthing.capacity_limiter().borrowed_tokens == 0
+
+        xthing.thread_limit = 5
+        assert xthing.capacity_limiter().total_tokens == 5
+
+
+class FlakyXThing(XThing):
+    _reads: int = 0
+
+    @xproperty(model=int, poll_interval=0.01)
+    def flaky(self) -> int:
+        self._reads += 1
+        if self._reads <= 2:
+            raise RuntimeError("sensor not ready")
+        return self._reads
+
+
+def test_property_sampling_errors():
+    server = XThingsServer()
+    xthing = FlakyXThing(service_type, service_name)
+    server.add_xthing(xthing, "/flaky")
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/flaky/ws") as ws:
+            ws.send_json(
+                {"messageType": "addPropertyObservation", "data": {"flaky": True}}
+            )
+            assert ws.receive_json(mode="text")["status"] == "success"
+            # the failing first samples neither stop sampling nor the server
+            message = ws.receive_json(mode="text")
+            assert message["messageType"] == "propertyStatus"
+            assert message["data"]["flaky"] > 3
+        assert client.get("/flaky/flaky").status_code == 200
+
+
+def test_property_value_changed_arrays():
+    p = PropertyDescriptor(list, [])
+    a = np.zeros((2, 2))
+    assert not p.value_changed(a, a.copy())
+    assert p.value_changed(a, a + 1)
+    assert p.value_changed(a, np.zeros(3))
+
+    p = PropertyDescriptor(list, [], deadband=0.5)
+    assert not p.value_changed(a, a + 0.2)
+    assert p.value_changed(a, a + 1)
+    frame = np.zeros(4, dtype=np.uint8)
+    assert not p.value_changed(frame, frame)
+    assert p.value_changed(frame, frame - 1)
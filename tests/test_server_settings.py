@@ -0,0 +1,75 @@
+import pytest
+import uvicorn
+
+from xthings import cli
+from xthings.server import ServerSettings, XThingsServer, load_server_settings
+from xthings.server.xthings_settings import SERVER_SETTINGS_ENVIRONMENT_VARIABLE
+from xthings.xthing import XThing
+
+service_type = "_http._tcp.local."
+service_name = "thing._http._tcp.local."
+
+
+def test_load_server_settings(tmp_path, monkeypatch):
+    monkeypatch.delenv(SERVER_SETTINGS_ENVIRONMENT_VARIABLE, raising=False)
+    assert load_server_settings(str(tmp_path)) == ServerSettings()
+
+    (tmp_path / "server.yaml").write_text("port: 8080\nloop: asyncio\nkeep_alive: 10\n")
+    settings = load_server_settings(str(tmp_path))
+    assert settings.port == 8080
+    assert settings.workers == 1
+    assert settings.uvicorn_options()["loop"] == "asyncio"
+    assert settings.uvicorn_options()["timeout_keep_alive"] == 10
+    assert "event loop      asyncio" in settings.describe()
+    assert settings.mdns_server_name.endswith(".local.")
+
+    (tmp_path / "server.yaml").write_text("loop: trio\n")
+    with pytest.raises(ValueError):
+        load_server_settings(str(tmp_path))
+
+    # the settings given by `xthings serve` win over the file
+    settings = ServerSettings(port=9000)
+    monkeypatch.setenv(SERVER_SETTINGS_ENVIRONMENT_VARIABLE, settings.model_dump_json())
+    assert load_server_settings(str(tmp_path)).port == 9000
+    server = XThingsServer(settings_folder=str(tmp_path))
+    assert server.server_settings.port == 9000
+
+
+def create_server():
+    server = XThingsServer()
+    server.add_xthing(XThing(service_type, service_name), "/xthing")
+    return server
+
+
+def test_serve(tmp_path, monkeypatch, capsys):
+    monkeypatch.delenv(SERVER_SETTINGS_ENVIRONMENT_VARIABLE, raising=False)
+    monkeypatch.delenv("XTHINGS_SETTINGS_FOLDER", raising=False)
+    (tmp_path / "server.yaml").write_text("port: 8080\nbacklog: 100\n")
+    calls = []
+    monkeypatch.setattr(uvicorn, "run", lambda app, **kw: calls.append((app, kw)))
+
+    cli.main(
+        [
+            "serve",
+            "test_server_settings:create_server",
+            "--settings-folder",
+            str(tmp_path),
+            "--port",
+            "8081",
+            "--loop",
+            "asyncio",
+        ]
+    )
+    ((app, options),) = calls
+    assert app == "test_server_settings:create_server"
+    assert options["factory"]
+    assert options["port"] == 8081
+    assert options["backlog"] == 100
+    assert options["loop"] == "asyncio"
+    output = capsys.readouterr().out
+    assert "0.0.0.0:8081" in output
+
+    # the servers created by the factory read the effective settings
+    server = create_server()
+    assert server.server_settings.port == 8081
+    assert server.server_settings.backlog == 100
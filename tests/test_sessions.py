@@ -0,0 +1,155 @@
+from fastapi.testclient import TestClient
+import time
+
+from xthings import xproperty
+from xthings.server import XThingsServer, SessionStore
+from xthings.xthing import XThing
+
+service_type = "_http._tcp.local."
+service_name = "thing._http._tcp.local."
+
+
+class MyXThing(XThing):
+    _count: int = 0
+
+    @xproperty(model=int)
+    def count(self) -> int:
+        return self._count
+
+    @count.setter
+    def count(self, value: int):
+        self._count = value
+
+
+def wait_until_released(xthing):
+    for _ in range(100):
+        if len(xthing.subscriptions) == 0:
+            break
+        time.sleep(0.01)
+    time.sleep(0.05)
+
+
+def test_session_store():
+    sessions = SessionStore(max_sessions=2, ttl=60)
+    first = sessions.create()
+    assert len(sessions) == 1
+    # an open session cannot be taken over
+    other = sessions.create()
+    assert sessions.resume(other, first.session_id) is None
+
+    topics = frozenset({("property", "count")})
+    sessions.release(first, {"/xthing": topics, "/other": frozenset()})
+    assert first.subscriptions == {"/xthing": topics}
+    resumed = sessions.resume(other, first.session_id)
+    assert resumed is first
+    assert other.session_id == first.session_id
+    # a session is resumed once
+    assert sessions.resume(sessions.create(), first.session_id) is None
+
+    # the oldest closed sessions are forgotten first
+    closed = [sessions.create() for _ in range(3)]
+    for session in closed:
+        sessions.release(session, {})
+    assert sessions.resume(sessions.create(), closed[0].session_id) is None
+    assert sessions.resume(sessions.create(), closed[2].session_id) is closed[2]
+
+
+def test_session_store_expiry():
+    sessions = SessionStore(ttl=0)
+    session = sessions.create()
+    sessions.release(session, {})
+    time.sleep(0.01)
+    assert sessions.resume(sessions.create(), session.session_id) is None
+
+
+def test_resume_replays_missed_events():
+    server = XThingsServer()
+    xthing = MyXThing(service_type, service_name)
+    server.add_xthing(xthing, "/xthing")
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/xthing/ws") as ws:
+            ws.send_json(
+                {"messageType": "addPropertyObservation", "data": {"count": True}}
+            )
+            session_id = ws.receive_json(mode="text")["sessionId"]
+            client.put("/xthing/count", json=1)
+            last_seq = ws.receive_json(mode="text")["seq"]
+        wait_until_released(xthing)
+
+        # missed while disconnected
+        client.put("/xthing/count", json=2)
+        client.put("/xthing/count", json=3)
+
+        with client.websocket_connect("/xthing/ws") as ws:
+            ws.send_json(
+                {"messageType": "resume", "sessionId": session_id, "lastSeq": last_seq}
+            )
+            assert ws.receive_json(mode="text") == {
+                "status": "success",
+                "sessionId": session_id,
+            }
+            replayed = [ws.receive_json(mode="text") for _ in range(2)]
+            assert [m["data"]["count"] for m in replayed] == [2, 3]
+            assert [m["seq"] for m in replayed] == [last_seq + 1, last_seq + 2]
+
+            # the subscriptions are restored
+            client.put("/xthing/count", json=4)
+            assert ws.receive_json(mode="text")["data"] == {"count": 4}
+        wait_until_released(xthing)
+
+        # events which are not in the log anymore are replaced by a snapshot
+        with client.websocket_connect("/xthing/ws") as ws:
+            ws.send_json({"messageType": "resume", "sessionId": session_id})
+            assert ws.receive_json(mode="text")["status"] == "success"
+            assert ws.receive_json(mode="text") == {
+                "messageType": "snapshot",
+                "thing": "/xthing",
+                "seq": xthing.event_log.last_id,
+                "data": {"count": 4},
+            }
+
+            ws.send_json({"messageType": "resume", "sessionId": "unknown"})
+            message = ws.receive_json(mode="text")
+            assert message["status"] == "error"
+            assert message["errorMessage"] == "UnknownSession"
+            assert message["sessionId"] == session_id
+
+
+def test_resume_multiplexed_websocket():
+    server = XThingsServer()
+    first = MyXThing(service_type, service_name)
+    second = MyXThing(service_type, service_name)
+    server.add_xthing(first, "/first")
+    server.add_xthing(second, "/second")
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            ws.send_json(
+                {
+                    "thing": "/second",
+                    "messageType": "addPropertyObservation",
+                    "data": {"*": True},
+                }
+            )
+            session_id = ws.receive_json(mode="text")["sessionId"]
+        wait_until_released(second)
+
+        last_seq = second.event_log.last_id
+        client.put("/first/count", json=1)
+        client.put("/second/count", json=2)
+
+        with client.websocket_connect("/ws") as ws:
+            ws.send_json(
+                {
+                    "messageType": "resume",
+                    "sessionId": session_id,
+                    "lastSeq": {"/second": last_seq},
+                }
+            )
+            assert ws.receive_json(mode="text")["status"] == "success"
+            message = ws.receive_json(mode="text")
+            assert message["thing"] == "/second"
+            assert message["data"] == {"count": 2}
+            assert len(second.property_observers("count")) == 1
+            assert first.property_observers("count") == ()
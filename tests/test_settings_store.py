@@ -0,0 +1,133 @@
+from fastapi.testclient import TestClient
+import anyio
+import os
+import sys
+import threading
+import time
+import yaml
+
+from xthings.server import ServerSettings, SettingsStore, XThingsServer
+from xthings.xthing import XThing
+
+service_type = "_http._tcp.local."
+service_name = "thing._http._tcp.local."
+
+
+def read(filename: str) -> dict:
+    with open(filename) as f:
+        return yaml.safe_load(f)
+
+
+def test_settings_store_write_back(tmp_path):
+    filename = str(tmp_path / "stage.settings.yaml")
+    store = SettingsStore(filename, write_delay=0.2, poll_interval=None)
+    store.load()
+    assert dict(store.settings) == {}
+
+    async def main():
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(store.run)
+            for i in range(5):
+                store.settings["speed"] = i
+                await anyio.sleep(0.05)
+            assert not os.path.exists(filename)
+            await anyio.sleep(0.4)
+            tg.cancel_scope.cancel()
+
+    anyio.run(main)
+    # the changes were batched in one atomic write
+    assert store.writes == 1
+    assert not store.dirty
+    assert read(filename) == {"speed": 4}
+    assert os.listdir(tmp_path) == ["stage.settings.yaml"]
+
+    store = SettingsStore(filename)
+    store.load()
+    assert dict(store.settings) == {"speed": 4}
+
+
+def test_settings_store_threads(tmp_path):
+    filename = str(tmp_path / "stage.settings.yaml")
+    store = SettingsStore(filename, write_delay=0.2, poll_interval=None)
+    store.load()
+
+    def change(thread: int):
+        for i in range(500):
+            store.settings[f"{thread}-{i}"] = [i] * 10
+
+    async def main():
+        threads = [threading.Thread(target=change, args=(t,)) for t in range(4)]
+        for thread in threads:
+            thread.start()
+        # flushed while the handlers change the settings in their threads
+        while any(thread.is_alive() for thread in threads):
+            await store.flush()
+        await store.flush()
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        anyio.run(main)
+    finally:
+        sys.setswitchinterval(interval)
+    assert not store.dirty
+    assert len(read(filename)) == 2000
+
+
+def test_settings_store_reload(tmp_path):
+    filename = tmp_path / "stage.settings.yaml"
+    filename.write_text("speed: 1\nacceleration: 2\n")
+    store = SettingsStore(str(filename))
+    store.load()
+
+    async def main():
+        assert await store.reload_if_modified() == set()
+        store.settings["acceleration"] = 3
+        filename.write_text("speed: 5\nacceleration: 4\nlimit: 10\n")
+        os.utime(filename, ns=(time.time_ns(), time.time_ns() + 10**9))
+        # the changes which are not written yet win
+        assert await store.reload_if_modified() == {"speed", "limit"}
+        assert dict(store.settings) == {"speed": 5, "acceleration": 3, "limit": 10}
+        await store.flush()
+
+    anyio.run(main)
+    assert read(str(filename)) == {"speed": 5, "acceleration": 3, "limit": 10}
+
+
+class Stage(XThing):
+    changed: list[set[str]]
+
+    def settings_changed(self, keys: set[str]):
+        self.changed.append(keys)
+
+
+def test_server_settings_store(tmp_path):
+    settings = ServerSettings(
+        mdns_enabled=False, settings_write_delay=0.1, settings_poll_interval=0.05
+    )
+    server = XThingsServer(settings_folder=str(tmp_path), server_settings=settings)
+    stage = Stage(service_type, service_name)
+    stage.changed = []
+    server.add_xthing(stage, "/stage")
+    filename = tmp_path / "stage.settings.yaml"
+
+    with TestClient(server.app):
+        stage.settings["speed"] = 1
+        for _ in range(40):
+            if filename.exists():
+                break
+            time.sleep(0.05)
+        assert read(str(filename)) == {"speed": 1}
+
+        filename.write_text("speed: 2\n")
+        os.utime(filename, ns=(time.time_ns(), time.time_ns() + 10**9))
+        for _ in range(40):
+            if stage.changed:
+                break
+            time.sleep(0.05)
+        assert stage.changed == [{"speed"}]
+        assert stage.settings["speed"] == 2
+
+        # written at shutdown at the latest
+        stage.settings["limit"] = 10
+    assert read(str(filename)) == {"speed": 2, "limit": 10}
@@ -0,0 +1,138 @@
+from contextlib import aclosing
+from fastapi.testclient import TestClient
+import anyio
+import json
+
+from xthings import xproperty
+from xthings.server import XThingsServer, EventMessage, EventLog
+from xthings.server.xthings_sse import format_sse, sse_stream
+from xthings.xthing import XThing
+
+service_type = "_http._tcp.local."
+service_name = "thing._http._tcp.local."
+
+
+def event(name, value, thing="/xthing"):
+    return EventMessage("propertyStatus", name, value, thing)
+
+
+class MyXThing(XThing):
+    _count: int = 0
+
+    @xproperty(model=int)
+    def count(self) -> int:
+        return self._count
+
+    @count.setter
+    def count(self, value: int):
+        self._count = value
+
+
+def test_event_log_since():
+    log = EventLog(3)
+    start = log.last_id
+    assert log.since(start) == []
+    ids = [log.append(event("count", i)) for i in range(5)]
+    assert ids == list(range(start + 1, start + 6))
+    assert len(log) == 3
+
+    assert [e.value for _, e in log.since(ids[1])] == [2, 3, 4]
+    assert [e.value for _, e in log.since(ids[3])] == [4]
+    assert log.since(ids[4]) == []
+    # events were dropped from the log
+    assert log.since(ids[0]) is None
+    # an id from the future, e.g. from before a restart with a wrong clock
+    assert log.since(ids[4] + 1) is None
+
+
+def test_format_sse():
+    frame = format_sse(7, event("count", 1))
+    lines = frame.split("\n")
+    assert lines[0] == "id: 7"
+    assert lines[1] == "event: propertyStatus"
+    assert json.loads(lines[2][len("data: ") :]) == {
+        "messageType": "propertyStatus",
+        "data": {"count": 1},
+        "thing": "/xthing",
+    }
+    assert frame.endswith("\n\n")
+    assert format_sse(8, None) == "id: 8\nevent: reset\ndata: {}\n\n"
+
+
+def test_sse_stream_resumes_from_last_event_id():
+    async def main():
+        log = EventLog(10)
+        first = log.append(event("count", 1))
+        log.append(event("count", 2))
+
+        frames = []
+
+        async def read(last_event_id, n):
+            async with aclosing(sse_stream(log, last_event_id)) as stream:
+                async for frame in stream:
+                    frames.append(frame)
+                    if len(frames) == n:
+                        return
+
+        # replay the events after the last one seen, then follow new ones
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(read, str(first), 2)
+            await anyio.sleep(0.01)
+            assert log.followers == 1
+            log.append(event("count", 3))
+        assert log.followers == 0
+        assert ["data: {" in f for f in frames] == [True, True]
+        assert '"count":2' in frames[0]
+        assert '"count":3' in frames[1]
+
+        # events which are not in the log anymore are reported by a reset
+        frames.clear()
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(read, "not-an-id", 1)
+        assert frames == [f"id: {log.last_id}\nevent: reset\ndata: {{}}\n\n"]
+
+    anyio.run(main)
+
+
+def test_sse_follow_without_last_event_id_starts_at_the_end():
+    async def main():
+        log = EventLog(10)
+        log.append(event("count", 1))
+        received = []
+
+        async def read():
+            async for event_id, e in log.follow():
+                received.append((event_id, e.value))
+                return
+
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(read)
+            await anyio.sleep(0.01)
+            event_id = log.append(event("count", 2))
+        assert received == [(event_id, 2)]
+
+    anyio.run(main)
+
+
+def test_events_are_logged_per_xthing_and_server():
+    server = XThingsServer()
+    first = MyXThing(service_type, service_name)
+    second = MyXThing(service_type, service_name)
+    server.add_xthing(first, "/first")
+    server.add_xthing(second, "/second")
+    paths = [route.path for route in server.app.routes]
+    assert "/events" in paths
+    assert "/first/events" in paths
+
+    with TestClient(server.app) as client:
+        # events are logged even if nobody observes them
+        client.put("/first/count", json=1)
+        client.put("/second/count", json=2)
+
+    assert len(first.event_log) == 1
+    assert len(second.event_log) == 1
+    logged = server.event_log.since(server.event_log.last_id - 2)
+    assert [(e.thing, e.value) for _, e in logged] == [
+        ("/first", 1),
+        ("/second", 2),
+    ]
@@ -0,0 +1,185 @@
+from fastapi.testclient import TestClient
+import anyio
+import itertools
+import pytest
+import threading
+import time
+
+from xthings import xproperty
+from xthings.server import XThingsServer
+from xthings.xthing import XThing
+
+service_type = "_http._tcp.local."
+names = itertools.count()
+
+
+class SlowXThing(XThing):
+    def __init__(self, log: list, setup_time: float = 0.2, failures: int = 0):
+        super().__init__(service_type, f"thing{next(names)}._http._tcp.local.")
+        self._log = log
+        self._setup_time = setup_time
+        self._failures = failures
+        self._lock = threading.Lock()
+
+    @xproperty(model=int)
+    def value(self) -> int:
+        return 1
+
+    def setup(self):
+        with self._lock:
+            self._log.append(("setup", self))
+        time.sleep(self._setup_time)
+        if self._failures > 0:
+            self._failures -= 1
+            raise RuntimeError("camera not found")
+
+    def teardown(self):
+        with self._lock:
+            self._log.append(("teardown", self))
+
+
+def start(server: XThingsServer):
+    async def main():
+        async with server.lifespan(server.app):
+            ...
+
+    anyio.run(main)
+
+
+def root_cause(e: BaseException) -> BaseException:
+    while hasattr(e, "exceptions"):
+        (e,) = e.exceptions
+    return e
+
+
+def test_concurrent_setup():
+    log: list = []
+    server = XThingsServer()
+    xthings = [SlowXThing(log, setup_time=0.3) for _ in range(4)]
+    for i, xthing in enumerate(xthings):
+        server.add_xthing(xthing, f"/camera{i}")
+
+    start = time.monotonic()
+    with TestClient(server.app) as client:
+        assert time.monotonic() - start < 1.0
+        report = client.get("/startup").json()
+        assert [r["state"] for r in report] == ["ready"] * 4
+        assert all(r["setup_time"] >= 0.3 for r in report)
+        assert client.get("/camera0/value").json() == 1
+    assert len([event for event, _ in log if event == "teardown"]) == 4
+
+
+def test_setup_dependencies():
+    log: list = []
+    server = XThingsServer()
+    stage = SlowXThing(log, setup_time=0.1)
+    camera = SlowXThing(log, setup_time=0.1)
+    server.add_xthing(camera, "/camera", depends_on=["/stage"])
+    server.add_xthing(stage, "/stage")
+
+    with TestClient(server.app):
+        assert log == [("setup", stage), ("setup", camera)]
+    assert log[2:] == [("teardown", camera), ("teardown", stage)]
+
+    server = XThingsServer()
+    server.add_xthing(SlowXThing(log), "/a", depends_on=["/b"])
+    server.add_xthing(SlowXThing(log), "/b", depends_on=["/a"])
+    with pytest.raises(ValueError):
+        start(server)
+
+
+def test_setup_timeout():
+    log: list = []
+    server = XThingsServer(setup_timeout=5)
+    fast = SlowXThing(log, setup_time=0)
+    server.add_xthing(fast, "/fast")
+    server.add_xthing(SlowXThing(log, setup_time=1), "/slow", setup_timeout=0.1)
+
+    with pytest.raises(Exception) as e:
+        start(server)
+    assert isinstance(root_cause(e.value), TimeoutError)
+    # the XThings which came up are torn down
+    assert ("teardown", fast) in log
+
+
+def test_degraded_startup():
+    log: list = []
+    server = XThingsServer(degraded_startup=True, setup_retry_interval=0.1)
+    flaky = SlowXThing(log, setup_time=0, failures=2)
+    server.add_xthing(SlowXThing(log, setup_time=0), "/ok")
+    server.add_xthing(flaky, "/flaky")
+    dependent = SlowXThing(log, setup_time=0)
+    server.add_xthing(dependent, "/dependent", depends_on=["/flaky"])
+
+    with TestClient(server.app) as client:
+        assert client.get("/ok/value").json() == 1
+        r = client.get("/flaky/value")
+        assert r.status_code == 503
+        assert "Retry-After" in r.headers
+        report = {r["path"]: r for r in client.get("/startup").json()}
+        assert report["/flaky"]["state"] in ("failed", "starting")
+        assert "camera not found" in report["/flaky"]["error"]
+        assert report["/dependent"]["state"] == "pending"
+
+        for _ in range(50):
+            if client.get("/dependent/value").status_code == 200:
+                break
+            time.sleep(0.05)
+        assert client.get("/flaky/value").json() == 1
+        report = {r["path"]: r for r in client.get("/startup").json()}
+        assert report["/flaky"]["attempts"] == 3
+        assert report["/dependent"]["state"] == "ready"
+    assert ("teardown", flaky) in log
+
+
+def test_restart():
+    log: list = []
+    server = XThingsServer()
+    stage = SlowXThing(log, setup_time=0.1)
+    camera = SlowXThing(log, setup_time=0)
+    server.add_xthing(camera, "/camera", depends_on=["/stage"])
+    server.add_xthing(stage, "/stage")
+
+    for _ in range(2):
+        log.clear()
+        with TestClient(server.app) as client:
+            assert log == [("setup", stage), ("setup", camera)]
+            report = {r["path"]: r for r in client.get("/startup").json()}
+            assert report["/camera"]["attempts"] == 1
+        assert log[2:] == [("teardown", camera), ("teardown", stage)]
+
+
+def test_abandoned_setup():
+    log: list = []
+    server = XThingsServer(
+        degraded_startup=True, setup_timeout=0.1, setup_retry_interval=0.05
+    )
+    slow = SlowXThing(log, setup_time=0.5)
+    server.add_xthing(slow, "/slow")
+
+    with TestClient(server.app):
+        # the setup which timed out is not retried while its thread runs
+        time.sleep(0.3)
+        assert log == [("setup", slow)]
+        assert slow.setup_running
+        # and the XThing is torn down once that setup completes
+        for _ in range(50):
+            if len(log) > 1:
+                break
+            time.sleep(0.02)
+        assert log[:2] == [("setup", slow), ("teardown", slow)]
+
+    # a setup which fails cancels the others, which are torn down too
+    log.clear()
+    server = XThingsServer()
+    server.add_xthing(SlowXThing(log, setup_time=0.1, failures=1), "/failing")
+    cancelled = SlowXThing(log, setup_time=0.5)
+    server.add_xthing(cancelled, "/cancelled")
+    with pytest.raises(Exception):
+        start(server)
+    assert cancelled.setup_running
+    for _ in range(50):
+        if not cancelled.setup_running:
+            break
+        time.sleep(0.02)
+    assert ("teardown", cancelled) in log
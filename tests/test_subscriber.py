@@ -0,0 +1,147 @@
+from anyio import ClosedResourceError
+from fastapi.testclient import TestClient
+import anyio
+import json
+import pytest
+
+from xthings.server import OverflowPolicy, SubscriberQueue, XThingsServer
+from xthings.server.xthings_events import EventMessage
+from xthings.xthing import XThing
+
+service_type = "_http._tcp.local."
+service_name = "thing._http._tcp.local."
+
+
+def event(name, value):
+    return {"messageType": "propertyStatus", "data": {name: value}}
+
+
+async def drain(queue: SubscriberQueue):
+    queue.close()
+    return [item async for item in queue]
+
+
+def test_subscriber_queue_drop_oldest():
+    async def main():
+        queue = SubscriberQueue(3, OverflowPolicy.DROP_OLDEST)
+        for i in range(5):
+            await queue.send(event("a", i))
+        stats = queue.statistics()
+        assert stats.depth == 3
+        assert stats.dropped == 2
+        assert [e["data"]["a"] for e in await drain(queue)] == [2, 3, 4]
+        assert queue.statistics().delivered == 3
+
+    anyio.run(main)
+
+
+def test_subscriber_queue_conflate():
+    async def main():
+        queue = SubscriberQueue(3, OverflowPolicy.CONFLATE)
+        await queue.send(event("a", 0))
+        await queue.send(event("b", 0))
+        await queue.send(event("a", 1))
+        await queue.send(event("b", 1))  # replaces b=0
+        await queue.send(event("a", 2))  # replaces a=0
+        assert queue.statistics().conflated == 2
+        assert await drain(queue) == [event("a", 1), event("b", 1), event("a", 2)]
+
+    anyio.run(main)
+
+
+def test_subscriber_queue_does_not_conflate_action_status():
+    def status(value):
+        return {"messageType": "actionStatus", "data": {"move": value}}
+
+    async def main():
+        queue = SubscriberQueue(2, OverflowPolicy.CONFLATE)
+        await queue.send(status("completed"))
+        await queue.send(event("a", 0))
+        # the status of a later invocation does not replace the terminal one
+        await queue.send(status("running"))
+        assert queue.statistics().conflated == 0
+        assert await drain(queue) == [event("a", 0), status("running")]
+
+        queue = SubscriberQueue(3, OverflowPolicy.CONFLATE)
+        for value in ("completed", "pending", "running"):
+            await queue.send(EventMessage("actionStatus", "move", value))
+        await queue.send(EventMessage("actionStatus", "move", "completed"))
+        assert queue.statistics().conflated == 0
+        assert [e.value for e in await drain(queue)] == [
+            "pending",
+            "running",
+            "completed",
+        ]
+
+    anyio.run(main)
+
+
+def test_subscriber_queue_disconnect():
+    async def main():
+        queue = SubscriberQueue(2, OverflowPolicy.DISCONNECT)
+        await queue.send(event("a", 0))
+        await queue.send(event("a", 1))
+        await queue.send(event("a", 2))
+        assert queue.overflowed
+        assert queue.closed
+        with pytest.raises(ClosedResourceError):
+            await queue.send(event("a", 3))
+        assert await drain(queue) == []
+
+    anyio.run(main)
+
+
+def test_subscriber_queue_receive_waits():
+    async def main():
+        queue = SubscriberQueue()
+        received = []
+
+        async def receive():
+            async for item in queue:
+                received.append(item)
+
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(receive)
+            await anyio.sleep(0.01)
+            await queue.send(event("a", 0))
+            await anyio.sleep(0.01)
+            assert received == [event("a", 0)]
+            await queue.aclose()
+
+    anyio.run(main)
+
+    with pytest.raises(ValueError):
+        SubscriberQueue(0)
+
+
+def test_websocket_statistics():
+    server = XThingsServer(websocket_queue_size=10)
+    xthing = XThing(service_type, service_name)
+    server.add_xthing(xthing, "/xthing")
+
+    with TestClient(server.app) as client:
+        assert client.get("/websockets").json() == []
+        with client.websocket_connect("/xthing/ws"):
+            stats = client.get("/websockets").json()
+            assert len(stats) == 1
+            assert stats[0]["max_size"] == 10
+            assert stats[0]["policy"] == "drop_oldest"
+            assert stats[0]["name"].endswith("/xthing")
+
+
+def test_publish_event_encodes_once():
+    async def main():
+        xthing = XThing(service_type, service_name)
+        queues = [SubscriberQueue() for _ in range(3)]
+        for queue in queues:
+            xthing.add_property_observer_by_attr("foo", queue)
+        await xthing.publish_event("propertyStatus", "foo", {"x": 1.5})
+        events = [await queue.receive() for queue in queues]
+        assert events[0] is events[1] is events[2]
+        assert json.loads(events[0].text) == {
+            "messageType": "propertyStatus",
+            "data": {"foo": {"x": 1.5}},
+            "seq": xthing.event_log.last_id,
+        }
+
+    anyio.run(main)
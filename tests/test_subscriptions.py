@@ -0,0 +1,42 @@
+from xthings.server import SubscriptionRegistry, WILDCARD
+
+
+def test_subscription_registry():
+    registry = SubscriptionRegistry()
+    a, b = object(), object()
+
+    assert registry.subscribe("property", "foo", a)
+    assert not registry.subscribe("property", "foo", a)
+    assert registry.subscribe("property", "foo", b)
+    assert registry.subscribe("action", "bar", a)
+    assert registry.subscribers("property", "foo") == (a, b)
+    assert registry.subscribers("property", "bar") == ()
+    assert registry.topics(a) == {("property", "foo"), ("action", "bar")}
+    assert len(registry) == 2
+
+    snapshot = registry.subscribers("property", "foo")
+    assert registry.unsubscribe("property", "foo", a)
+    assert not registry.unsubscribe("property", "foo", a)
+    assert snapshot == (a, b)  # snapshots are not changed by unsubscribing
+    assert registry.subscribers("property", "foo") == (b,)
+
+    assert registry.unsubscribe_all(a) == {("action", "bar")}
+    assert registry.subscribers("action", "bar") == ()
+    assert len(registry) == 1
+
+
+def test_subscription_registry_wildcard():
+    registry = SubscriptionRegistry()
+    a, b = object(), object()
+
+    registry.subscribe("property", WILDCARD, a)
+    registry.subscribe("property", "foo", b)
+    registry.subscribe("property", "foo", a)
+    assert registry.subscribers("property", "foo") == (b, a)
+    assert registry.subscribers("property", "anything") == (a,)
+    assert registry.subscribers("action", "anything") == ()
+
+    registry.unsubscribe_all(a)
+    registry.unsubscribe_all(b)
+    assert len(registry) == 0
+    assert registry.subscribers("property", "foo") == ()
@@ -0,0 +1,338 @@
+from fastapi import HTTPException
+from pydantic import BaseModel, StrictInt
+import anyio
+import httpx
+import numpy as np
+import pytest
+import time
+import uuid
+
+from xthings import xaction, xlcrud, xproperty
+from xthings.descriptors import PngImageStreamDescriptor
+from xthings.errors import RemoteInteractionError
+from xthings.server import SubscriberQueue, XThingsServer
+from xthings.server.xthings_workers import SharedFrameRing
+from xthings.xthing import XThing
+
+service_type = "_http._tcp.local."
+service_name = "thing._http._tcp.local."
+
+
+class Item(BaseModel):
+    name: str
+
+
+class MyXThing(XThing):
+    _count: int = 0
+    png_stream = PngImageStreamDescriptor(ringbuffer_size=10)
+
+    def setup(self):
+        self._items: dict[str, Item] = {}
+        return super().setup()
+
+    @xproperty(model=int)
+    def count(self) -> int:
+        return self._count
+
+    @count.setter
+    def count(self, value: int):
+        self._count = value
+
+    @xaction(input_model=StrictInt, output_model=StrictInt)
+    def increment(self, i: StrictInt, apn, cancellation_token, logger) -> StrictInt:
+        self._count += i
+        return self._count
+
+    @xproperty(model=int)
+    def slow(self) -> int:
+        time.sleep(0.5)
+        return 0
+
+    @xlcrud(item_model=Item)
+    def items(self):
+        return self._items
+
+    @items.create_func
+    def items(self, item: Item):
+        id = str(uuid.uuid4())
+        self._items[id] = item
+        return id
+
+    @items.retrieve_func
+    def items(self, id: uuid.UUID) -> Item:
+        try:
+            return self._items[str(id)]
+        except KeyError:
+            raise HTTPException(status_code=404)
+
+    @items.update_func
+    def items(self, id: uuid.UUID, item: Item):
+        self._items[str(id)] = item
+
+    @items.delete_func
+    def items(self, id: uuid.UUID):
+        try:
+            del self._items[str(id)]
+        except KeyError:
+            raise HTTPException(status_code=404)
+
+
+def test_shared_frame_ring():
+    ring = SharedFrameRing(slots=2, slot_size=4, create=True)
+    reader = SharedFrameRing(ring.name, slots=2, slot_size=4)
+    try:
+        assert reader.read(0) is None
+        assert ring.write(0, b"abc")
+        assert ring.write(1, b"defg")
+        assert not ring.write(2, b"too large")
+        assert reader.read(0) == b"abc"
+        assert reader.read(1) == b"defg"
+
+        # frames are overwritten when the ring wraps around
+        assert ring.write(2, b"hi")
+        assert reader.read(0) is None
+        assert reader.read(2) == b"hi"
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_worker_forwards_to_owner(tmp_path):
+    ipc_path = str(tmp_path / "xthings.sock")
+    owner = XThingsServer(role="owner", ipc_path=ipc_path)
+    owned = MyXThing(service_type, service_name)
+    owner.add_xthing(owned, "/xthing")
+    worker = XThingsServer(role="worker", ipc_path=ipc_path)
+    relayed = MyXThing(service_type, service_name)
+    worker.add_xthing(relayed, "/xthing")
+
+    async def main():
+        async with owner.lifespan(owner.app), worker.lifespan(worker.app):
+            bridge = worker.worker_bridge
+            with anyio.fail_after(5):
+                await bridge.wait_connected()
+            assert relayed.event_log.last_id == owned.event_log.last_id
+
+            queue = SubscriberQueue()
+            relayed.add_property_observer_by_attr("count", queue)
+
+            await relayed.write_property("count", 3)
+            assert owned._count == 3
+            assert relayed._count == 0
+            assert await relayed.read_property("count") == 3
+
+            # events of the owner reach the observers of the worker
+            with anyio.fail_after(5):
+                event = await queue.receive()
+            assert event.message == {
+                "messageType": "propertyStatus",
+                "thing": "/xthing",
+                "seq": owned.event_log.last_id,
+                "data": {"count": 3},
+            }
+            assert relayed.event_log.last_id == owned.event_log.last_id
+            assert worker.event_log.last_id == owner.event_log.last_id
+
+            invocation = await relayed.invoke_action("increment", 2)
+            assert invocation["status"] in ("pending", "running", "completed")
+            with anyio.fail_after(5):
+                while owned._count != 5:
+                    await anyio.sleep(0.01)
+            assert relayed._count == 0
+
+            with pytest.raises(RemoteInteractionError) as e:
+                await bridge.request(
+                    relayed, {"messageType": "readProperty", "name": "missing"}
+                )
+            assert e.value.error_message == "UnknownAffordance"
+
+            # frames are shared through memory
+            frame = np.zeros((4, 4, 3), dtype=np.uint8)
+            stream = relayed.png_stream
+            async with anyio.create_task_group() as tg:
+
+                async def next_frame():
+                    index = await stream.next_frame()
+                    async with stream.buffer_for_reading(index) as data:
+                        assert data[1:4] == b"PNG"
+
+                tg.start_soon(next_frame)
+                await anyio.sleep(0.1)
+                with anyio.fail_after(5):
+                    while stream.last_frame_i < 0:
+                        await anyio.to_thread.run_sync(
+                            owned.png_stream.add_frame, frame
+                        )
+                        await anyio.sleep(0.05)
+
+        assert relayed._remote is not None
+        assert not bridge.connected
+
+    anyio.run(main)
+
+
+def test_worker_without_owner(tmp_path):
+    worker = XThingsServer(role="worker", ipc_path=str(tmp_path / "none.sock"))
+    relayed = MyXThing(service_type, service_name)
+    worker.add_xthing(relayed, "/xthing")
+
+    async def main():
+        async with worker.lifespan(worker.app):
+            with pytest.raises(RemoteInteractionError) as e:
+                await relayed.read_property("count")
+            assert e.value.error_message == "OwnerDisconnected"
+
+            transport = httpx.ASGITransport(app=worker.app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://worker"
+            ) as client:
+                assert (await client.get("/xthing/count")).status_code == 503
+
+    anyio.run(main)
+
+
+def test_worker_invocations(tmp_path):
+    ipc_path = str(tmp_path / "xthings.sock")
+    owner = XThingsServer(role="owner", ipc_path=ipc_path)
+    owned = MyXThing(service_type, service_name)
+    owner.add_xthing(owned, "/xthing")
+    worker = XThingsServer(role="worker", ipc_path=ipc_path)
+    worker.add_xthing(MyXThing(service_type, service_name), "/xthing")
+
+    async def main():
+        async with owner.lifespan(owner.app), worker.lifespan(worker.app):
+            with anyio.fail_after(5):
+                await worker.worker_bridge.wait_connected()
+            transport = httpx.ASGITransport(app=worker.app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://worker"
+            ) as client:
+                r = await client.post("/xthing/increment", json=2)
+                assert r.status_code == 201
+                href = r.json()["href"]
+
+                # the invocation runs in the owner, and is polled on the worker
+                with anyio.fail_after(5):
+                    while True:
+                        r = await client.get(href)
+                        assert r.status_code == 200
+                        if r.json()["status"] == "completed":
+                            break
+                        await anyio.sleep(0.01)
+                assert r.json()["output"] == 2
+                id = r.json()["id"]
+                assert [i["id"] for i in (await client.get("/invocations")).json()] == [
+                    id
+                ]
+                r = await client.get("/xthing/increment")
+                assert [i["id"] for i in r.json()] == [id]
+
+                assert (await client.delete(href)).status_code == 200
+                missing = f"/invocations/{uuid.uuid4()}"
+                assert (await client.get(missing)).status_code == 404
+                assert (await client.delete(missing)).status_code == 404
+
+    anyio.run(main)
+
+
+def test_worker_lcrud(tmp_path):
+    ipc_path = str(tmp_path / "xthings.sock")
+    owner = XThingsServer(role="owner", ipc_path=ipc_path)
+    owned = MyXThing(service_type, service_name)
+    owner.add_xthing(owned, "/xthing")
+    worker = XThingsServer(role="worker", ipc_path=ipc_path)
+    worker.add_xthing(MyXThing(service_type, service_name), "/xthing")
+
+    async def main():
+        async with owner.lifespan(owner.app), worker.lifespan(worker.app):
+            with anyio.fail_after(5):
+                await worker.worker_bridge.wait_connected()
+            transport = httpx.ASGITransport(app=worker.app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://worker"
+            ) as client:
+                r = await client.post("/xthing/items", json={"name": "a"})
+                assert r.status_code == 200
+                id = r.json()
+                assert owned._items == {id: Item(name="a")}
+
+                r = await client.get("/xthing/items")
+                assert r.json() == {id: {"name": "a"}}
+                etag = r.headers["ETag"]
+                r = await client.get("/xthing/items", headers={"If-None-Match": etag})
+                assert r.status_code == 304
+
+                r = await client.put(f"/xthing/items/{id}", json={"name": "b"})
+                assert r.status_code == 200
+                assert (await client.get(f"/xthing/items/{id}")).json() == {"name": "b"}
+                # changes made through the owner are seen by every worker
+                r = await client.get("/xthing/items", headers={"If-None-Match": etag})
+                assert r.status_code == 200
+
+                r = await client.post(
+                    "/xthing/items/batch", json=[{"name": "c"}, {"name": 1}]
+                )
+                assert [s["status"] for s in r.json()] == [201, 422]
+                assert len(owned._items) == 2
+
+                assert (await client.delete(f"/xthing/items/{id}")).status_code == 200
+                assert id not in owned._items
+                # the HTTP errors of the owner are those of the worker
+                assert (await client.delete(f"/xthing/items/{id}")).status_code == 404
+                assert (await client.get(f"/xthing/items/{id}")).status_code == 404
+
+    anyio.run(main)
+
+
+def test_worker_request_timeout(tmp_path):
+    ipc_path = str(tmp_path / "xthings.sock")
+    owner = XThingsServer(role="owner", ipc_path=ipc_path)
+    owner.add_xthing(MyXThing(service_type, service_name), "/xthing")
+    worker = XThingsServer(role="worker", ipc_path=ipc_path)
+    relayed = MyXThing(service_type, service_name)
+    worker.add_xthing(relayed, "/xthing")
+
+    async def main():
+        async with owner.lifespan(owner.app), worker.lifespan(worker.app):
+            bridge = worker.worker_bridge
+            with anyio.fail_after(5):
+                await bridge.wait_connected()
+            bridge.request_timeout = 0.1
+            with pytest.raises(RemoteInteractionError) as e:
+                await relayed.read_property("slow")
+            assert e.value.error_message == "Timeout"
+
+            transport = httpx.ASGITransport(app=worker.app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://worker"
+            ) as client:
+                assert (await client.get("/xthing/slow")).status_code == 504
+            assert not bridge._pending
+
+    anyio.run(main)
+
+
+def test_worker_drops_frames_of_busy_slots():
+    worker = XThingsServer(role="worker", ipc_path="unused.sock")
+    relayed = MyXThing(service_type, service_name)
+    worker.add_xthing(relayed, "/xthing")
+    bridge = worker.worker_bridge
+    ring = SharedFrameRing(slots=2, slot_size=16, create=True)
+    bridge._rings[("/xthing", "png_stream")] = ring
+    message = {"thing": "/xthing", "stream": "png_stream", "index": 0}
+
+    async def main():
+        # a slow viewer still reads the slot the frame would be written to
+        relayed.png_stream._ringbuffer[0].readers_refcount = 1
+        ring.write(0, b"frame")
+        await bridge._deliver_frame(message)
+        assert bridge.dropped_frames == 1
+        # an overwritten frame is dropped too
+        ring.write(2, b"frame")
+        await bridge._deliver_frame(message)
+        assert bridge.dropped_frames == 2
+
+    try:
+        anyio.run(main)
+    finally:
+        ring.close()
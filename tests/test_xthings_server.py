@@ -1,6 +1,8 @@
 from fastapi.testclient import TestClient
 import pytest
 
+from xthings import xproperty
+from xthings.descriptors import XThingsDescriptor
 from xthings.server import XThingsServer
 from xthings.xthing import XThing
 
@@ -50,3 +52,30 @@ def test_xthings_server_add_xthing_twice():
         xthing = XThing(service_type, service_name)
         server.add_xthing(xthing, "/xthing")
         server.add_xthing(xthing, "/xthing")
+
+
+def test_xthings_server_descriptors():
+    class Base(XThing):
+        @xproperty(model=int)
+        def a(self) -> int:
+            return 1
+
+        @xproperty(model=int)
+        def b(self) -> int:
+            return 2
+
+    class Derived(Base):
+        b = 3
+
+    base = Base(service_type, service_name)
+    derived = Derived(service_type, service_name)
+    assert [n for n, _ in XThingsDescriptor.get_xthings_descriptors(base)] == [
+        "a",
+        "b",
+    ]
+    assert [n for n, _ in XThingsDescriptor.get_xthings_descriptors(derived)] == ["a"]
+
+    # the OpenAPI schema includes the XThings added after it was generated
+    assert "/xthing" in server.app.openapi()["paths"]
+    server.add_xthing(derived, "/derived")
+    assert "/derived/a" in server.app.openapi()["paths"]
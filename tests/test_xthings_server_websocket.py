@@ -1,7 +1,12 @@
 from fastapi.testclient import TestClient
 from xthings.server import XThingsServer
+from xthings.server.xthings_websocket import MAX_CONCURRENT_REQUESTS
 from xthings.xthing import XThing
+from xthings import xaction, xproperty
+from pydantic import StrictInt
 import pytest
+import threading
+import time
 from typing import Optional
 
 xthing: Optional[XThing]
@@ -87,3 +92,298 @@ def test_websocket_observe_KeyError():
             message = ws.receive_json(mode="text")
             assert message["status"] == "error"
             assert message["errorMessage"] == "BadKey"
+
+
+def test_websocket_remove_observation():
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/xthing/ws") as ws:
+            ws.send_json(
+                {"messageType": "addPropertyObservation", "data": {"foo": True}}
+            )
+            assert ws.receive_json(mode="text")["status"] == "success"
+            assert len(xthing.property_observers("foo")) == 1
+
+            ws.send_json(
+                {"messageType": "removePropertyObservation", "data": {"foo": True}}
+            )
+            assert ws.receive_json(mode="text")["status"] == "success"
+            assert xthing.property_observers("foo") == ()
+
+            ws.send_json({"messageType": "addActionObservation", "data": {"bar": 1}})
+            assert ws.receive_json(mode="text")["status"] == "success"
+            ws.send_json({"messageType": "removeActionObservation", "data": {"bar": 1}})
+            assert ws.receive_json(mode="text")["status"] == "success"
+            assert xthing.action_observers("bar") == ()
+
+
+def test_websocket_wildcard_observation():
+    other = XThing(service_type, service_name)
+    server.add_xthing(other, "/other")
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/xthing/ws") as ws:
+            ws.send_json({"messageType": "addPropertyObservation", "data": {"*": 1}})
+            assert ws.receive_json(mode="text")["status"] == "success"
+            assert len(xthing.property_observers("foo")) == 1
+            assert len(xthing.property_observers("bar")) == 1
+            # subscriptions belong to one XThing instance
+            assert other.property_observers("foo") == ()
+
+        # subscriptions are released when the client disconnects
+        for _ in range(100):
+            if len(xthing.subscriptions) == 0:
+                break
+            time.sleep(0.01)
+        assert len(xthing.subscriptions) == 0
+
+
+class CounterXThing(XThing):
+    _count: int = 0
+
+    @xproperty(model=int)
+    def count(self) -> int:
+        return self._count
+
+    @count.setter
+    def count(self, value: int):
+        self._count = value
+
+
+def test_multiplexed_websocket():
+    first = CounterXThing(service_type, service_name)
+    second = CounterXThing(service_type, service_name)
+    server.add_xthing(first, "/first")
+    server.add_xthing(second, "/second")
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            for path in ("/first", "/second"):
+                ws.send_json(
+                    {
+                        "thing": path,
+                        "messageType": "addPropertyObservation",
+                        "data": {"count": True},
+                    }
+                )
+                message = ws.receive_json(mode="text")
+                assert message["thing"] == path
+                assert message["status"] == "success"
+            assert len(first.property_observers("count")) == 1
+            assert len(second.property_observers("count")) == 1
+
+            client.put("/second/count", json=2)
+            client.put("/first/count", json=1)
+            assert ws.receive_json(mode="text") == {
+                "messageType": "propertyStatus",
+                "data": {"count": 2},
+                "thing": "/second",
+                "seq": second.event_log.last_id,
+            }
+            assert ws.receive_json(mode="text") == {
+                "messageType": "propertyStatus",
+                "data": {"count": 1},
+                "thing": "/first",
+                "seq": first.event_log.last_id,
+            }
+
+            ws.send_json({"thing": "/nothing", "messageType": "addActionObservation"})
+            message = ws.receive_json(mode="text")
+            assert message["errorMessage"] == "UnknownThing"
+
+            ws.send_json({"messageType": "addPropertyObservation", "data": {"x": 1}})
+            message = ws.receive_json(mode="text")
+            assert message["errorMessage"] == "UnknownThing"
+
+        # one disconnection releases the subscriptions to every XThing
+        for _ in range(100):
+            if len(first.subscriptions) == 0 and len(second.subscriptions) == 0:
+                break
+            time.sleep(0.01)
+        assert len(first.subscriptions) == 0
+        assert len(second.subscriptions) == 0
+
+
+class InteractionXThing(XThing):
+    _count: int = 0
+
+    @xproperty(model=int)
+    def count(self) -> int:
+        return self._count
+
+    @count.setter
+    def count(self, value: int):
+        self._count = value
+
+    @xproperty(model=str)
+    def slow(self) -> str:
+        time.sleep(0.2)
+        return "slow"
+
+    @xaction(input_model=StrictInt, output_model=StrictInt)
+    def increment(self, i: StrictInt, apn, cancellation_token, logger) -> StrictInt:
+        return i + 1
+
+
+class BlockedXThing(XThing):
+    unblocked = threading.Event()
+
+    @xproperty(model=int)
+    def blocked(self) -> int:
+        self.unblocked.wait(5)
+        return 1
+
+    @xproperty(model=int)
+    def unencodable(self) -> int:
+        return object()  # type: ignore[return-value]
+
+
+def test_websocket_interactions():
+    thing = InteractionXThing(service_type, service_name)
+    server.add_xthing(thing, "/thing")
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/thing/ws") as ws:
+            ws.send_json(
+                {
+                    "messageType": "writeProperty",
+                    "requestId": 1,
+                    "name": "count",
+                    "value": 3,
+                }
+            )
+            assert ws.receive_json(mode="text") == {"requestId": 1, "status": "success"}
+            assert thing._count == 3
+
+            ws.send_json(
+                {"messageType": "readProperty", "requestId": 2, "name": "count"}
+            )
+            assert ws.receive_json(mode="text") == {
+                "requestId": 2,
+                "value": 3,
+                "status": "success",
+            }
+
+            ws.send_json(
+                {
+                    "messageType": "readMultipleProperties",
+                    "requestId": 3,
+                    "names": ["slow", "count"],
+                }
+            )
+            message = ws.receive_json(mode="text")
+            assert message["values"] == {"slow": "slow", "count": 3}
+
+            ws.send_json(
+                {
+                    "messageType": "invokeAction",
+                    "requestId": 4,
+                    "name": "increment",
+                    "input": 1,
+                }
+            )
+            message = ws.receive_json(mode="text")
+            assert message["requestId"] == 4
+            assert message["status"] == "success"
+            assert message["invocation"]["action"] == "/thing/increment"
+            assert message["invocation"]["input"] == 1
+
+
+def test_websocket_interactions_are_concurrent():
+    thing = InteractionXThing(service_type, service_name)
+    server.add_xthing(thing, "/thing")
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            request = {"thing": "/thing", "messageType": "readProperty"}
+            ws.send_json({**request, "requestId": "slow", "name": "slow"})
+            ws.send_json({**request, "requestId": "fast", "name": "count"})
+            first = ws.receive_json(mode="text")
+            second = ws.receive_json(mode="text")
+            # the fast read does not wait for the slow one
+            assert (first["requestId"], second["requestId"]) == ("fast", "slow")
+            assert first["thing"] == "/thing"
+            assert second["value"] == "slow"
+
+
+def test_websocket_interaction_errors():
+    thing = InteractionXThing(service_type, service_name)
+    server.add_xthing(thing, "/thing")
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/thing/ws") as ws:
+            ws.send_json({"messageType": "readProperty", "requestId": 1, "name": "x"})
+            message = ws.receive_json(mode="text")
+            assert message["errorMessage"] == "UnknownAffordance"
+            assert message["name"] == "x"
+
+            ws.send_json(
+                {"messageType": "invokeAction", "requestId": 2, "name": "count"}
+            )
+            message = ws.receive_json(mode="text")
+            assert message["errorMessage"] == "UnknownAffordance"
+
+            ws.send_json(
+                {
+                    "messageType": "writeProperty",
+                    "requestId": 3,
+                    "name": "count",
+                    "value": "not a number",
+                }
+            )
+            message = ws.receive_json(mode="text")
+            assert message["requestId"] == 3
+            assert message["errorMessage"] == "ValidationError"
+            assert message["detail"][0]["type"] == "int_parsing"
+            assert thing._count == 0
+
+            ws.send_json({"messageType": "writeProperty", "requestId": 4})
+            message = ws.receive_json(mode="text")
+            assert message["errorMessage"] == "BadKey"
+
+
+def test_websocket_reply_errors():
+    thing = BlockedXThing(service_type, service_name)
+    server.add_xthing(thing, "/thing")
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/thing/ws") as ws:
+            ws.send_json(
+                {"messageType": "readProperty", "requestId": 1, "name": "unencodable"}
+            )
+            message = ws.receive_json(mode="text")
+            assert message["requestId"] == 1
+            assert message["status"] == "error"
+            assert message["errorMessage"] == "InteractionError"
+
+
+def test_websocket_requests_past_the_limit_are_refused():
+    thing = BlockedXThing(service_type, service_name)
+    server.add_xthing(thing, "/thing")
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/thing/ws") as ws:
+            try:
+                for i in range(MAX_CONCURRENT_REQUESTS + 1):
+                    ws.send_json(
+                        {
+                            "messageType": "readProperty",
+                            "requestId": i,
+                            "name": "blocked",
+                        }
+                    )
+                message = ws.receive_json(mode="text")
+                assert message["requestId"] == MAX_CONCURRENT_REQUESTS
+                assert message["errorMessage"] == "Busy"
+
+                # the receive loop is not blocked by the requests in flight
+                ws.send_json({"messageType": "ping"})
+                assert ws.receive_json(mode="text")["messageType"] == "pong"
+            finally:
+                thing.unblocked.set()
+            replies = [
+                ws.receive_json(mode="text") for _ in range(MAX_CONCURRENT_REQUESTS)
+            ]
+            assert {r["requestId"] for r in replies} == set(
+                range(MAX_CONCURRENT_REQUESTS)
+            )
+            assert all(r["value"] == 1 for r in replies)